@@ -1,12 +1,13 @@
-from flask import Flask,render_template, Response, request, send_from_directory
+from flask import Flask,render_template, Response, request, send_from_directory, redirect, jsonify, abort
 import sys
 # Tornado web server
 from tornado.wsgi import WSGIContainer
 from tornado.httpserver import HTTPServer
 import tornado.ioloop
-from tornado.ioloop import IOLoop
+import tornado.web
 from text2speech import T2S
 import os
+from tornado_handlers import JobEventsHandler, TTSStreamHandler
 
 t2s = T2S()
 speakers = [x for x in list(t2s.tt_sp_name_lookup.keys()) if "(Music)" not in x]
@@ -37,36 +38,98 @@ sample_textseg_len_target = 120
 
 use_localhost = t2s.conf['localhost']
 
+# job queue config
+job_queue_conf = t2s.conf.get('job_queue', {})
+use_job_queue = job_queue_conf.get('enabled', False)
+if use_job_queue:
+    from job_queue import TTSJobQueue
+    job_queue = TTSJobQueue(t2s, max_coalesce=job_queue_conf.get('max_coalesce', 8), max_finished_jobs=job_queue_conf.get('max_finished_jobs', 256),
+                            max_stream_chunks=job_queue_conf.get('max_stream_chunks', 16))
+
 # Initialize Flask.
 app = Flask(__name__)
 
+def parse_tts_form(result):
+    """Grab all the form inputs. Returns (text, infer_params, tt_current, wg_current)."""
+    assert result.get('input_text'), "No input_text found in request form!"
+    
+    text = result.get('input_text')
+    params = {
+        'speaker_names': result.getlist('input_speaker'),
+        'style_mode': result.get('input_style_mode'),
+        'textseg_mode': result.get('input_textseg_mode'),
+        'batch_mode': result.get('input_batch_mode'),
+        'max_attempts': int(result.get('input_max_attempts')) if result.get('input_max_attempts') else 256,
+        'max_duration_s': float(result.get('input_max_duration_s')),
+        'batch_size': int(result.get('input_batch_size')),
+        'dyna_max_duration_s': float(result.get('input_dyna_max_duration_s')),
+        'use_arpabet': True if result.get('input_use_arpabet') == "on" else False,
+        'target_score': float(result.get('input_target_score')),
+        'speaker_mode': result.get('input_multispeaker_mode'),
+        'cat_silence_s': float(result.get('input_cat_silence_s')),
+        'textseg_len_target': int(result.get('input_textseg_len_target')),
+    }
+    wg_current = result.get('input_wg_current')
+    tt_current = result.get('input_tt_current')
+    
+    # (Text) CRLF to LF
+    text = text.replace('\r\n','\n')
+    
+    # (Text) Max Lenght Limit
+    text = text[:int(max_input_length)]
+    return text, params, tt_current, wg_current
+
+def render_result(text, params, tt_current, wg_current, infer_output):
+    """Send updated webpage back to client along with page to the file."""
+    filenames, gen_time, gen_dur, total_specs, n_passes, avg_score = infer_output
+    return render_template('main.html',
+                            use_localhost=use_localhost,
+                            max_input_length=max_input_length,
+                            tacotron_conf=tacotron_conf,
+                            tt_current=tt_current,
+                            tt_len=len(tacotron_conf),
+                            waveglow_conf=waveglow_conf,
+                            wg_current=wg_current,
+                            wg_len=len(waveglow_conf),
+                            sp_len=len(speakers),
+                            speakers_available_short=[sp.split("_")[-1] for sp in speakers],
+                            speakers_available=speakers,
+                            current_text=text,
+                            voice=filenames,
+                            sample_text=sample_background_text,
+                            speaker=params['speaker_names'],
+                            style_mode=params['style_mode'],
+                            textseg_mode=params['textseg_mode'],
+                            batch_mode=params['batch_mode'],
+                            max_attempts=params['max_attempts'],
+                            max_duration_s=params['max_duration_s'],
+                            batch_size=params['batch_size'],
+                            dyna_max_duration_s=params['dyna_max_duration_s'],
+                            use_arpabet="on" if params['use_arpabet'] else None,
+                            target_score=params['target_score'],
+                            gen_time=round(gen_time,2),
+                            gen_dur=round(gen_dur,2),
+                            total_specs=total_specs,
+                            n_passes=n_passes,
+                            avg_score=round(avg_score,3),
+                            multispeaker_mode=params['speaker_mode'],
+                            cat_silence_s=params['cat_silence_s'],
+                            textseg_len_target=params['textseg_len_target'],)
+
 @app.route('/tts', methods=['GET', 'POST'])
 def texttospeech():
     if request.method == 'POST':
         print("REQUEST RECIEVED")
         # grab all the form inputs
         result = request.form
-        
-        assert result.get('input_text'), "No input_text found in request form!"
-        
-        speaker = result.getlist('input_speaker')
-        text = result.get('input_text')
-        style_mode = result.get('input_style_mode')
-        textseg_mode = result.get('input_textseg_mode')
-        batch_mode = result.get('input_batch_mode')
-        max_attempts = int(result.get('input_max_attempts')) if result.get('input_max_attempts') else 256
-        max_duration_s = float(result.get('input_max_duration_s'))
-        batch_size = int(result.get('input_batch_size'))
-        dyna_max_duration_s = float(result.get('input_dyna_max_duration_s'))
-        use_arpabet = True if result.get('input_use_arpabet') == "on" else False
-        target_score = float(result.get('input_target_score'))
-        multispeaker_mode = result.get('input_multispeaker_mode')
-        cat_silence_s = float(result.get('input_cat_silence_s'))
-        textseg_len_target = int(result.get('input_textseg_len_target'))
-        wg_current = result.get('input_wg_current')
-        tt_current = result.get('input_tt_current')
+        text, params, tt_current, wg_current = parse_tts_form(result)
         print(result)
         
+        if use_job_queue: # add to queue and send the client to the result page
+            job = job_queue.submit(text, params, tt_current, wg_current)
+            print(f"QUEUED {job.id}\n\n")
+            return redirect(f'/tts_result/{job.id}')
+        
         # update tacotron if needed
         if t2s.tt_current != tt_current:
             t2s.update_tt(tt_current)
@@ -75,50 +138,45 @@ def texttospeech():
         if t2s.wg_current != wg_current:
             t2s.update_wg(wg_current)
         
-        # (Text) CRLF to LF
-        text = text.replace('\r\n','\n')
-        
-        # (Text) Max Lenght Limit
-        text = text[:int(max_input_length)]
-        
         # generate an audio file from the inputs
-        filename, gen_time, gen_dur, total_specs, n_passes, avg_score = t2s.infer(text, speaker, style_mode, textseg_mode, batch_mode, max_attempts, max_duration_s, batch_size, dyna_max_duration_s, use_arpabet, target_score, multispeaker_mode, cat_silence_s, textseg_len_target)
-        print(f"GENERATED {filename}\n\n")
+        infer_output = t2s.infer(text, **params)
+        print(f"GENERATED {infer_output[0]}\n\n")
         
         # send updated webpage back to client along with page to the file
-        return render_template('main.html',
-                                use_localhost=use_localhost,
-                                max_input_length=max_input_length,
-                                tacotron_conf=tacotron_conf,
-                                tt_current=tt_current,
-                                tt_len=len(tacotron_conf),
-                                waveglow_conf=waveglow_conf,
-                                wg_current=wg_current,
-                                wg_len=len(waveglow_conf),
-                                sp_len=len(speakers),
-                                speakers_available_short=[sp.split("_")[-1] for sp in speakers],
-                                speakers_available=speakers,
-                                current_text=text,
-                                voice=filename,
-                                sample_text=sample_background_text,
-                                speaker=speaker,
-                                style_mode=style_mode,
-                                textseg_mode=textseg_mode,
-                                batch_mode=batch_mode,
-                                max_attempts=max_attempts,
-                                max_duration_s=max_duration_s,
-                                batch_size=batch_size,
-                                dyna_max_duration_s=dyna_max_duration_s,
-                                use_arpabet=result.get('input_use_arpabet'),
-                                target_score=target_score,
-                                gen_time=round(gen_time,2),
-                                gen_dur=round(gen_dur,2),
-                                total_specs=total_specs,
-                                n_passes=n_passes,
-                                avg_score=round(avg_score,3),
-                                multispeaker_mode=multispeaker_mode,
-                                cat_silence_s=cat_silence_s,
-                                textseg_len_target=textseg_len_target,)
+        return render_result(text, params, tt_current, wg_current, infer_output)
+
+#Route to submit a request to the job queue
+@app.route('/tts_job', methods=['POST'])
+def submit_job():
+    if not use_job_queue:
+        abort(404)
+    text, params, tt_current, wg_current = parse_tts_form(request.form)
+    job = job_queue.submit(text, params, tt_current, wg_current)
+    return jsonify(job_queue.status(job))
+
+#Route to poll the status of a queued job
+@app.route('/tts_job/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id) if use_job_queue else None
+    if job is None:
+        abort(404)
+    return jsonify(job_queue.status(job))
+
+#Route to show the result of a queued job (refreshes itself till the job has finished)
+@app.route('/tts_result/<job_id>', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.get(job_id) if use_job_queue else None
+    if job is None:
+        abort(404)
+    if job.status == 'done':
+        return render_result(job.text, job.params, job.tt_model, job.wg_model, job.result)
+    if job.status == 'failed':
+        return f"<html><body><p>Request failed: {job.error}</p><a href='/'>Back</a></body></html>", 500
+    if job.status == 'cancelled':
+        return f"<html><body><p>Request {job.id} was cancelled.</p><a href='/'>Back</a></body></html>"
+    status = job_queue.status(job)
+    state = f"position {status['position']+1} in queue" if job.status == 'queued' else "generating"
+    return f"<html><head><meta http-equiv='refresh' content='2'></head><body><p>Request {job.id} is {state}...</p></body></html>"
 
 #Route to render GUI
 @app.route('/')
@@ -177,7 +235,12 @@ def streammp3(voice):
 #launch a Tornado server with HTTPServer.
 if __name__ == "__main__":
     port = 5000
-    http_server = HTTPServer(WSGIContainer(app))
+    handlers = []
+    if use_job_queue:
+        handlers.append((r"/tts_job/([0-9a-f]+)/events", JobEventsHandler, dict(job_queue=job_queue)))
+        handlers.append((r"/tts_stream", TTSStreamHandler, dict(job_queue=job_queue, parse_form=parse_tts_form)))
+    handlers.append((r".*", tornado.web.FallbackHandler, dict(fallback=WSGIContainer(app))))
+    http_server = HTTPServer(tornado.web.Application(handlers))
     http_server.listen(port)
     io_loop = tornado.ioloop.IOLoop.current()
     io_loop.start()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class AudioCache:
+    """
+    On-disk LRU cache of generated segments (audio + best spectrogram), one .npz file per segment.
+    Keys are hashes of everything that affects the output (see make_key()), so the same text/speaker/models/settings
+    will reuse the first generated result instead of running Tacotron2 and WaveGlow again.
+    Least recently used files are deleted once the cache is larger than max_size_gb.
+    """
+    def __init__(self, directory, max_size_gb=2.0):
+        self.directory = directory
+        self.max_bytes = max_size_gb*1024**3
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # index existing files, least recently used first
+        self.entries = OrderedDict() # key -> size of file in bytes
+        files = [f for f in os.listdir(directory) if f.endswith('.npz') and not f.endswith('.tmp.npz')]
+        for f in sorted(files, key=lambda f: os.path.getmtime(os.path.join(directory, f))):
+            self.entries[f[:-4]] = os.path.getsize(os.path.join(directory, f))
+        self.nbytes = sum(self.entries.values())
+
+    @staticmethod
+    def make_key(*args):
+        """Hash of args (must be JSON serializable)."""
+        return hashlib.sha256(json.dumps(args, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key+'.npz')
+
+    def get(self, key):
+        """Returns dict with 'audio', 'audio_len', 'score', 'score_str' (and 'mel' if stored), or None if key isn't cached."""
+        with self.lock:
+            if key not in self.entries:
+                return None
+            try:
+                with np.load(self.path(key)) as data:
+                    out = {'audio': data['audio'], 'audio_len': int(data['audio_len']), 'score': float(data['score']), 'score_str': str(data['score_str'])}
+                    if 'mel' in data:
+                        out['mel'] = data['mel']
+            except (OSError, ValueError, KeyError): # file deleted or corrupted, forget it
+                self.nbytes -= self.entries.pop(key)
+                return None
+            os.utime(self.path(key)) # update mtime so LRU order survives restarts
+            self.entries.move_to_end(key)
+            return out
+
+    def put(self, key, audio, audio_len, score, score_str, mel=None):
+        """Save a segment to the cache, then delete the least recently used segments if over max_size_gb."""
+        data = {'audio': audio, 'audio_len': np.int64(audio_len), 'score': np.float64(score), 'score_str': np.array(score_str)}
+        if mel is not None:
+            data['mel'] = mel
+        with self.lock:
+            tmp_path = self.path(key)+'.tmp.npz'
+            np.savez(tmp_path, **data)
+            os.replace(tmp_path, self.path(key)) # (so a crash can't leave a partially written file)
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)
+            self.entries[key] = os.path.getsize(self.path(key))
+            self.nbytes += self.entries[key]
+
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                old_key, size = self.entries.popitem(last=False)
+                self.nbytes -= size
+                try:
+                    os.remove(self.path(old_key))
+                except OSError:
+                    pass
@@ -0,0 +1,73 @@
+import os
+import struct
+import subprocess
+
+
+def wav_header(sampling_rate, n_channels=1, bits_per_sample=16, n_samples=None):
+    """
+    Returns the 44 byte header of a PCM .wav file.
+    If n_samples is None the RIFF/data sizes are set to 0xFFFFFFFF so the header can be sent
+    before the length of the audio is known (e.g. when streaming segments as they're generated).
+    """
+    block_align = n_channels * bits_per_sample//8
+    byte_rate = sampling_rate * block_align
+    if n_samples is None:
+        data_size = riff_size = 0xFFFFFFFF
+    else:
+        data_size = n_samples * block_align
+        riff_size = min(36 + data_size, 0xFFFFFFFF)
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', riff_size, b'WAVE',
+                       b'fmt ', 16, 1, n_channels, sampling_rate, byte_rate, block_align, bits_per_sample,
+                       b'data', data_size)
+
+
+class AudioFileWriter:
+    """
+    Appends int16 audio to a single output file as it's generated.
+    .wav files are written directly (header is patched with the final length on close()),
+    other formats (e.g. .flac) are encoded with soundfile if installed, else the
+    audio is written to a temp .wav and converted with a single sox call on close().
+    """
+    def __init__(self, path, sampling_rate, tmp_dir=None):
+        self.path = path
+        self.sampling_rate = sampling_rate
+        self.n_samples = 0
+        self.sf_file = None
+        self.tmp_path = None
+        
+        ext = os.path.splitext(path)[1].lower()
+        if ext != '.wav':
+            try:
+                import soundfile as sf
+                self.sf_file = sf.SoundFile(path, mode='w', samplerate=sampling_rate, channels=1, subtype='PCM_16')
+            except (ImportError, OSError, RuntimeError): # no soundfile or libsndfile doesn't support this format
+                self.tmp_path = os.path.join(tmp_dir or os.path.dirname(path), os.path.basename(path)+'.tmp.wav')
+        if self.sf_file is None:
+            self.file = open(self.tmp_path or path, 'wb')
+            self.file.write(wav_header(sampling_rate)) # placeholder, sizes are filled in by close()
+    
+    @property
+    def nbytes(self):
+        return self.n_samples*2
+    
+    def write(self, audio):
+        """audio: 1D int16 numpy array"""
+        if self.sf_file is not None:
+            self.sf_file.write(audio)
+        else:
+            self.file.write(audio.astype('<i2').tobytes())
+        self.n_samples += audio.shape[0]
+    
+    def close(self):
+        if self.sf_file is not None:
+            self.sf_file.close()
+            return
+        self.file.seek(0)
+        self.file.write(wav_header(self.sampling_rate, n_samples=self.n_samples))
+        self.file.close()
+        if self.tmp_path is not None: # convert to the requested format
+            # argument list (no shell) since the filename comes from the request, abspath so a name starting with '-' isn't read as an option
+            subprocess.run(['sox', os.path.abspath(self.tmp_path), '-b', '16', os.path.abspath(self.path)], check=True)
+            assert os.path.exists(self.path), f"'{self.path}' failed to generate."
+            os.remove(self.tmp_path)
@@ -0,0 +1,98 @@
+import array
+import os
+import queue
+import sys
+import threading
+from types import SimpleNamespace
+import pytest
+
+# tests import the repo's flat modules (model.py, text2speech.py, ...) directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def decoder_hparams():
+    """Returns a function that makes hparams for a tiny Tacotron2 Decoder (kwargs override the defaults)."""
+    def make_hparams(**overrides):
+        hparams = dict(
+            n_mel_channels=16, n_frames_per_step=1, encoder_LSTM_dim=32, token_embedding_size=0, speaker_embedding_dim=0,
+            attention_rnn_dim=32, decoder_rnn_dim=32, prenet_dim=16, prenet_layers=2, p_prenet_dropout=0.0, # (Prenet dropout is also used at inference)
+            max_decoder_steps=64, gate_threshold=0.9, gate_delay=0,
+            AttRNN_extra_decoder_input=False, AttRNN_hidden_dropout_type='dropout', p_AttRNN_hidden_dropout=0.0, p_AttRNN_cell_dropout=0.0,
+            DecRNN_hidden_dropout_type='dropout', p_DecRNN_hidden_dropout=0.0, p_DecRNN_cell_dropout=0.0,
+            p_teacher_forcing=1.0, teacher_force_till=0, num_att_mixtures=1, extra_projection=False,
+            normalize_attention_input=False, normalize_AttRNN_output=False, attention_type=0, attention_layers=1,
+            attention_dim=24, attention_location_n_filters=8, attention_location_kernel_size=31,
+            dynamic_filter_num=4, dynamic_filter_len=21, context_frames=1, hide_startstop_tokens=False)
+        hparams.update(overrides)
+        return SimpleNamespace(**hparams)
+    return make_hparams
+
+
+@pytest.fixture
+def tacotron2_hparams(decoder_hparams):
+    """Returns a function that makes hparams for a tiny Tacotron2 (kwargs override the defaults)."""
+    def make_hparams(**overrides):
+        hparams = dict(
+            n_symbols=40, symbols_embedding_dim=16, n_speakers=4, speaker_embedding_dim=8,
+            encoder_speaker_embed_dim=0, encoder_concat_speaker_embed='before_conv', encoder_n_convolutions=2, encoder_conv_hidden_dim=16, encoder_kernel_size=5,
+            postnet_embedding_dim=16, postnet_kernel_size=5, postnet_n_convolutions=3,
+            mask_padding=True, fp16_run=False, with_gst=False, token_num=5, drop_tokens_mode=None, torchMoji_training=False, torchMoji_linear=False, drop_frame_rate=0.0)
+        hparams.update(overrides)
+        return decoder_hparams(**hparams)
+    return make_hparams
+
+
+@pytest.fixture
+def tiny_tacotron2(tacotron2_hparams):
+    """Returns a function that makes a randomly initialized tiny Tacotron2 (in eval mode, on the CPU)."""
+    def make_model(seed=1234, **overrides):
+        from model import load_model
+        torch = pytest.importorskip("torch")
+        torch.manual_seed(seed)
+        return load_model(tacotron2_hparams(**overrides), device='cpu').eval()
+    return make_model
+
+
+class StubT2S:
+    """Stands in for T2S in the job queue (no models). Every infer()/infer_stream() call waits for a token in self.release."""
+    def __init__(self, n_segments=3):
+        self.tt_current, self.wg_current = 'tt', 'wg'
+        self.n_segments = n_segments # segments infer_stream() generates per request
+        self.calls = [] # (texts, params) of every infer()/infer_stream() call
+        self.started = queue.Queue() # texts of each call once it has started
+        self.release = queue.Queue()
+        self.n_yielded = 0
+        self.stream_closed = threading.Event()
+
+    def update_tt(self, tt_model):
+        self.tt_current = tt_model
+
+    def update_wg(self, wg_model):
+        self.wg_current = wg_model
+
+    def _start(self, texts, params):
+        self.calls.append((texts, params))
+        self.started.put(texts)
+        self.release.get(timeout=10)
+        if 'fail' in texts:
+            raise ValueError("stub failure")
+
+    def infer(self, texts, filename_prefix, **params):
+        self._start(texts, params)
+        return [(f"{prefix}.wav", 1.0, 2.0, 3, 1, 0.5) for prefix in filename_prefix]
+
+    def infer_stream(self, texts, **params):
+        try:
+            self._start(texts, params)
+            for i in range(self.n_segments):
+                for request in range(len(texts)):
+                    self.n_yielded += 1
+                    yield {'request': request, 'segment': i, 'audio': array.array('h', [request*100+i]*4), 'sampling_rate': 8000}
+        finally:
+            self.stream_closed.set()
+
+
+@pytest.fixture
+def stub_t2s():
+    return StubT2S()
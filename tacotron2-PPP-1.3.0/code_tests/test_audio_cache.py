@@ -0,0 +1,68 @@
+import pytest
+np = pytest.importorskip("numpy")
+
+from audio_cache import AudioCache
+
+# same arguments (in the same order) as T2S.infer_stream() passes to make_key()
+SETTINGS = {
+    'tacotron': "Tacotron2 A",
+    'waveglow': "WaveGlow A",
+    'speaker': "Twilight Sparkle",
+    'text': "Hello there.",
+    'use_arpabet': True,
+    'style_mode': 'torchmoji_hidden',
+    'target_score': 0.75,
+    'max_attempts': 64,
+    'absolute_maximum_tries': 4096,
+    'absolutely_required_score': -1e3,
+    'max_duration_s': 12.0,
+    'dyna_max_duration_s': 0.125,
+    'gate_delay': 4,
+    'gate_threshold': 0.6,
+    'end_mode': 'thresh',
+    'cat_silence_s': 0.1,
+}
+CHANGED = {
+    'tacotron': "Tacotron2 B",
+    'waveglow': "WaveGlow B",
+    'speaker': "Rarity",
+    'text': "Hello there!",
+    'use_arpabet': False,
+    'style_mode': 'zeros',
+    'target_score': 0.5,
+    'max_attempts': 32,
+    'absolute_maximum_tries': 2048,
+    'absolutely_required_score': -1e2,
+    'max_duration_s': 6.0,
+    'dyna_max_duration_s': 0.25,
+    'gate_delay': 2,
+    'gate_threshold': 0.5,
+    'end_mode': 'max',
+    'cat_silence_s': 0.0,
+}
+
+
+def test_key_is_deterministic():
+    assert AudioCache.make_key(*SETTINGS.values()) == AudioCache.make_key(*SETTINGS.values())
+
+
+@pytest.mark.parametrize('name', SETTINGS.keys())
+def test_key_changes_with_every_setting(name):
+    assert AudioCache.make_key(*{**SETTINGS, name: CHANGED[name]}.values()) != AudioCache.make_key(*SETTINGS.values())
+
+
+def test_key_depends_on_argument_order():
+    a, b = AudioCache.make_key("speaker", "text"), AudioCache.make_key("text", "speaker")
+    assert a != b
+
+
+def test_put_get_roundtrip(tmp_path):
+    cache = AudioCache(str(tmp_path), max_size_gb=1.0)
+    key = AudioCache.make_key(*SETTINGS.values())
+    assert cache.get(key) is None
+    audio = np.arange(100, dtype=np.int16)
+    cache.put(key, audio, 100, -0.5, "score -0.5")
+    out = cache.get(key)
+    assert np.array_equal(out['audio'], audio)
+    assert out['audio_len'] == 100 and out['score'] == -0.5 and out['score_str'] == "score -0.5"
+    assert AudioCache(str(tmp_path)).get(key) is not None # existing files are indexed on startup
@@ -0,0 +1,41 @@
+import struct
+import wave
+import pytest
+np = pytest.importorskip("numpy")
+
+from audio_writer import AudioFileWriter, wav_header
+
+
+def test_wav_header_patched_on_close(tmp_path):
+    """The placeholder header written on open is replaced with the real RIFF/data sizes on close()."""
+    path = str(tmp_path/'out.wav')
+    chunks = [np.arange(-500, 500, dtype=np.int16), np.full(1234, 7, dtype=np.int16)]
+    
+    writer = AudioFileWriter(path, 22050)
+    for chunk in chunks:
+        writer.write(chunk)
+    writer.close()
+    
+    n_samples = sum(len(chunk) for chunk in chunks)
+    with open(path, 'rb') as f:
+        data = f.read()
+    riff_size, = struct.unpack('<I', data[4:8])
+    data_size, = struct.unpack('<I', data[40:44])
+    assert data[:44] == wav_header(22050, n_samples=n_samples)
+    assert riff_size == len(data)-8
+    assert data_size == n_samples*2 == len(data)-44
+    
+    with wave.open(path, 'rb') as f:
+        assert f.getframerate() == 22050
+        assert f.getnchannels() == 1
+        assert f.getsampwidth() == 2
+        assert f.getnframes() == n_samples
+        audio = np.frombuffer(f.readframes(n_samples), dtype='<i2')
+    assert (audio == np.concatenate(chunks)).all()
+
+
+def test_streaming_header_has_unknown_size():
+    header = wav_header(48000)
+    assert len(header) == 44
+    assert struct.unpack('<I', header[4:8])[0] == 0xFFFFFFFF
+    assert struct.unpack('<I', header[40:44])[0] == 0xFFFFFFFF
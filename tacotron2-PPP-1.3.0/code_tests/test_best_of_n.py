@@ -0,0 +1,203 @@
+from collections import Counter
+import pytest
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("nltk")
+pytest.importorskip("unidecode")
+
+from text2speech import BestOfNSampler, alignment_metric, get_first_over_thresh, score_alignments
+
+TEXT_LENGTHS = [12, 9, 5]
+STOP_AFTER = [99, 20, 9] # decoder steps (roughly) before the gate of each text goes over 0.9, see stopping_tacotron2()
+
+
+def make_sampler(cls=BestOfNSampler, text_lengths=TEXT_LENGTHS, target_score=2.0, max_attempts=3, absolute_maximum_tries=5, absolutely_required_score=-9e9, max_decoder_steps=40, **kwargs):
+    """Defaults never reach target_score, so every text gets exactly max_attempts attempts."""
+    return cls(torch.tensor(text_lengths), target_score, max_attempts, absolute_maximum_tries, absolutely_required_score, max_decoder_steps, 0.9, **kwargs)
+
+
+def test_next_text_least_attempts_first():
+    sampler = make_sampler(max_attempts=2)
+    order = [sampler.next_text() for _ in range(7)]
+    assert order == [0, 1, 2, 0, 1, 2, None]
+    assert sampler.in_progress.tolist() == [2, 2, 2]
+
+    # aborted attempts still count as tries, so nothing is handed out again
+    sampler.add_aborted(torch.tensor([1, 1]))
+    assert sampler.tries.tolist() == [0, 2, 0] and sampler.in_progress.tolist() == [2, 0, 2]
+    assert sampler.n_aborted == 2
+    assert sampler.next_text() is None
+
+
+def test_is_done():
+    sampler = make_sampler(target_score=0.5, max_attempts=2, absolute_maximum_tries=4, absolutely_required_score=0.2)
+    assert not sampler.is_done(0)
+    sampler.best_score[0] = 0.6 # reached target_score
+    assert sampler.is_done(0)
+    sampler.best_score[1], sampler.tries[1] = 0.0, 2 # max_attempts reached but the score is below absolutely_required_score-1 ...
+    assert sampler.is_done(1)
+    sampler.best_score[1] = -0.9 # ... is only required to be over absolutely_required_score-1
+    assert not sampler.is_done(1)
+    sampler.tries[1] = 4 # absolute_maximum_tries
+    assert sampler.is_done(1)
+
+
+def test_next_text_retries_texts_under_required_score():
+    sampler = make_sampler(max_attempts=1, absolute_maximum_tries=3, absolutely_required_score=0.5)
+    sampler.best_score[:] = [0.9, -0.9, 0.9] # text 1 is under absolutely_required_score-1
+    sampler.tries[:] = 1
+    sampler.text_queue = [(1, 0), (1, 1), (1, 2)]
+    assert [sampler.next_text() for _ in range(3)] == [1, 1, None]
+
+
+def test_doomed():
+    sampler = make_sampler(max_decoder_steps=10)
+    sampler.best_score[:] = [0.9, -9e9, 0.9]
+    row_text = torch.tensor([0, 1, 2, 2])
+    dist = torch.tensor([1.0, 1.0, 1.0, 100.0]) # last row has wandered far too much to finish above 0.9
+    max_focus = torch.tensor([1.0, 1.0, 1.0, 1.0])
+    assert sampler.doomed(row_text, torch.tensor([5, 5, 5, 5]), dist, max_focus).tolist() == [False, False, False, True]
+    max_focus[0] = 100.0 # stuck on one encoder output
+    assert sampler.doomed(row_text, torch.tensor([5, 5, 5, 5]), dist, max_focus).tolist() == [True, False, False, True]
+    sampler.tries[1] = sampler.absolute_maximum_tries # text is done, remaining attempts aren't needed
+    assert sampler.doomed(row_text, torch.tensor([5, 5, 5, 5]), dist, max_focus).tolist() == [True, True, False, True]
+
+
+class RecordingSampler(BestOfNSampler):
+    """Checks the sampler's bookkeeping against the rows inference_pool() is actually decoding."""
+    def __init__(self, *args, abort=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.abort = abort # (optional) replaces doomed()'s decision
+        self.handed_out = Counter()
+        self.results = [] # (text_index, mel, gate, alignment)
+        self.aborted = Counter()
+
+    def check_consistent(self, row_text=None):
+        n_texts = len(self.tries)
+        assert (self.tries + self.in_progress).tolist() == [self.handed_out[j] for j in range(n_texts)]
+        assert self.tries.tolist() == [sum(j == r[0] for r in self.results) + self.aborted[j] for j in range(n_texts)]
+        if row_text is not None: # every running row is counted once in in_progress
+            assert self.in_progress.tolist() == [Counter(row_text.tolist())[j] for j in range(n_texts)]
+
+    def next_text(self):
+        j = super().next_text()
+        if j is not None:
+            self.handed_out[j] += 1
+        self.check_consistent()
+        return j
+
+    def doomed(self, row_text, n_frames, dist, max_focus):
+        self.check_consistent(row_text)
+        if self.abort is not None:
+            return self.abort(row_text, n_frames)
+        return super().doomed(row_text, n_frames, dist, max_focus)
+
+    def add_aborted(self, row_text):
+        super().add_aborted(row_text)
+        self.aborted.update(row_text.tolist())
+        self.check_consistent()
+
+    def add_results(self, row_text, lengths, mels, gates, alignments):
+        for k, j in enumerate(row_text.tolist()):
+            l = int(lengths[k])
+            self.results.append((j, mels[k, :, :l].clone(), gates[k, :l].clone(), alignments[k, :l].clone()))
+        super().add_results(row_text, lengths, mels, gates, alignments)
+        self.check_consistent()
+
+
+def stopping_tacotron2(tiny_tacotron2):
+    """
+    Tiny Tacotron2 whose gate rises with the decoder step (a random model's gates barely move, so nothing would finish early).
+    Unit 0 of the decoder LSTM counts the steps and each speaker's embedding sets the step it's gate crosses the threshold.
+    """
+    model = tiny_tacotron2()
+    rnn, gate = model.decoder.decoder_rnn, model.decoder.gate_layer.linear_layer
+    H = rnn.hidden_size
+    with torch.no_grad():
+        for k in range(4): # input, forget, cell and output gate rows of unit 0
+            rnn.weight_ih[k*H].zero_()
+            rnn.weight_hh[k*H].zero_()
+            rnn.bias_ih[k*H], rnn.bias_hh[k*H] = 20.0, 0.0
+        rnn.bias_ih[2*H] = 0.02 # cell of unit 0 grows by ~0.02 every step
+        gate.weight.zero_()
+        gate.bias.zero_()
+        gate.weight[0, 0] = 50.0
+        gate.weight[0, -model.speaker_embedding_dim] = -50.0 # (the last channels of the attention context are the speaker embedding)
+        model.speaker_embedding.weight[:len(STOP_AFTER), 0] = torch.tanh(torch.tensor(STOP_AFTER)*0.02)
+    return model
+
+
+def inputs():
+    torch.manual_seed(1234)
+    text_lengths = torch.tensor(TEXT_LENGTHS)
+    text = torch.randint(1, 40, (len(TEXT_LENGTHS), max(TEXT_LENGTHS))) * (torch.arange(max(TEXT_LENGTHS))[None, :] < text_lengths[:, None])
+    return text, torch.tensor([0, 1, 2]), text_lengths
+
+
+def reference_outputs(model, max_decoder_steps=40):
+    """Plain inference() of every text (the tiny model has no dropout at inference, so every attempt of a text is the same)."""
+    text, speaker_ids, text_lengths = inputs()
+    with torch.no_grad():
+        mel, _, gate, alignments = model.inference(text, speaker_ids, text_lengths=text_lengths, run_postnet=False, return_alignments=True, max_decoder_steps=max_decoder_steps, gate_threshold=0.9)
+    output_lengths = get_first_over_thresh(gate, 0.9)
+    alignments = alignments.float()
+    scores = score_alignments(*alignment_metric(alignments.clone(), input_lengths=text_lengths, output_lengths=output_lengths, to_cpu=False)) # (alignment_metric() masks it's input in-place)
+    return mel, gate, alignments, scores
+
+
+def run_pool(model, sampler, batch_size, max_decoder_steps=40):
+    text, speaker_ids, text_lengths = inputs()
+    with torch.no_grad():
+        model.inference_pool(text, speaker_ids, sampler, batch_size, text_lengths=text_lengths, max_decoder_steps=max_decoder_steps, gate_threshold=0.9)
+    sampler.check_consistent()
+    assert sampler.in_progress.tolist() == [0, 0, 0]
+
+
+def check_results_match_reference(sampler, reference):
+    """Each finished attempt must be a decode of the text it was reported for (rows were refilled with the right text)."""
+    mel, gate, alignments, _ = reference
+    for j, r_mel, r_gate, r_alignment in sampler.results:
+        T = r_gate.size(0)
+        assert T <= gate.size(1)
+        assert torch.allclose(r_mel, mel[j, :, :T], atol=1e-4)
+        assert torch.allclose(r_gate, gate[j, :T], atol=1e-4)
+        assert torch.allclose(r_alignment, alignments[j, :T], atol=1e-3) # (alignments are stored in fp16)
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 5, 12])
+def test_inference_pool_matches_inference_without_abort(tiny_tacotron2, batch_size):
+    model = stopping_tacotron2(tiny_tacotron2)
+    reference = reference_outputs(model)
+    sampler = make_sampler(RecordingSampler, abort=lambda row_text, n_frames: torch.zeros(len(row_text), dtype=torch.bool), check_interval=4)
+    run_pool(model, sampler, batch_size)
+
+    assert sampler.tries.tolist() == [3, 3, 3]
+    assert sampler.n_aborted == 0
+    assert len({r[2].size(0) for r in sampler.results}) == 3 # (texts finished at different steps, so rows were refilled/compacted mid-batch)
+    check_results_match_reference(sampler, reference)
+    assert np.allclose(sampler.best_score, reference[3][:, 2].numpy(), atol=1e-4)
+    for j, generation in enumerate(sampler.best_generations):
+        assert torch.allclose(generation[0][0], reference[0][j, :, :generation[0].size(2)], atol=1e-4)
+
+
+def test_inference_pool_refills_aborted_rows(tiny_tacotron2):
+    model = stopping_tacotron2(tiny_tacotron2)
+    reference = reference_outputs(model)
+
+    # abort the first two attempts of text 0 after a few frames, the rows must be refilled with attempts of the texts that still need them
+    n_to_abort = [2]
+    def abort(row_text, n_frames):
+        aborted = torch.zeros(len(row_text), dtype=torch.bool)
+        for k, (j, n) in enumerate(zip(row_text.tolist(), n_frames.tolist())):
+            if j == 0 and n >= 5 and n_to_abort[0] > 0:
+                aborted[k] = True
+                n_to_abort[0] -= 1
+        return aborted
+    sampler = make_sampler(RecordingSampler, abort=abort, check_interval=1)
+    run_pool(model, sampler, 2)
+
+    assert sampler.aborted == Counter({0: 2})
+    assert sampler.n_aborted == 2
+    assert sampler.tries.tolist() == [3, 3, 3]
+    assert Counter(r[0] for r in sampler.results) == Counter({0: 1, 1: 3, 2: 3})
+    check_results_match_reference(sampler, reference)
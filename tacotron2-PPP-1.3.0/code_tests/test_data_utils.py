@@ -0,0 +1,113 @@
+import os
+from types import SimpleNamespace
+import pytest
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("librosa")
+
+from data_utils import TextMelLoader
+
+
+def make_hparams(**overrides):
+    hparams = dict(
+        text_cleaners=['basic_cleaners'], start_token="", stop_token="",
+        max_wav_value=32768.0, sampling_rate=16000, load_mel_from_disk=True,
+        filter_length=64, hop_length=16, win_length=64, n_mel_channels=8, mel_fmin=0.0, mel_fmax=8000.0,
+        truncated_length=20, batch_size=2, val_batch_size=2, n_gpus=1, rank=0, seed=1234,
+        use_TBPTT=True, use_dataset_manifest=True, torchMoji_training=False, torchMoji_linear=False,
+    )
+    hparams.update(overrides)
+    return SimpleNamespace(**hparams)
+
+
+@pytest.fixture
+def filelist(tmp_path):
+    """Filelist with good files and every kind of file checkdataset() should drop."""
+    def mel(name, n_frames):
+        path = tmp_path/name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.save(path, np.random.randn(8, n_frames).astype(np.float32))
+        return str(path)
+    corrupt = tmp_path/"corrupt.npy"
+    corrupt.write_bytes(b"not a npy file")
+    lines = [
+        [mel("a.npy", 30), "Hello there.", "0"],
+        [mel("b.npy", 45), "General Kenobi!", "1"],
+        [mel("Songs/c.npy", 25), "la la la.", "1"],
+        [mel("d.npy", 33), "No ending punctuation", "0"],
+        [str(tmp_path/"missing.npy"), "This file doesn't exist.", "0"],
+        [mel("empty_text.npy", 20), "", "0"],
+        [mel("zero_length.npy", 0), "Nothing here.", "0"],
+        [str(corrupt), "Corrupt file.", "0"],
+        [mel("banned.npy", 20), "[banned] text.", "1"],
+        [str(tmp_path/"wav_file.wav"), "Expecting npy files.", "1"],
+    ]
+    path = tmp_path/"filelist.txt"
+    path.write_text("\n".join("|".join(line) for line in lines), encoding='utf-8')
+    return str(path)
+
+
+def test_manifest_skips_lengths_without_TBPTT(filelist, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("spectrogram lengths shouldn't be read without TBPTT")
+    monkeypatch.setattr(TextMelLoader, 'get_mel_length', fail)
+    monkeypatch.setattr(TextMelLoader, 'get_mel', fail)
+    dataset = TextMelLoader(filelist, make_hparams(use_TBPTT=False))
+    manifest = np.load(filelist+'.manifest.npz')
+    assert 'mel_lengths' not in manifest
+    assert 'torchmoji_paths' not in manifest # (derived from the audiopath by get_torchmoji_path(), not worth storing)
+    assert dataset.mel_lengths == {}
+
+    reloaded = TextMelLoader(filelist, make_hparams(use_TBPTT=False))
+    assert sorted(reloaded.audiopaths_and_text) == sorted(dataset.audiopaths_and_text)
+
+
+def test_manifest_is_rebuilt_when_TBPTT_needs_lengths(filelist):
+    TextMelLoader(filelist, make_hparams(use_TBPTT=False))
+    dataset = TextMelLoader(filelist, make_hparams(use_TBPTT=True))
+    assert {os.path.basename(k): v for k, v in dataset.mel_lengths.items()} == {'a.npy': 30, 'b.npy': 45, 'c.npy': 25, 'd.npy': 33}
+    assert 'mel_lengths' in np.load(filelist+'.manifest.npz')
+
+    reloaded = TextMelLoader(filelist, make_hparams(use_TBPTT=True))
+    assert reloaded.mel_lengths == dataset.mel_lengths
+    assert sorted(reloaded.audio_lengths.tolist()) == sorted(dataset.audio_lengths.tolist())
+
+
+def test_TBPTT_argument_disables_length_prediction(filelist):
+    dataset = TextMelLoader(filelist, make_hparams(use_TBPTT=True), TBPTT=False)
+    assert not dataset.use_TBPTT
+    assert (dataset.audio_lengths == dataset.truncated_length-1).all()
+
+
+def test_manifest_is_off_by_default():
+    pytest.importorskip("tensorflow") # (hparams.py uses tf.contrib.training.HParams)
+    from hparams import create_hparams
+    assert not create_hparams().use_dataset_manifest
+
+
+def check_files(filelist, **overrides):
+    dataset = TextMelLoader(filelist, make_hparams(use_dataset_manifest=False, **overrides), check_files=True)
+    return sorted(dataset.audiopaths_and_text), sorted(dataset.audio_lengths.tolist())
+
+
+def test_checkdataset_drops_bad_files(filelist):
+    files, lengths = check_files(filelist)
+    assert sorted(os.path.basename(x[0]) for x in files) == ['a.npy', 'b.npy', 'c.npy', 'd.npy']
+    assert lengths == [25, 30, 33, 45]
+
+
+def test_checkdataset_same_result_with_and_without_cache(filelist):
+    cache_path = filelist+'.checkcache.json'
+    uncached = check_files(filelist)
+    assert os.path.exists(cache_path)
+    assert check_files(filelist) == uncached # everything from the cache
+
+    # files that changed since they were cached are checked again
+    b_path = [x[0] for x in uncached[0] if x[0].endswith('b.npy')][0]
+    np.save(b_path, np.zeros((8, 0), dtype=np.float32))
+    os.utime(b_path, (0, 0))
+    os.remove([x[0] for x in uncached[0] if x[0].endswith('a.npy')][0])
+    cached = check_files(filelist)
+    os.remove(cache_path)
+    assert cached == check_files(filelist)
+    assert sorted(os.path.basename(x[0]) for x in cached[0]) == ['c.npy', 'd.npy']
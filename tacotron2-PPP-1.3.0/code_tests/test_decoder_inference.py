@@ -0,0 +1,194 @@
+import pytest
+torch = pytest.importorskip("torch")
+
+import torch.nn.functional as F
+from model import Decoder
+
+
+def run_inference(hparams, seed=1234, **kwargs):
+    torch.manual_seed(seed)
+    decoder = Decoder(hparams).eval()
+    memory = torch.randn(3, 20, hparams.encoder_LSTM_dim)
+    memory_lengths = torch.tensor([20, 14, 7])
+    with torch.no_grad():
+        return decoder.inference(memory, memory_lengths, n_repeats=2, **kwargs)
+
+
+@pytest.mark.parametrize('overrides', [{'inference_alignments': 'none'}, {'low_vram_inference': True}])
+def test_inference_without_alignments(decoder_hparams, overrides):
+    mel_outputs, gate_outputs, alignments = run_inference(decoder_hparams(**overrides))
+    assert alignments is None
+    assert mel_outputs.shape[:2] == (6, 16)
+    assert gate_outputs.shape == (6, mel_outputs.size(2))
+
+
+@pytest.mark.parametrize('overrides', [{'inference_alignments': 'none'}, {'low_vram_inference': True}])
+def test_inference_return_alignments_overrides_none(decoder_hparams, overrides):
+    """T2S scores every candidate, so it must still get alignments when they're turned off in the hparams."""
+    mel_full, gate_full, align_full = run_inference(decoder_hparams(inference_alignments='full'))
+    mel_none, gate_none, align_none = run_inference(decoder_hparams(**overrides), return_alignments=True)
+    assert align_none is not None
+    assert align_none.shape == align_full.shape == (6, mel_full.size(2), 20)
+    assert torch.allclose(mel_none, mel_full)
+    assert torch.allclose(gate_none, gate_full)
+    assert torch.allclose(align_none.float(), align_full, atol=1e-3) # (stored in fp16)
+
+
+def test_dynamic_convolution_attention_prior_filter_follows_model(decoder_hparams):
+    """prior_filter is a (non-persistent) buffer, so DCA runs wherever the model is moved to and isn't expected in checkpoints."""
+    torch.manual_seed(1234)
+    decoder = Decoder(decoder_hparams(attention_type=2)).eval()
+    assert any(name.endswith('prior_filter') for name, _ in decoder.named_buffers())
+    assert not any('prior_filter' in k for k in decoder.state_dict().keys())
+    mel_outputs, gate_outputs, alignments = run_inference(decoder_hparams(attention_type=2), return_alignments=True)
+    assert mel_outputs.shape[:2] == (6, 16)
+    assert torch.isfinite(mel_outputs).all()
+
+
+def monotonic_attention_decoder(hparams):
+    """Decoder whose attention moves forward one encoder position per step, starting at position 0."""
+    torch.manual_seed(1234)
+    decoder = Decoder(hparams).eval()
+    attention = decoder.attention_layer
+    with torch.no_grad():
+        for layer in (attention.query_layer, attention.memory_layer, attention.location_layer.location_dense):
+            layer.linear_layer.weight.zero_()
+        attention.memory_layer.linear_layer.weight[:, 0] = 1.0 # (memory feature 0 marks the start of the input)
+        conv = attention.location_layer.location_conv.conv
+        conv.weight.zero_()
+        conv.weight[0, 0, conv.padding[0]-1] = 10.0 # previous attention shifted forward by one position
+        attention.location_layer.location_dense.linear_layer.weight[:, 0] = 1.0
+        attention.v.linear_layer.weight.fill_(2.0)
+    return decoder
+
+
+def long_memory(B=3, enc=120, dim=32):
+    torch.manual_seed(1234)
+    memory = torch.randn(B, enc, dim)
+    memory[:, :, 0] = 0.0
+    memory[:, 0, 0] = 0.5
+    return memory
+
+
+def test_windowed_attention_matches_full(decoder_hparams, monkeypatch):
+    torch.manual_seed(1234)
+    attention = Decoder(decoder_hparams()).attention_layer.eval()
+    attention.v.linear_layer.weight.data *= 20.0 # sharper attention, so the window holds all of it for some rows
+    B, enc, window_len, leak = 6, 120, 32, 1e-3
+    memory = torch.randn(B, enc, 32)
+    mask = torch.arange(enc)[None, :] >= torch.tensor([120, 120, 80, 30, 20, 120])[:, None] # (rows 3 and 4 fit in the window)
+    prev_weights = torch.softmax(torch.randn(B, enc)*5.0, dim=1).masked_fill(mask, 0.0)
+    prev_weights[3:5] = F.one_hot(torch.tensor([2, 5]), enc).float() # (window starts at 0)
+    attention_weights_cat = torch.stack((prev_weights, prev_weights.cumsum(1)), dim=1)
+    query = torch.randn(B, 32)
+    with torch.no_grad():
+        processed_memory = attention.memory_layer(memory)
+        full_context, full_weights = attention(query, memory, processed_memory, attention_weights_cat, mask)
+        energies = attention.get_alignment_energies(query, processed_memory, attention_weights_cat).masked_fill(mask, attention.score_mask_value)
+        full_batch_sizes = []
+        forward = attention.forward
+        monkeypatch.setattr(attention, 'forward', lambda *args: full_batch_sizes.append(args[0].size(0)) or forward(*args))
+        context, weights = attention.windowed_forward(query, memory, processed_memory, attention_weights_cat, mask, window_len, leak)
+    
+    # reference: softmax over the window slice of the full energies, rows with too much weight at a window edge use forward()
+    start = (prev_weights.argmax(1) - window_len//4).clamp(0, enc-window_len)
+    index = start[:, None] + torch.arange(window_len)
+    window_weights = torch.softmax(energies.gather(1, index), dim=1)
+    edge = window_len//8
+    leaked = ((start > 0) & (window_weights[:, :edge].sum(1) > leak)) | ((start+window_len < enc) & (window_weights[:, -edge:].sum(1) > leak))
+    assert 0 < int(leaked.sum()) < B
+    assert not leaked[3:5].any()
+    
+    # only the leaking rows were recomputed over the full input (in one batch)
+    assert full_batch_sizes == [int(leaked.sum())]
+    assert torch.allclose(weights[leaked], full_weights[leaked], atol=1e-6)
+    assert torch.allclose(context[leaked], full_context[leaked], atol=1e-6)
+    
+    # the other rows only attend inside the window
+    assert torch.allclose(weights[~leaked], torch.zeros(B, enc)[~leaked].scatter(1, index[~leaked], window_weights[~leaked]), atol=1e-6)
+    assert torch.allclose(context[~leaked], torch.bmm(window_weights[~leaked, None], memory[~leaked].gather(1, index[~leaked, :, None].expand(-1, -1, 32))).squeeze(1), atol=1e-5)
+    assert torch.allclose(weights[3:5], full_weights[3:5], atol=1e-6) # (nothing outside the window to attend to)
+
+
+def test_windowed_attention_decoder_inference_matches_full(decoder_hparams, monkeypatch):
+    decoder = monotonic_attention_decoder(decoder_hparams())
+    memory, memory_lengths = long_memory(), torch.tensor([120, 90, 60])
+    full_batch_sizes = []
+    forward = decoder.attention_layer.forward
+    with torch.no_grad():
+        mel_full, gate_full, align_full = decoder.inference(memory, memory_lengths, return_alignments=True)
+        monkeypatch.setattr(decoder.attention_layer, 'forward', lambda *args: full_batch_sizes.append(args[0].size(0)) or forward(*args))
+        decoder.inference_attention_window, decoder.inference_attention_leak = 32, 1e-3
+        mel_window, gate_window, align_window = decoder.inference(memory, memory_lengths, return_alignments=True)
+    assert align_full.argmax(2)[0, :40].tolist() == list(range(40)) # (the attention really does move past the first window)
+    assert sum(full_batch_sizes) <= 2 # every step used the window (except when the attention of the 60 long row runs off the end of it's input)
+    assert mel_window.shape == mel_full.shape
+    assert torch.allclose(mel_window, mel_full, atol=1e-3)
+    assert torch.allclose(gate_window, gate_full, atol=1e-3)
+    assert ((align_window.float()-align_full.float()).abs().sum(2) <= 1e-2).all()
+
+
+def test_windowed_attention_decoder_inference_fallback(decoder_hparams):
+    """With a negative leak threshold every row is recomputed over the full input, which must give exactly the full attention's result."""
+    decoder = monotonic_attention_decoder(decoder_hparams())
+    memory, memory_lengths = long_memory(), torch.tensor([120, 90, 60])
+    with torch.no_grad():
+        mel_full, gate_full, align_full = decoder.inference(memory, memory_lengths, return_alignments=True)
+        decoder.inference_attention_window, decoder.inference_attention_leak = 32, -1.0
+        mel_window, gate_window, align_window = decoder.inference(memory, memory_lengths, return_alignments=True)
+    assert torch.allclose(mel_window, mel_full, atol=1e-6)
+    assert torch.allclose(align_window, align_full, atol=1e-6)
+
+
+def pad_encoder_positions(state, enc_length):
+    """Pad a DecoderState's encoder positions to enc_length like DecoderStepGraph does (padding is masked, and zero everywhere else)."""
+    from model import DecoderState, DecoderStepGraph
+    padded = DecoderState()
+    for name in DecoderState.names:
+        tensor = getattr(state, name)
+        if tensor is not None and name in DecoderStepGraph.enc_names:
+            pad = tensor.new_full((tensor.size(0), enc_length-tensor.size(1))+tensor.shape[2:], name == 'mask')
+            tensor = torch.cat((tensor, pad), dim=1)
+        setattr(padded, name, None if tensor is None else tensor.clone())
+    return padded
+
+
+@pytest.mark.parametrize('attention_type', [0, 2])
+def test_padded_encoder_positions_get_no_attention(decoder_hparams, attention_type):
+    """CUDA graphs are shared by encoder lengths in the same bucket, padding the encoder positions must not change any step."""
+    from model import DecoderState
+    torch.manual_seed(1234)
+    decoder = Decoder(decoder_hparams(attention_type=attention_type)).eval()
+    memory = torch.randn(3, 20, 32)
+    mask = torch.arange(20)[None, :] >= torch.tensor([20, 14, 7])[:, None]
+    state = DecoderState()
+    with torch.no_grad():
+        decoder.initialize_decoder_states(memory, mask=mask, state=state)
+        padded = pad_encoder_positions(state, 64)
+        decoder_input = decoder.get_go_frame(memory)
+        for i in range(10):
+            mel, gate, alignment = decoder.inference_step(decoder_input, state)
+            padded_mel, padded_gate, padded_alignment = decoder.inference_step(decoder_input, padded)
+            assert (padded_alignment[:, 20:] == 0.0).all()
+            assert torch.allclose(padded_alignment[:, :20], alignment, atol=1e-6)
+            assert torch.allclose(padded_mel, mel, atol=1e-5)
+            assert torch.allclose(padded_gate, gate, atol=1e-5)
+            decoder_input = mel
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="needs CUDA")
+def test_cuda_graph_shared_by_encoder_lengths_in_a_bucket(decoder_hparams):
+    torch.manual_seed(1234)
+    decoder = Decoder(decoder_hparams(cuda_graph_inference=True)).cuda().eval()
+    memory = torch.randn(1, 40, 32, device='cuda')
+    outputs = {}
+    with torch.no_grad():
+        for enc_T in (20, 27, 40):
+            outputs[enc_T] = decoder.inference(memory[:, :enc_T], torch.tensor([enc_T], device='cuda'), return_alignments=True)
+            assert [key[:2] for key in decoder.step_graphs] == [(1, 64)] # (the first call captured the graph, the others reused it)
+        decoder.cuda_graph_inference = False
+        for enc_T, (mel, gate, alignments) in outputs.items():
+            ref_mel, ref_gate, ref_alignments = decoder.inference(memory[:, :enc_T], torch.tensor([enc_T], device='cuda'), return_alignments=True)
+            assert alignments.shape == ref_alignments.shape == (1, mel.size(2), enc_T)
+            assert torch.allclose(mel, ref_mel, atol=1e-4)
+            assert torch.allclose(alignments, ref_alignments, atol=1e-4)
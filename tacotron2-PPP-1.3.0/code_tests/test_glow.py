@@ -0,0 +1,69 @@
+import pytest
+torch = pytest.importorskip("torch")
+
+import glow
+from waveglow_export import prepare_inference_waveglow
+
+HOP_LENGTH = 32
+
+
+def inference_waveglow():
+    torch.manual_seed(1234)
+    WN_config = {'n_layers': 2, 'n_channels': 8, 'kernel_size': 3, 'speaker_embed_dim': 4, 'rezero': False}
+    waveglow = glow.WaveGlow(yoyo=False, yoyo_WN=False, n_mel_channels=8, n_flows=4, n_group=8, n_early_every=2, n_early_size=2,
+                             memory_efficient=False, spect_scaling=False, upsample_mode='normal', WN_config=WN_config,
+                             win_length=128, hop_length=HOP_LENGTH)
+    for WN in waveglow.WN: # (end is initialized to zero, which would hide any difference in the cond_layers)
+        torch.nn.init.normal_(WN.end.weight, std=0.1)
+    return prepare_inference_waveglow(waveglow)
+
+
+def infer(waveglow, spect, speaker_ids, fold, monkeypatch):
+    with monkeypatch.context() as m:
+        if not fold:
+            m.setattr(glow, 'can_fold_speaker_embed', lambda layer: False)
+        torch.manual_seed(1234)
+        with torch.no_grad():
+            return waveglow.infer(spect, speaker_ids, sigma=0.8)
+
+
+def test_speaker_embed_can_be_folded_after_export():
+    waveglow = inference_waveglow()
+    assert all(glow.can_fold_speaker_embed(WN.cond_layers[0]) for WN in waveglow.WN)
+
+
+def test_folded_speaker_embed_matches_concat(monkeypatch):
+    waveglow = inference_waveglow()
+    spect = torch.randn(3, 8, 20)
+    speaker_ids = torch.LongTensor([0, 7, 300])
+    assert torch.allclose(infer(waveglow, spect, speaker_ids, True, monkeypatch), infer(waveglow, spect, speaker_ids, False, monkeypatch), atol=1e-5)
+
+    # the precomputed speaker projection follows the model to a new dtype (the noise changes with the dtype, so only compare within a dtype)
+    waveglow.double()
+    folded = infer(waveglow, spect.double(), speaker_ids, True, monkeypatch)
+    assert waveglow.WN[0].speaker_projection.dtype == torch.float64
+    assert torch.allclose(folded, infer(waveglow, spect.double(), speaker_ids, False, monkeypatch), atol=1e-10)
+
+    # and is recomputed when the weights change
+    with torch.no_grad():
+        waveglow.WN[0].speaker_embed.weight.mul_(2.0)
+    assert torch.allclose(infer(waveglow, spect.double(), speaker_ids, True, monkeypatch),
+                          infer(waveglow, spect.double(), speaker_ids, False, monkeypatch), atol=1e-10)
+
+
+@pytest.mark.parametrize('device', ['cpu', pytest.param('cuda', marks=pytest.mark.skipif(not torch.cuda.is_available(), reason="needs CUDA"))])
+def test_folded_speaker_embed_matches_concat_half(device, monkeypatch):
+    waveglow = inference_waveglow()
+    spect = torch.randn(2, 8, 20)
+    speaker_ids = torch.LongTensor([1, 5])
+    infer(waveglow, spect, speaker_ids, True, monkeypatch) # (fills the fp32 cache first)
+
+    waveglow.to(device).half()
+    spect, speaker_ids = spect.to(device).half(), speaker_ids.to(device)
+    try:
+        folded = infer(waveglow, spect, speaker_ids, True, monkeypatch)
+    except RuntimeError as ex: # fp16 ops missing on this device
+        pytest.skip(str(ex))
+    assert waveglow.WN[0].speaker_projection.dtype == torch.float16
+    assert waveglow.WN[0].speaker_projection.device.type == device
+    assert torch.allclose(folded.float(), infer(waveglow, spect, speaker_ids, False, monkeypatch).float(), atol=1e-2)
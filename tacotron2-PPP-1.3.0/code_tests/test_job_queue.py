@@ -0,0 +1,139 @@
+import pytest
+
+from job_queue import TTSJobQueue
+
+PARAMS = {'speaker_names': ['a', 'b'], 'batch_size': 4}
+TIMEOUT = 10
+
+
+def blocked_queue(stub_t2s, **kwargs):
+    """Returns a TTSJobQueue whose worker is busy with a 'blocker' job (till a token is put in stub_t2s.release), so the next submits queue up."""
+    job_queue = TTSJobQueue(stub_t2s, **kwargs)
+    job_queue.submit('blocker', {}, 'tt', 'wg')
+    assert stub_t2s.started.get(timeout=TIMEOUT) == ['blocker']
+    return job_queue
+
+
+def read_chunks(job):
+    chunks = []
+    while True:
+        chunk = job.chunks.get(timeout=TIMEOUT)
+        if chunk is None:
+            return chunks
+        chunks.append(chunk)
+
+
+def test_identical_requests_share_one_infer_call(stub_t2s):
+    job_queue = blocked_queue(stub_t2s)
+    job_a = job_queue.submit('hello', PARAMS, 'tt', 'wg')
+    job_other = job_queue.submit('hello', PARAMS, 'other_tt', 'wg') # (needs a different model, can't share a batch)
+    job_b = job_queue.submit('hello', {'batch_size': 4, 'speaker_names': ['a', 'b']}, 'tt', 'wg')
+    assert [job_queue.status(job)['position'] for job in (job_a, job_other, job_b)] == [0, 1, 2]
+    for _ in range(3):
+        stub_t2s.release.put(True)
+    for job in (job_a, job_b, job_other):
+        assert job.done_event.wait(TIMEOUT)
+
+    assert stub_t2s.calls[1:] == [(['hello', 'hello'], PARAMS), (['hello'], PARAMS)]
+    assert stub_t2s.tt_current == 'other_tt'
+    assert job_a.n_coalesced == job_b.n_coalesced == 2 and job_other.n_coalesced == 1
+    for job in (job_a, job_b, job_other):
+        status = job_queue.status(job)
+        assert status['status'] == 'done' and status['voice'] == f"{job.id}.wav"
+        assert status['started'] <= status['finished']
+
+
+def test_max_coalesce(stub_t2s):
+    job_queue = blocked_queue(stub_t2s, max_coalesce=2)
+    jobs = [job_queue.submit(f'text {i}', PARAMS, 'tt', 'wg') for i in range(3)]
+    for _ in range(3):
+        stub_t2s.release.put(True)
+    for job in jobs:
+        assert job.done_event.wait(TIMEOUT)
+    assert [texts for texts, _ in stub_t2s.calls[1:]] == [['text 0', 'text 1'], ['text 2']]
+
+
+def test_cancel_queued_job(stub_t2s):
+    job_queue = blocked_queue(stub_t2s)
+    job_a = job_queue.submit('hello', PARAMS, 'tt', 'wg')
+    job_b = job_queue.submit('hello', PARAMS, 'tt', 'wg')
+    job_queue.cancel(job_a)
+    assert job_a.status == 'cancelled' and job_a.done_event.is_set()
+    assert job_queue.status(job_b)['position'] == 0
+
+    stub_t2s.release.put(True)
+    stub_t2s.release.put(True)
+    assert job_b.done_event.wait(TIMEOUT)
+    assert stub_t2s.calls[1:] == [(['hello'], PARAMS)]
+    assert job_b.status == 'done' and job_b.n_coalesced == 1
+
+
+def test_cancelling_one_waiter_keeps_shared_batch_running(stub_t2s):
+    job_queue = blocked_queue(stub_t2s)
+    job_a = job_queue.submit('hello', PARAMS, 'tt', 'wg')
+    job_b = job_queue.submit('hello', PARAMS, 'tt', 'wg')
+    stub_t2s.release.put(True) # (finish the blocker)
+    assert stub_t2s.started.get(timeout=TIMEOUT) == ['hello', 'hello']
+    job_queue.cancel(job_a) # (while the shared batch is running)
+    stub_t2s.release.put(True)
+
+    assert job_b.done_event.wait(TIMEOUT)
+    assert not job_b.cancelled.is_set()
+    assert job_b.status == 'done' and job_b.result[0] == f"{job_b.id}.wav"
+
+
+def test_cancelling_one_stream_waiter_keeps_shared_batch_running(stub_t2s):
+    stub_t2s.n_segments = 5
+    job_queue = blocked_queue(stub_t2s, max_stream_chunks=1) # (the worker has to wait for the readers)
+    job_a = job_queue.submit('hello', PARAMS, 'tt', 'wg', stream=True)
+    job_b = job_queue.submit('hello', PARAMS, 'tt', 'wg', stream=True)
+    stub_t2s.release.put(True)
+    stub_t2s.release.put(True)
+
+    assert job_a.chunks.get(timeout=TIMEOUT)['segment'] == 0
+    job_queue.cancel(job_a) # job_a's client went away, job_b still gets every segment
+    chunks = read_chunks(job_b)
+    assert [(c['request'], c['segment']) for c in chunks] == [(1, i) for i in range(5)]
+    assert job_b.done_event.wait(TIMEOUT)
+    assert job_b.status == 'done' and job_a.status == 'cancelled'
+    assert stub_t2s.n_yielded == 10
+
+
+def test_cancelling_every_stream_waiter_stops_the_batch(stub_t2s):
+    stub_t2s.n_segments = 50
+    job_queue = blocked_queue(stub_t2s, max_stream_chunks=1)
+    jobs = [job_queue.submit('hello', PARAMS, 'tt', 'wg', stream=True) for _ in range(2)]
+    stub_t2s.release.put(True)
+    stub_t2s.release.put(True)
+
+    for job in jobs:
+        assert job.chunks.get(timeout=TIMEOUT)['segment'] == 0
+        job_queue.cancel(job)
+    for job in jobs:
+        assert job.done_event.wait(TIMEOUT)
+        assert job.status == 'cancelled'
+    assert stub_t2s.stream_closed.is_set() # (the generator was closed)
+    assert stub_t2s.n_yielded < 100
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_failed_batch(stub_t2s, stream):
+    job_queue = blocked_queue(stub_t2s)
+    jobs = [job_queue.submit(text, PARAMS, 'tt', 'wg', stream=stream) for text in ('fail', 'fine')]
+    stub_t2s.release.put(True)
+    stub_t2s.release.put(True)
+    for job in jobs:
+        assert job.done_event.wait(TIMEOUT)
+        assert job.status == 'failed' and job.error == 'ValueError: stub failure'
+        if stream:
+            assert read_chunks(job) == [] # (the stream is still ended)
+
+
+def test_finished_jobs_are_forgotten(stub_t2s):
+    job_queue = blocked_queue(stub_t2s, max_coalesce=1, max_finished_jobs=2)
+    jobs = [job_queue.submit(f'text {i}', PARAMS, 'tt', 'wg') for i in range(3)]
+    for _ in range(4):
+        stub_t2s.release.put(True)
+    for job in jobs:
+        assert job.done_event.wait(TIMEOUT)
+    assert [job_queue.get(job.id) for job in jobs] == [None, jobs[1], jobs[2]]
@@ -0,0 +1,53 @@
+import pytest
+torch = pytest.importorskip("torch")
+
+from model_cache import ModelCache, module_nbytes
+
+MODEL_NBYTES = module_nbytes(torch.nn.Linear(16, 16))
+
+
+def make_cache(device, max_device_models, max_cpu_models, offload_to_cpu=True):
+    return ModelCache(device, max_device_gb=max_device_models*MODEL_NBYTES/1024**3, max_cpu_gb=max_cpu_models*MODEL_NBYTES/1024**3, offload_to_cpu=offload_to_cpu)
+
+
+def load(cache, key, in_use=()):
+    return cache.get(key, lambda: (torch.nn.Linear(16, 16), key), in_use=in_use)
+
+
+def test_drops_least_recently_used():
+    cache = make_cache(torch.device('cpu'), max_device_models=2, max_cpu_models=2)
+    load(cache, 'a'); load(cache, 'b')
+    load(cache, 'a') # 'b' is now the least recently used
+    load(cache, 'c')
+    assert list(cache.entries.keys()) == ['a', 'c']
+
+
+def test_get_returns_cached_value_without_reloading():
+    cache = make_cache(torch.device('cpu'), max_device_models=2, max_cpu_models=2)
+    value = load(cache, 'a')
+    assert cache.get('a', lambda: pytest.fail("loader called for a cached key")) is value
+
+
+def test_in_use_entries_are_kept():
+    cache = make_cache(torch.device('cpu'), max_device_models=2, max_cpu_models=2)
+    load(cache, 'a'); load(cache, 'b')
+    load(cache, 'c', in_use=['a'])
+    assert list(cache.entries.keys()) == ['a', 'c']
+
+
+def test_offloads_then_drops_in_lru_order():
+    # any non-CPU device enables offloading, 'meta' lets this run without a GPU
+    cache = make_cache(torch.device('meta'), max_device_models=2, max_cpu_models=1)
+    load(cache, 'a'); load(cache, 'b'); load(cache, 'c')
+    assert list(cache.entries.keys()) == ['a', 'b', 'c']
+    assert [e['offloaded'] for e in cache.entries.values()] == [True, False, False]
+    assert cache.entries['a']['value'][0].weight.device.type == 'cpu'
+
+    load(cache, 'd') # 'b' is offloaded, 'a' no longer fits in the CPU budget
+    assert list(cache.entries.keys()) == ['b', 'c', 'd']
+    assert [e['offloaded'] for e in cache.entries.values()] == [True, False, False]
+
+    load(cache, 'b') # moved back to the device, 'c' is offloaded in it's place
+    assert list(cache.entries.keys()) == ['c', 'd', 'b']
+    assert [e['offloaded'] for e in cache.entries.values()] == [True, False, False]
+    assert cache.entries['b']['value'][0].weight.device.type == 'meta'
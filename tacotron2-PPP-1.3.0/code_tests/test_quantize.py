@@ -0,0 +1,49 @@
+import copy
+import pytest
+torch = pytest.importorskip("torch")
+
+from quantize import load_quantized_tacotron2, quantize_tacotron2
+
+if not any(engine != 'none' for engine in torch.backends.quantized.supported_engines):
+    pytest.skip("no quantized engine in this torch build", allow_module_level=True)
+
+
+def inputs():
+    torch.manual_seed(1234)
+    text_lengths = torch.tensor([12, 5, 9])
+    text = torch.randint(1, 40, (3, 12)) * (torch.arange(12)[None, :] < text_lengths[:, None])
+    return text, torch.tensor([0, 3, 1]), text_lengths
+
+
+def run(model):
+    text, speaker_ids, text_lengths = inputs()
+    with torch.no_grad():
+        return model.inference(text, speaker_ids, text_lengths=text_lengths, max_decoder_steps=32, return_alignments=True)
+
+
+@pytest.mark.parametrize('overrides', [{}, {'DecRNN_hidden_dropout_type': 'zoneout', 'p_DecRNN_hidden_dropout': 0.1}])
+def test_quantized_inference_close_to_fp32(tiny_tacotron2, overrides):
+    model = tiny_tacotron2(**overrides)
+    q_model = quantize_tacotron2(copy.deepcopy(model)) # (quantizes in-place)
+    for layer in (q_model.decoder.decoder_rnn, q_model.decoder.attention_rnn, q_model.decoder.gate_layer.linear_layer):
+        assert 'quantized' in type(layer).__module__
+
+    fp32_outputs, int8_outputs = run(model), run(q_model)
+    for fp32, int8 in zip(fp32_outputs, int8_outputs):
+        assert int8.shape == fp32.shape
+        assert int8.dtype == fp32.dtype
+        assert torch.isfinite(int8).all()
+    mel, mel_postnet, gate, alignments = fp32_outputs
+    q_mel, q_mel_postnet, q_gate, q_alignments = int8_outputs
+    assert mel.shape == (3, 16, 32)
+    assert (q_mel_postnet-mel_postnet).abs().mean() < 0.05 * mel_postnet.abs().mean()
+    assert (q_gate-gate).abs().max() < 0.05
+    assert (q_alignments.float()-alignments.float()).abs().sum(2).max() < 0.2
+
+
+def test_quantized_checkpoint_reloads(tiny_tacotron2, tacotron2_hparams):
+    q_model = quantize_tacotron2(tiny_tacotron2())
+    checkpoint = {'state_dict': q_model.state_dict(), 'hparams': tacotron2_hparams()} # (what export_quantized() saves)
+    reloaded = load_quantized_tacotron2(checkpoint).eval()
+    for x, reloaded_x in zip(run(q_model), run(reloaded)):
+        assert torch.equal(x, reloaded_x)
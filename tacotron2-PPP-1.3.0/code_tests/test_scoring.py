@@ -0,0 +1,119 @@
+import pytest
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("nltk")
+pytest.importorskip("unidecode")
+
+from text2speech import BestOfNSampler, alignment_metric, best_of_pass, get_first_over_thresh, score_alignments, score_to_str
+
+WEIGHTS = {'diagonality_weighting': 0.7, 'max_focus_weighting': 1.3, 'min_focus_weighting': 0.8, 'avg_focus_weighting': 1.1}
+
+
+def reference_score(diagonality, avg_prob, enc_max_focus, enc_min_focus, enc_avg_focus, diagonality_weighting=0.5, max_focus_weighting=1.0, min_focus_weighting=1.0, avg_focus_weighting=1.0):
+    """Score of one candidate, the way T2S scored every candidate before score_alignments() (returns weighted_score, score_str)."""
+    weighted_score =  avg_prob.item() # general alignment quality
+    diagonality_punishment = (max(diagonality.item(),1.20)-1.20) * 0.5 * diagonality_weighting  # smooth pacing
+    max_focus_punishment = max((enc_max_focus.item()-24), 0) * 0.005 * max_focus_weighting # getting stuck on pauses/phones
+    min_focus_punishment = max(0.25-enc_min_focus.item(),0) * min_focus_weighting # skipping single enc outputs
+    avg_focus_punishment = max(2.5-enc_avg_focus.item(), 0) * avg_focus_weighting # skipping most enc outputs
+    weighted_score -= (diagonality_punishment + max_focus_punishment + min_focus_punishment + avg_focus_punishment)
+    score_str = f"{round(diagonality.item(),3)} {round(avg_prob.item()*100,2)}% {round(weighted_score,4)} {round(max_focus_punishment,2)} {round(min_focus_punishment,2)} {round(avg_focus_punishment,2)}|"
+    return weighted_score, score_str
+
+
+def random_alignments(input_lengths, output_lengths, seed=1234):
+    """Random attention [B, max(output_lengths), max(input_lengths)] (each frame sums to 1 over it's input, padding is zero)."""
+    torch.manual_seed(seed)
+    B, dec_T, enc_T = len(input_lengths), max(output_lengths), max(input_lengths)
+    energies = torch.randn(B, dec_T, enc_T)*3.0
+    energies[:, :, 0] += torch.linspace(-5.0, 5.0, dec_T)[None] * torch.rand(B, 1) # (some candidates get stuck at the start)
+    energies.masked_fill_(torch.arange(enc_T)[None, None, :] >= torch.tensor(input_lengths)[:, None, None], -float('inf'))
+    alignments = torch.softmax(energies, dim=2)
+    return alignments.masked_fill(torch.arange(dec_T)[None, :, None] >= torch.tensor(output_lengths)[:, None, None], 0.0)
+
+
+def per_candidate_metrics(alignments, input_lengths, output_lengths):
+    """alignment_metric() of each candidate on it's own (no padding)."""
+    return [alignment_metric(alignments[k:k+1, :output_lengths[k], :input_lengths[k]].clone(), input_lengths=torch.tensor([input_lengths[k]]), output_lengths=torch.tensor([output_lengths[k]]))
+            for k in range(len(input_lengths))]
+
+
+def test_score_alignments_matches_loop():
+    torch.manual_seed(1234)
+    B = 64
+    metrics = (torch.rand(B)*1.0+0.8, torch.rand(B), torch.rand(B)*50.0, torch.rand(B)*0.5, torch.rand(B)*5.0) # (half of each is on either side of it's clamp)
+    for weights in ({}, WEIGHTS):
+        scores = score_alignments(*metrics, **weights)
+        assert scores.shape == (B, 6)
+        for k in range(B):
+            weighted_score, score_str = reference_score(*[x[k] for x in metrics], **weights)
+            assert scores[k, 2].item() == pytest.approx(weighted_score, abs=1e-9)
+            assert score_to_str(scores[k].numpy()) == score_str
+
+
+def test_alignment_metric_padded_matches_per_candidate():
+    input_lengths, output_lengths = [7, 20, 3, 20, 12, 1], [30, 9, 45, 45, 2, 17]
+    alignments = random_alignments(input_lengths, output_lengths)
+    batched = alignment_metric(alignments.clone(), input_lengths=torch.tensor(input_lengths), output_lengths=torch.tensor(output_lengths), to_cpu=False)
+    single = per_candidate_metrics(alignments, input_lengths, output_lengths)
+    for i, metric in enumerate(batched):
+        assert torch.allclose(metric.double(), torch.cat([x[i] for x in single]).double(), atol=1e-5)
+
+
+def test_add_results_matches_loop():
+    """BestOfNSampler.add_results() scores ragged candidates in one batch, it must pick the same candidate/score as scoring them one at a time."""
+    text_lengths = [7, 20, 3]
+    row_text = [0, 1, 2, 1, 0, 2, 2, 1]
+    lengths = [30, 9, 45, 40, 2, 17, 33, 21] # decoder steps each candidate generated
+    input_lengths = [text_lengths[j] for j in row_text]
+    torch.manual_seed(1234)
+    gates = torch.rand(len(row_text), max(lengths))*0.8
+    for k, l in enumerate(lengths):
+        gates[k, l*2//3:l] += 0.15 # (most candidates have a frame over the threshold before the end)
+    alignments = random_alignments(input_lengths, lengths)
+    alignments += (torch.arange(max(lengths))[None, :, None] >= torch.tensor(lengths)[:, None, None]) * torch.rand(alignments.shape) # (frames after the end are garbage)
+    mels = torch.randn(len(row_text), 4, max(lengths))
+
+    sampler = BestOfNSampler(torch.tensor(text_lengths), 2.0, 3, 5, -9e9, 45, 0.9, score_weights=WEIGHTS)
+    sampler.in_progress[:] = [row_text.count(j) for j in range(len(text_lengths))]
+    sampler.add_results(torch.tensor(row_text[:5]), torch.tensor(lengths[:5]), mels[:5], gates[:5], alignments[:5])
+    sampler.add_results(torch.tensor(row_text[5:]), torch.tensor(lengths[5:]), mels[5:], gates[5:], alignments[5:])
+
+    best_score, best_score_str, best_k = [-9e9]*3, ['']*3, [None]*3
+    for k, (j, l) in enumerate(zip(row_text, lengths)):
+        output_length = int(get_first_over_thresh(gates[k:k+1, :l].clone(), 0.9))
+        metrics = per_candidate_metrics(alignments[k:k+1, :l], [input_lengths[k]], [output_length])[0]
+        weighted_score, score_str = reference_score(*[x[0] for x in metrics], **WEIGHTS)
+        if weighted_score > best_score[j]:
+            best_score[j], best_score_str[j], best_k[j] = weighted_score, score_str, k
+
+    assert sampler.tries.tolist() == [2, 3, 3]
+    assert sampler.in_progress.tolist() == [0, 0, 0]
+    assert np.allclose(sampler.best_score, best_score, atol=1e-5)
+    assert sampler.best_score_str == best_score_str
+    for j, k in enumerate(best_k):
+        mel, _, gate, alignment = sampler.best_generations[j]
+        assert torch.equal(mel[0], mels[k, :, :lengths[k]])
+        assert torch.equal(gate[0], gates[k, :lengths[k]])
+        assert torch.equal(alignment[0], alignments[k, :lengths[k]])
+
+
+def test_best_of_pass_matches_loop():
+    torch.manual_seed(1234)
+    n_texts, n_attempts, n_passes = 5, 4, 6
+    best_score_device = torch.full((n_texts,), -9e9, dtype=torch.float64)
+    best_score, best_attempt = [-9e9]*n_texts, [None]*n_texts
+    for p in range(n_passes):
+        scores = torch.rand(n_texts, n_attempts, 6, dtype=torch.float64)
+        scores[:, :, 2] = (scores[:, :, 2]*8).round()/8 # (ties, the first attempt with the best score is kept)
+        best_score_device, pass_info = best_of_pass(scores, best_score_device)
+        for j in range(n_texts):
+            for k in range(n_attempts):
+                if scores[j, k, 2].item() > best_score[j]:
+                    best_score[j], best_attempt[j] = scores[j, k, 2].item(), (p, k)
+            if pass_info[j, 6]:
+                assert best_attempt[j] == (p, int(pass_info[j, 7]))
+                assert np.allclose(pass_info[j, :6], scores[j, int(pass_info[j, 7])].numpy())
+            else:
+                assert best_attempt[j][0] < p
+        assert best_score_device.tolist() == best_score
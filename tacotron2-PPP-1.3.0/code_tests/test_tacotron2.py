@@ -0,0 +1,75 @@
+import pytest
+torch = pytest.importorskip("torch")
+
+from model import load_model
+
+
+def test_load_model_device(tacotron2_hparams):
+    model = load_model(tacotron2_hparams(), device='cpu')
+    assert {p.device.type for p in model.parameters()} == {'cpu'}
+    model = load_model(tacotron2_hparams(), device=torch.device('meta'))
+    assert {p.device.type for p in model.parameters()} == {'meta'}
+
+
+def decoder_inputs(model, monkeypatch, **kwargs):
+    """Runs model.inference() and returns the states the Decoder started from (memory, processed_memory, mask) and the outputs."""
+    states = []
+    initialize_decoder_states = model.decoder.initialize_decoder_states
+    def record(*args, **kw):
+        initialize_decoder_states(*args, **kw)
+        state = kw['state']
+        states.append((state.memory.clone(), state.processed_memory.clone(), state.mask.clone()))
+    with monkeypatch.context() as m:
+        m.setattr(model.decoder, 'initialize_decoder_states', record)
+        with torch.no_grad():
+            outputs = model.inference(**kwargs, run_postnet=False, return_alignments=True)
+    assert len(states) == 1
+    return states[0], outputs
+
+
+def test_encode_n_repeats_matches_per_row_inputs(tiny_tacotron2, monkeypatch):
+    """Encoding each text once and expanding it in the Decoder must give the same Decoder inputs as encoding every repeated row."""
+    model = tiny_tacotron2()
+    torch.manual_seed(1234)
+    text_lengths = torch.tensor([12, 5, 9])
+    text = torch.randint(1, 40, (3, 12)) * (torch.arange(12)[None, :] < text_lengths[:, None])
+    speaker_ids = torch.tensor([0, 3, 1])
+    n_repeats = 3
+
+    per_row_state, per_row_outputs = decoder_inputs(model, monkeypatch, text=text.repeat_interleave(n_repeats, dim=0), speaker_ids=speaker_ids.repeat_interleave(n_repeats, dim=0), text_lengths=text_lengths.repeat_interleave(n_repeats, dim=0))
+    with torch.no_grad():
+        encoder_outputs = model.encode(text, speaker_ids, text_lengths=text_lengths)
+    state, outputs = decoder_inputs(model, monkeypatch, text=text, speaker_ids=speaker_ids, text_lengths=text_lengths, encoder_outputs=encoder_outputs, n_repeats=n_repeats)
+
+    for x, per_row_x in zip(state, per_row_state):
+        assert x.shape == per_row_x.shape
+        assert torch.allclose(x, per_row_x, atol=1e-6)
+    for x, per_row_x in zip(outputs, per_row_outputs):
+        assert (x is None) == (per_row_x is None)
+        if x is not None:
+            assert torch.allclose(x.float(), per_row_x.float(), atol=1e-5)
+
+
+def test_postnet_on_selected_matches_postnet_on_all(tiny_tacotron2):
+    """T2S only runs the Postnet on the best attempt of each text, it must match running it on every attempt and then selecting."""
+    model = tiny_tacotron2(p_prenet_dropout=0.5) # (Prenet dropout is used at inference, so every attempt is different)
+    torch.manual_seed(1234)
+    text_lengths = torch.tensor([12, 5, 9])
+    text = torch.randint(1, 40, (3, 12)) * (torch.arange(12)[None, :] < text_lengths[:, None])
+    speaker_ids = torch.tensor([0, 3, 1])
+    n_repeats = 4
+    with torch.no_grad():
+        torch.manual_seed(1234)
+        mel, mel_postnet, gate, alignments = model.inference(text, speaker_ids, text_lengths=text_lengths, n_repeats=n_repeats, run_postnet=True)
+        torch.manual_seed(1234)
+        mel_no_postnet, no_postnet, _, _ = model.inference(text, speaker_ids, text_lengths=text_lengths, n_repeats=n_repeats, run_postnet=False)
+        assert no_postnet is None
+        assert not torch.allclose(mel_postnet[0], mel_postnet[2])
+        assert torch.equal(mel_no_postnet, mel)
+
+        best = [2, 5, 11] # (one attempt of each text)
+        best_generations = [[mel[i:i+1], None, gate[i:i+1], alignments[i:i+1]] for i in best] # (as T2S stores the winners)
+        for generation in best_generations:
+            generation[1] = model.postnet_inference(generation[0])
+    for generation, i in zip(best_generations, best):
+        assert torch.allclose(generation[1], mel_postnet[i:i+1], atol=1e-5)
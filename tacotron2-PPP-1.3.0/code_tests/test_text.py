@@ -0,0 +1,60 @@
+import random
+import pytest
+torch = pytest.importorskip("torch")
+
+from text import text_to_sequence, text_to_sequence_batch, _clean_text, _symbols_to_sequence, _arpabet_to_sequence, _curly_re
+
+TEXTS = [
+    "Turn left on {HH AW1 S S T AH0 N} Street.",
+    "It costs $12.50, Mr. Smith!",
+    "{HH AH0 L OW1} {W ER1 L D}",
+    "no braces here",
+    "multi\nline {T EH1 K S T}\nwith {AH0 R P AH0 B EH2 T}",
+    "unclosed {brace",
+    "",
+    "Ünïcödé… “quotes” — dash",
+]
+
+
+def reference_text_to_sequence(text, cleaner_names):
+    """The original (uncached) implementation from keithito/tacotron."""
+    sequence = []
+    while len(text):
+        m = _curly_re.match(text)
+        if not m:
+            sequence += _symbols_to_sequence(_clean_text(text, cleaner_names))
+            break
+        sequence += _symbols_to_sequence(_clean_text(m.group(1), cleaner_names))
+        sequence += _arpabet_to_sequence(m.group(2))
+        text = m.group(3)
+    return sequence
+
+
+def random_texts(n, seed=1234):
+    rng = random.Random(seed)
+    chars = "abcdefgh ABC.,!?'-\n{}0123456789"
+    return ["".join(rng.choice(chars) for _ in range(rng.randint(0, 40))) for _ in range(n)]
+
+
+@pytest.mark.parametrize('cleaner_names', [['english_cleaners'], ['basic_cleaners']])
+def test_text_to_sequence_matches_reference(cleaner_names):
+    for text in TEXTS + random_texts(500):
+        assert text_to_sequence(text, cleaner_names) == reference_text_to_sequence(text, cleaner_names), repr(text)
+
+
+@pytest.mark.parametrize('cleaner_names', [['english_cleaners'], ['basic_cleaners']])
+def test_text_to_sequence_batch_matches_text_to_sequence(cleaner_names):
+    texts = TEXTS + random_texts(50)
+    sequence, text_lengths = text_to_sequence_batch(texts, cleaner_names, pad_value=0)
+    assert sequence.dtype == text_lengths.dtype == torch.long
+    assert sequence.shape == (len(texts), int(text_lengths.max()))
+    for i, text in enumerate(texts):
+        expected = text_to_sequence(text, cleaner_names)
+        assert text_lengths[i].item() == len(expected)
+        assert sequence[i, :len(expected)].tolist() == expected
+        assert (sequence[i, len(expected):] == 0).all()
+
+
+def test_text_to_sequence_batch_empty():
+    sequence, text_lengths = text_to_sequence_batch([], ['english_cleaners'])
+    assert sequence.shape == (0, 0) and text_lengths.shape == (0,)
@@ -0,0 +1,146 @@
+import json
+import struct
+import threading
+import pytest
+pytest.importorskip("tornado")
+
+import tornado.gen
+import tornado.web
+from tornado.tcpclient import TCPClient
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from job_queue import TTSJobQueue
+from tornado_handlers import JobEventsHandler, TTSStreamHandler
+from audio_writer import wav_header
+from conftest import StubT2S
+
+TIMEOUT = 10
+
+
+def parse_form(form):
+    """Minimal stand-in for app.parse_tts_form."""
+    assert form.get('input_text'), "No input_text found in request form!"
+    return form.get('input_text'), {'speaker_names': form.getlist('input_speaker')}, 'tt', 'wg'
+
+
+def parse_events(body):
+    """Returns the JSON payload of every Server-Sent Event in body."""
+    events = body.decode('utf-8').split('\n\n')
+    assert events[-1] == ''
+    assert all(event.startswith('data: ') for event in events[:-1])
+    return [json.loads(event[len('data: '):]) for event in events[:-1]]
+
+
+class JobEventsHandlerTest(AsyncHTTPTestCase):
+    def setUp(self):
+        self.t2s = StubT2S()
+        self.job_queue = TTSJobQueue(self.t2s)
+        super().setUp()
+
+    def get_app(self):
+        return tornado.web.Application([(r"/tts_job/([0-9a-f]+)/events", JobEventsHandler, dict(job_queue=self.job_queue, poll_interval=0.01))])
+
+    def fetch_events(self, job, release_after=0.2):
+        """Fetch the job's event stream, letting the stub finish the job after release_after seconds."""
+        timer = threading.Timer(release_after, self.t2s.release.put, (True,))
+        timer.start()
+        try:
+            response = self.fetch(f"/tts_job/{job.id}/events", request_timeout=TIMEOUT)
+        finally:
+            timer.cancel()
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'text/event-stream')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        return parse_events(response.body)
+
+    def test_events_end_with_terminal_state(self):
+        job = self.job_queue.submit('hello', {}, 'tt', 'wg')
+        events = self.fetch_events(job)
+        self.assertEqual(events[0]['id'], job.id)
+        self.assertIn(events[0]['status'], ('queued', 'running'))
+        self.assertEqual(len(events), len({json.dumps(e) for e in events})) # (only changes are sent)
+        self.assertEqual(events[-1], self.job_queue.status(job))
+        self.assertEqual(events[-1]['status'], 'done')
+        self.assertEqual(events[-1]['voice'], f"{job.id}.wav")
+        self.assertIsNotNone(events[-1]['finished'])
+
+    def test_failed_job_sends_terminal_state(self):
+        job = self.job_queue.submit('fail', {}, 'tt', 'wg')
+        events = self.fetch_events(job)
+        self.assertEqual(events[-1]['status'], 'failed')
+        self.assertEqual(events[-1]['error'], 'ValueError: stub failure')
+
+    def test_finished_job_sends_one_event(self):
+        job = self.job_queue.submit('hello', {}, 'tt', 'wg')
+        self.t2s.release.put(True)
+        self.assertTrue(job.done_event.wait(TIMEOUT))
+        events = self.fetch_events(job)
+        self.assertEqual([e['status'] for e in events], ['done'])
+
+    def test_unknown_job(self):
+        response = self.fetch("/tts_job/0123abcd/events")
+        self.assertEqual(response.code, 404)
+
+
+class TTSStreamHandlerTest(AsyncHTTPTestCase):
+    def setUp(self):
+        self.t2s = StubT2S(n_segments=4)
+        self.t2s.release.put(True) # (infer_stream starts straight away)
+        self.job_queue = TTSJobQueue(self.t2s, max_stream_chunks=1)
+        super().setUp()
+
+    def get_app(self):
+        return tornado.web.Application([(r"/tts_stream", TTSStreamHandler, dict(job_queue=self.job_queue, parse_form=parse_form))])
+
+    def test_streams_segments_in_order(self):
+        received = []
+        response = self.fetch("/tts_stream?input_text=hello&input_speaker=a&input_speaker=b", streaming_callback=received.append, request_timeout=TIMEOUT)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'audio/wav')
+        self.assertEqual(response.headers['Transfer-Encoding'], 'chunked') # (the response has finished, so the final chunk was sent)
+        job = self.job_queue.get(response.headers['X-Job-Id'])
+        self.assertEqual(self.t2s.calls, [(['hello'], {'speaker_names': ['a', 'b']})])
+
+        body = b''.join(received)
+        self.assertEqual(body[:44], wav_header(8000))
+        riff_size, data_size = struct.unpack('<I', body[4:8])[0], struct.unpack('<I', body[40:44])[0]
+        self.assertEqual((riff_size, data_size), (0xFFFFFFFF, 0xFFFFFFFF)) # (unknown length)
+        samples = struct.unpack(f'<{(len(body)-44)//2}h', body[44:])
+        self.assertEqual(samples, tuple(i for i in range(4) for _ in range(4))) # every segment, in order
+        self.assertTrue(job.done_event.wait(TIMEOUT))
+        self.assertEqual(job.status, 'done')
+
+    def test_post(self):
+        response = self.fetch("/tts_stream", method='POST', body="input_text=hello", request_timeout=TIMEOUT)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(len(response.body), 44 + 4*4*2)
+
+    def test_bad_form(self):
+        response = self.fetch("/tts_stream")
+        self.assertEqual(response.code, 400)
+        self.assertEqual(self.t2s.calls, [])
+
+    def test_failed_before_first_segment(self):
+        response = self.fetch("/tts_stream?input_text=fail", request_timeout=TIMEOUT)
+        self.assertEqual(response.code, 500)
+
+    @gen_test(timeout=TIMEOUT)
+    async def test_client_disconnect_cancels_generator(self):
+        self.t2s.n_segments = 1000
+        stream = await TCPClient().connect('127.0.0.1', self.get_http_port())
+        await stream.write(b"GET /tts_stream?input_text=hello HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        headers = (await stream.read_until(b"\r\n\r\n")).decode('latin-1')
+        self.assertIn('Transfer-Encoding: chunked', headers)
+        job_id = [line.split(': ')[1] for line in headers.split('\r\n') if line.startswith('X-Job-Id')][0]
+        chunk_size = int(await stream.read_until(b"\r\n"), 16)
+        first_chunk = await stream.read_bytes(chunk_size) # (the wav header and the first segment arrive long before the audio has finished)
+        self.assertEqual(first_chunk, wav_header(8000) + struct.pack('<4h', 0, 0, 0, 0))
+        stream.close()
+
+        job = self.job_queue.get(job_id)
+        while not job.done_event.is_set():
+            await tornado.gen.sleep(0.01)
+        self.assertTrue(job.cancelled.is_set())
+        self.assertEqual(job.status, 'cancelled')
+        self.assertTrue(self.t2s.stream_closed.is_set())
+        self.assertLess(self.t2s.n_yielded, 1000)
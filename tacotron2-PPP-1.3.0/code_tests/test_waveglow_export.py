@@ -0,0 +1,69 @@
+import json
+import pytest
+torch = pytest.importorskip("torch")
+
+import efficient_model
+import glow
+from waveglow_export import export_waveglow, load_waveglow_model, prepare_inference_waveglow
+
+WN_CONFIG = {'n_layers': 2, 'n_channels': 8, 'kernel_size': 3, 'speaker_embed_dim': 4, 'rezero': False}
+CORES = { # core: (WaveGlow class, the config keys load_waveglow_model() picks it with)
+    'glow': (glow.WaveGlow, {'yoyo': False, 'yoyo_WN': False}),
+    'efficient_model': (efficient_model.WaveGlow, {'yoyo': True, 'yoyo_WN': False}),
+}
+
+
+@pytest.fixture(params=sorted(CORES))
+def waveglow_files(request, tmp_path):
+    """Returns (waveglow, checkpoint_path, config_fpath) of a tiny randomly initialized WaveGlow saved like a training checkpoint."""
+    WaveGlow, core_config = CORES[request.param]
+    waveglow_config = {**core_config, 'n_mel_channels': 8, 'n_flows': 4, 'n_group': 8, 'n_early_every': 2, 'n_early_size': 2,
+                       'memory_efficient': False, 'spect_scaling': False, 'upsample_mode': 'normal', 'WN_config': WN_CONFIG}
+    data_config = {'win_length': 128, 'hop_length': 32}
+    config_fpath = tmp_path/'config.json'
+    config_fpath.write_text(json.dumps({'waveglow_config': waveglow_config, 'data_config': data_config}))
+
+    torch.manual_seed(1234)
+    waveglow = WaveGlow(**waveglow_config, **data_config)
+    for WN in [m for m in waveglow.modules() if isinstance(m, glow.WN)]: # (end is initialized to zero, which would hide any difference in the cond_layers)
+        torch.nn.init.normal_(WN.end.weight, std=0.1)
+    checkpoint_path = tmp_path/'waveglow.pt'
+    torch.save({'model': waveglow.state_dict(), 'iteration': 10, 'speaker_lookup': {0: 0}}, checkpoint_path)
+    return waveglow.eval(), str(checkpoint_path), str(config_fpath)
+
+
+def infer(waveglow, seed=1234):
+    torch.manual_seed(seed)
+    spect = torch.randn(2, 8, 20)
+    speaker_ids = torch.LongTensor([0, 7])
+    with torch.no_grad():
+        return waveglow.infer(spect, speaker_ids, sigma=0.8)
+
+
+def test_export_matches_original(waveglow_files):
+    waveglow, checkpoint_path, config_fpath = waveglow_files
+    exported = prepare_inference_waveglow(load_waveglow_model(torch.load(checkpoint_path), config_fpath)) # (a copy, the model is modified in-place)
+    assert sum(p.numel() for p in exported.parameters()) <= sum(p.numel() for p in waveglow.parameters())
+    audio = infer(waveglow)
+    assert audio.shape == (2, 20*32)
+    assert torch.allclose(infer(exported), audio, atol=1e-4)
+    assert torch.allclose(infer(exported, seed=4321), infer(waveglow, seed=4321), atol=1e-4)
+
+
+def test_exported_checkpoint_reloads(waveglow_files, tmp_path):
+    waveglow, checkpoint_path, config_fpath = waveglow_files
+    exported = export_waveglow(checkpoint_path, config_fpath, str(tmp_path/'exported.pt'))
+    checkpoint = torch.load(str(tmp_path/'exported.pt'), map_location='cpu')
+    assert checkpoint['inference_export'] and checkpoint['iteration'] == 10
+    W_inverse_keys = [k for k in checkpoint['model'] if k.endswith('W_inverse')]
+    assert len(W_inverse_keys) == 4 # (one per flow)
+
+    reloaded = load_waveglow_model(checkpoint, config_fpath).eval()
+    for k in W_inverse_keys:
+        assert torch.equal(reloaded.state_dict()[k], checkpoint['model'][k])
+    assert torch.equal(infer(reloaded), infer(exported))
+    assert torch.allclose(infer(reloaded), infer(waveglow), atol=1e-4)
+
+    # the W_inverse buffers (and merged cond_layers) only exist in a model that went through prepare_inference_waveglow()
+    with pytest.raises(RuntimeError):
+        load_waveglow_model({**checkpoint, 'inference_export': False}, config_fpath)
@@ -0,0 +1,42 @@
+import pytest
+torch = pytest.importorskip("torch")
+
+from glow import WaveGlow
+from waveglow_utils import chunked_infer
+
+HOP_LENGTH = 32
+
+
+def small_waveglow():
+    torch.manual_seed(1234)
+    WN_config = {'n_layers': 2, 'n_channels': 8, 'kernel_size': 3, 'speaker_embed_dim': 4, 'rezero': False}
+    return WaveGlow(yoyo=False, yoyo_WN=False, n_mel_channels=8, n_flows=4, n_group=8, n_early_every=2, n_early_size=2,
+                    memory_efficient=False, spect_scaling=False, upsample_mode='normal', WN_config=WN_config,
+                    win_length=128, hop_length=HOP_LENGTH).eval()
+
+
+class ConstantVocoder:
+    """Returns 1.0 for every sample, so a correct crossfade gives 1.0 everywhere."""
+    def infer(self, spect, speaker_ids=None, sigma=1.0):
+        return spect.new_ones(spect.size(0), spect.size(2)*HOP_LENGTH)
+
+
+@pytest.mark.parametrize('n_frames', [5, 40, 48, 57, 130])
+def test_chunked_infer_output_length(n_frames):
+    """chunked_infer() gives the same length of audio as a normal infer() call on the whole spectrogram."""
+    waveglow = small_waveglow()
+    mel = torch.randn(8, n_frames)
+    speaker_ids = torch.LongTensor([3])
+    with torch.no_grad():
+        audio = waveglow.infer(mel[None], speaker_ids, sigma=0.5)
+    chunked_audio, = chunked_infer(waveglow, [mel], speaker_ids, HOP_LENGTH, sigma=0.5, chunk_frames=16, overlap_frames=4, max_batch_size=3)
+    assert chunked_audio.shape == (audio.size(1),) == (n_frames*HOP_LENGTH,)
+
+
+@pytest.mark.parametrize('overlap_frames', [0, 1, 4])
+def test_chunked_infer_crossfade_weights_sum_to_one(overlap_frames):
+    mels = [torch.randn(8, n_frames) for n_frames in (3, 16, 35, 70)]
+    outputs = chunked_infer(ConstantVocoder(), mels, torch.arange(len(mels)), HOP_LENGTH, chunk_frames=16, overlap_frames=overlap_frames, max_batch_size=5)
+    for mel, audio in zip(mels, outputs):
+        assert audio.shape == (mel.size(1)*HOP_LENGTH,)
+        assert torch.allclose(audio, torch.ones_like(audio))
@@ -1,16 +1,54 @@
 import random
 import os
 import re
+import json
 import numpy as np
 import torch
 import torch.utils.data
 import librosa
 
 import layers
+from multiprocessing import Pool
 from utils import load_wav_to_torch, load_filepaths_and_text
 from text import text_to_sequence
 
 
+def read_npy_shape(path):
+    """Shape of the array in a '.npy' file, only the header is read."""
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, _, _ = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, _ = np.lib.format.read_array_header_2_0(f)
+    return shape
+
+
+def check_dataset_file(args):
+    """
+    Used by TextMelLoader.checkdataset().
+    PARAMS:
+        args: (path, read_mel_length, cached) where cached is this function's previous output for path (or None)
+    RETURNS:
+        None if path doesn't exist, else [mtime, size, mel_length]. mel_length is -1 if the '.npy' header couldn't be read, None if not read_mel_length.
+    """
+    path, read_mel_length, cached = args
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if cached is not None and cached[0] == stat.st_mtime and cached[1] == stat.st_size and (cached[2] is not None or not read_mel_length):
+        return cached
+    mel_length = None
+    if read_mel_length:
+        try:
+            shape = read_npy_shape(path)
+            mel_length = shape[1] if len(shape) > 1 else 0
+        except (OSError, ValueError):
+            mel_length = -1
+    return [stat.st_mtime, stat.st_size, mel_length]
+
+
 class TextMelLoader(torch.utils.data.Dataset):
     """
         1) loads audio,text pairs
@@ -18,6 +56,7 @@ class TextMelLoader(torch.utils.data.Dataset):
         3) computes mel-spectrograms from audio files.
     """
     def __init__(self, audiopaths_and_text, hparams, check_files=True, TBPTT=True, shuffle=False, speaker_ids=None, audio_offset=0, verbose=False):
+        self.filelist_path = filelist_path = audiopaths_and_text
         self.audiopaths_and_text = load_filepaths_and_text(audiopaths_and_text)
         self.text_cleaners = hparams.text_cleaners
         self.max_wav_value = hparams.max_wav_value
@@ -28,23 +67,34 @@ class TextMelLoader(torch.utils.data.Dataset):
         self.speaker_ids = speaker_ids
         self.audio_offset = audio_offset
         self.shuffle = shuffle
+        self.use_TBPTT = TBPTT and hparams.use_TBPTT # (GTA.py doesn't need spectrogram lengths)
         if speaker_ids is None:
             self.speaker_ids = self.create_speaker_lookup_table(self.audiopaths_and_text)
         
         self.load_torchmoji = hparams.torchMoji_training and hparams.torchMoji_linear
         
-        # ---------- CHECK FILES --------------
-        self.start_token = hparams.start_token
-        self.stop_token = hparams.stop_token
-        if check_files:
-            self.checkdataset(verbose)
-        # -------------- CHECK FILES --------------
-        
         self.stft = layers.TacotronSTFT(
             hparams.filter_length, hparams.hop_length, hparams.win_length,
             hparams.n_mel_channels, hparams.sampling_rate, hparams.mel_fmin,
             hparams.mel_fmax)
         
+        # ---------- CHECK FILES --------------
+        self.start_token = hparams.start_token
+        self.stop_token = hparams.stop_token
+        self.text_ids = {} # text -> int32 numpy array of symbol IDs (from the manifest)
+        self.mel_lengths = {} # audiopath -> spectrogram length (from the manifest, only saved when TBPTT needs them)
+        use_manifest = hparams.use_dataset_manifest if hasattr(hparams, 'use_dataset_manifest') else False
+        manifest_path = filelist_path+'.manifest.npz'
+        manifest_meta = self.get_manifest_meta(filelist_path, hparams, check_files)
+        if use_manifest and self.load_manifest(manifest_path, manifest_meta):
+            print(f"Loaded {len(self.audiopaths_and_text)} files from '{manifest_path}'")
+        else:
+            if check_files:
+                self.checkdataset(verbose)
+            if use_manifest:
+                self.build_manifest(manifest_path, manifest_meta)
+        # -------------- CHECK FILES --------------
+        
         self.sampling_rate = hparams.sampling_rate
         self.filter_length = hparams.filter_length
         self.hop_length = hparams.hop_length
@@ -66,8 +116,8 @@ class TextMelLoader(torch.utils.data.Dataset):
         self.truncated_length = hparams.truncated_length # frames
         
         # -------------- PREDICT LENGTH (TBPTT) --------------
-        if hparams.use_TBPTT:
-            self.audio_lengths = torch.tensor([self.get_mel(x[0]).shape[1] for x in self.audiopaths_and_text]) # get the length of every file (the long way)
+        if self.use_TBPTT:
+            self.audio_lengths = torch.tensor([self.mel_lengths[x[0]] if x[0] in self.mel_lengths else self.get_mel(x[0]).shape[1] for x in self.audiopaths_and_text]) # get the length of every file (the long way if there's no manifest)
         else:
             self.audio_lengths = torch.tensor([self.truncated_length-1 for x in self.audiopaths_and_text]) # use dummy lengths
         self.update_dataloader_indexes()
@@ -117,7 +167,7 @@ class TextMelLoader(torch.utils.data.Dataset):
         
         self.len = len(self.dataloader_indexes)
     
-    def checkdataset(self, verbose=False): # TODO, change for list comprehension which is a few magnitudes faster.
+    def checkdataset(self, verbose=False):
         print("Checking dataset files... ", end="")
         audiopaths_length = len(self.audiopaths_and_text)
         filtered_chars=["☺","␤"]
@@ -126,41 +176,46 @@ class TextMelLoader(torch.utils.data.Dataset):
         music_stuff = True
         start_token = self.start_token
         stop_token = self.stop_token
-        for index, file in enumerate(self.audiopaths_and_text): # index must use seperate iterations from remove
+        for file in self.audiopaths_and_text:
             if music_stuff and r"Songs/" in file[0]:
-                self.audiopaths_and_text[index][1] = "♫" + self.audiopaths_and_text[index][1] + "♫"
-            self.audiopaths_and_text[index][1] = start_token + self.audiopaths_and_text[index][1] + stop_token
+                file[1] = "♫" + file[1] + "♫"
+            file[1] = start_token + file[1] + stop_token
             for filtered_char in filtered_chars:
-                self.audiopaths_and_text[index][1] = self.audiopaths_and_text[index][1].replace(filtered_char,"")
-        i = 0
-        i_offset = 0
-        for i_ in range(len(self.audiopaths_and_text)):
-            i = i_ + i_offset # iterating on an array you're also updating will cause some indexes to be skipped.
-            if i == len(self.audiopaths_and_text): break
-            file = self.audiopaths_and_text[i]
+                file[1] = file[1].replace(filtered_char,"")
+        
+        # stat every file (and read spectrogram lengths from the '.npy' headers) in parallel, files that haven't changed since the last check are taken from the cache
+        cache_path = self.filelist_path+'.checkcache.json' if self.filelist_path is not None else None
+        cache = {}
+        if cache_path is not None and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r') as f:
+                    cache = json.load(f)
+            except (OSError, ValueError):
+                cache = {}
+        jobs = [(file[0], self.load_mel_from_disk and '.wav' not in file[0], cache.get(file[0])) for file in self.audiopaths_and_text]
+        if len(jobs) > 2048:
+            with Pool(min(os.cpu_count() or 1, 16)) as p:
+                file_infos = p.map(check_dataset_file, jobs, chunksize=1024)
+        else:
+            file_infos = [check_dataset_file(job) for job in jobs]
+        
+        validated = []
+        for file, file_info in zip(self.audiopaths_and_text, file_infos):
             if self.load_mel_from_disk and '.wav' in file[0]:
                 if verbose:
                     print("|".join(file), "\n[warning] in filelist while expecting '.npy' . Being Ignored.")
-                self.audiopaths_and_text.remove(file)
-                i_offset-=1
                 continue
             elif not self.load_mel_from_disk and '.npy' in file[0]:
                 if verbose:
                     print("|".join(file), "\n[warning] in filelist while expecting '.wav' . Being Ignored.")
-                self.audiopaths_and_text.remove(file)
-                i_offset-=1
                 continue
-            if not os.path.exists(file[0]):
+            if file_info is None:
                 if verbose:
                     print("|".join(file), "\n[warning] does not exist and has been ignored")
-                self.audiopaths_and_text.remove(file)
-                i_offset-=1
                 continue
             if not len(file[1]):
                 if verbose:
                     print("|".join(file), "\n[warning] has no text and has been ignored.")
-                self.audiopaths_and_text.remove(file)
-                i_offset-=1
                 continue
             if len(file[1]) < 3:
                 if verbose:
@@ -169,29 +224,98 @@ class TextMelLoader(torch.utils.data.Dataset):
                 if verbose:
                     print("|".join(file), "\n[info] has no ending punctuation.")
             if self.load_mel_from_disk:
-                melspec = torch.from_numpy(np.load(file[0], allow_pickle=True))
-                mel_length = melspec.shape[1]
+                mel_length = file_info[2]
+                if mel_length < 0:
+                    print("|".join(file), "\n[warning] could not be read and has been ignored")
+                    continue
                 if mel_length == 0:
                     print("|".join(file), "\n[warning] has 0 duration and has been ignored")
-                    self.audiopaths_and_text.remove(file)
-                    i_offset-=1
                     continue
             if any(i in file[1] for i in banned_strings):
                 if verbose:
                     print("|".join(file), "\n[info] is in banned strings and has been ignored.")
-                self.audiopaths_and_text.remove(file)
-                i_offset-=1
                 continue
             if any(i in file[0] for i in banned_paths):
                 if verbose:
                     print("|".join(file), "\n[info] is in banned paths and has been ignored.")
-                self.audiopaths_and_text.remove(file)
-                i_offset-=1
                 continue
+            validated.append(file)
+        self.audiopaths_and_text = validated
+        
+        if cache_path is not None:
+            cache.update({job[0]: file_info for job, file_info in zip(jobs, file_infos) if file_info is not None})
+            try:
+                with open(cache_path, 'w') as f:
+                    json.dump(cache, f)
+            except OSError:
+                pass
         print("Done")
         print(audiopaths_length, "items in metadata file")
         print(len(self.audiopaths_and_text), "validated and being used.")
     
+    def get_manifest_meta(self, filelist_path, hparams, check_files):
+        """Everything the manifest depends on, the manifest is rebuilt if any of these change.
+        (note, changes to the audio/mel files themselves are not detected, delete the '.manifest.npz' file after regenerating them)"""
+        filelist_stat = os.stat(filelist_path)
+        return {
+            'filelist_mtime': filelist_stat.st_mtime,
+            'filelist_size': filelist_stat.st_size,
+            'check_files': bool(check_files),
+            'text_cleaners': list(self.text_cleaners),
+            'start_token': self.start_token,
+            'stop_token': self.stop_token,
+            'load_mel_from_disk': bool(self.load_mel_from_disk),
+            'audio_offset': int(self.audio_offset),
+            'stft': [hparams.filter_length, hparams.hop_length, hparams.win_length, hparams.n_mel_channels, hparams.sampling_rate],
+        }
+    
+    def build_manifest(self, manifest_path, meta):
+        """Convert every text to IDs (and get every spectrogram length if using TBPTT) once, then save them along with the checked filelist."""
+        print("Building dataset manifest... ", end="")
+        sequences = [np.asarray(text_to_sequence(x[1], self.text_cleaners), dtype=np.int16) for x in self.audiopaths_and_text]
+        lengths = {}
+        if self.use_TBPTT: # reading the length of every file is slow, skip it if the lengths aren't used
+            lengths['mel_lengths'] = np.array([self.get_mel_length(x[0]) for x in self.audiopaths_and_text], dtype=np.int32)
+        np.savez(manifest_path,
+            meta = np.array(json.dumps(meta, sort_keys=True)),
+            audiopaths = np.array([x[0] for x in self.audiopaths_and_text]),
+            texts = np.array([x[1] for x in self.audiopaths_and_text]),
+            speakers = np.array([x[2] for x in self.audiopaths_and_text]),
+            tokens = np.concatenate(sequences) if len(sequences) else np.zeros(0, dtype=np.int16),
+            token_offsets = np.cumsum([0,]+[len(seq) for seq in sequences]).astype(np.int64),
+            **lengths,
+        )
+        self.text_ids = {x[1]: seq.astype(np.int32) for x, seq in zip(self.audiopaths_and_text, sequences)}
+        if self.use_TBPTT:
+            self.mel_lengths = {x[0]: int(length) for x, length in zip(self.audiopaths_and_text, lengths['mel_lengths'])}
+        print(f"Saved to '{manifest_path}'")
+    
+    def load_manifest(self, manifest_path, meta):
+        """Load the checked filelist, text IDs and spectrogram lengths saved by build_manifest(). Returns False if the manifest is missing or out of date."""
+        if not os.path.exists(manifest_path):
+            return False
+        try:
+            data = np.load(manifest_path)
+            if str(data['meta']) != json.dumps(meta, sort_keys=True):
+                print(f"'{manifest_path}' is out of date and will be rebuilt.")
+                return False
+            audiopaths, texts, speakers = data['audiopaths'].tolist(), data['texts'].tolist(), data['speakers'].tolist()
+            tokens, token_offsets = data['tokens'].astype(np.int32), data['token_offsets']
+            if 'mel_lengths' in data:
+                mel_lengths = data['mel_lengths'].tolist()
+            elif self.use_TBPTT:
+                print(f"'{manifest_path}' has no spectrogram lengths and will be rebuilt.")
+                return False
+            else:
+                mel_lengths = []
+        except (OSError, ValueError, KeyError) as ex:
+            print(f"Failed to load '{manifest_path}' ({ex}), it will be rebuilt.")
+            return False
+        self.audiopaths_and_text = [[audiopath, text, speaker] for audiopath, text, speaker in zip(audiopaths, texts, speakers)]
+        self.text_ids = {text: tokens[token_offsets[i]:token_offsets[i+1]] for i, text in enumerate(texts)}
+        self.mel_lengths = dict(zip(audiopaths, mel_lengths))
+        return True
+    
     def create_speaker_lookup_table(self, audiopaths_and_text):
         speaker_ids = np.sort(np.unique([x[2] for x in audiopaths_and_text]))
         d = {int(speaker_ids[i]): i for i in range(len(speaker_ids))}
@@ -218,6 +342,15 @@ class TextMelLoader(torch.utils.data.Dataset):
                     melspec.size(0), self.stft.n_mel_channels))
         return melspec
     
+    def get_mel_length(self, filename):
+        """Number of spectrogram frames in filename, only the header is read for '.npy' files."""
+        if self.load_mel_from_disk:
+            try:
+                return read_npy_shape(filename)[1]
+            except (ValueError, IndexError):
+                pass
+        return self.get_mel(filename).shape[1]
+    
     def get_mel_text_pair(self, index):
         filelist_index, spectrogram_offset = self.dataloader_indexes[index]
         next_filelist_index, next_spectrogram_offset = self.dataloader_indexes[index+self.total_batch_size] if index+self.total_batch_size < self.len else (None, None)
@@ -239,17 +372,22 @@ class TextMelLoader(torch.utils.data.Dataset):
         
         return (text, mel, speaker_id, torchmoji, preserve_decoder_state)
     
-    def get_torchmoji_hidden(self, audiopath):
+    def get_torchmoji_path(self, audiopath):
         audiopath_without_ext = ".".join(audiopath.split(".")[:-1])
         path_path_len = min(len(audiopath_without_ext), 999)
         file_path_safe = audiopath_without_ext[0:path_path_len]
-        hidden_state = np.load(file_path_safe + "_.npy")
+        return file_path_safe + "_.npy"
+    
+    def get_torchmoji_hidden(self, audiopath):
+        hidden_state = np.load(self.get_torchmoji_path(audiopath))
         return torch.from_numpy(hidden_state).float()
     
     def get_speaker_id(self, speaker_id):
         return torch.IntTensor([self.speaker_ids[int(speaker_id)]])
     
     def get_text(self, text):
+        if text in self.text_ids: # precomputed by the manifest
+            return torch.from_numpy(self.text_ids[text])
         text_norm = torch.IntTensor(text_to_sequence(text, self.text_cleaners))
         return text_norm
     
@@ -302,7 +302,8 @@ class InvertibleConv1x1(nn.Conv1d):
         super().__init__(c, c, 1, bias=False) # init as nn.Conv1d(c, c, kernel_size=1, stride=1) 
         
         # Sample a random orthonormal matrix to initialize weights
-        W = torch.qr(torch.FloatTensor(c, c).normal_())[0]
+        qr = getattr(getattr(torch, 'linalg', None), 'qr', torch.qr) # (torch.qr was removed in newer PyTorch versions)
+        W = qr(torch.FloatTensor(c, c).normal_())[0]
         
         # Ensure determinant is 1.0 not -1.0
         if torch.det(W) < 0:
@@ -329,8 +330,8 @@ class InvertibleConv1x1(nn.Conv1d):
         W = self.weight.squeeze()
         if not hasattr(self, 'W_inverse'):
             W_inverse = W.float().inverse().unsqueeze(-1)
-            if audio_out.dtype == torch.float16:
-                W_inverse = W_inverse.half()
+            if audio_out.dtype != torch.float32:
+                W_inverse = W_inverse.to(audio_out.dtype) # fp16/bf16
             self.W_inverse = W_inverse
         
         if hasattr(self, 'efficient_inverse'):
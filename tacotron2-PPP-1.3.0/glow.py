@@ -41,6 +41,29 @@ def fused_add_tanh_sigmoid_multiply(input_a, input_b, n_channels):
     return acts
 
 
+def can_fold_speaker_embed(layer):
+    """True if layer is a (weight norm free) 1x1 conv, so the speaker embedding half of it's input can be precomputed."""
+    return (isinstance(layer, nn.Conv1d) and layer.kernel_size == (1,) and layer.stride == (1,) and layer.padding == (0,)
+            and layer.dilation == (1,) and layer.groups == 1 and not hasattr(layer, 'weight_g'))
+
+
+@torch.no_grad()
+def cond_layer_with_speaker(wn, layer, spect, speaker_id):
+    """
+    Inference only. Returns layer(torch.cat([spect, speaker embeddings repeated over time], dim=1)) without creating the concatenated tensor.
+    The speaker embedding's part of the 1x1 conv is the same for every frame, so it's computed once for every speaker in wn.speaker_embed
+    and reused by every call (and every frame) until the weights change.
+    """
+    n_spect_channels = spect.size(1)
+    weight, embed_weight = layer.weight, wn.speaker_embed.weight
+    key = (weight.data_ptr(), weight._version, weight.dtype, weight.device, embed_weight.data_ptr(), embed_weight._version, n_spect_channels)
+    if getattr(wn, 'speaker_projection_key', None) != key:
+        wn.register_buffer('cond_spect_weight', weight[:, :n_spect_channels].contiguous(), persistent=False) # [out, n_mel, 1]
+        wn.register_buffer('speaker_projection', F.linear(embed_weight.to(weight.dtype), weight[:, n_spect_channels:, 0], layer.bias), persistent=False) # [n_speakers, out]
+        wn.speaker_projection_key = key
+    return F.conv1d(spect, wn.cond_spect_weight) + wn.speaker_projection[speaker_id].unsqueeze(-1)
+
+
 class WaveGlowLoss(nn.Module):
     def __init__(self, sigma=1.0):
         super(WaveGlowLoss, self).__init__()
@@ -74,7 +97,8 @@ class Invertible1x1Conv(nn.Module):
                                     bias=False)
         
         # Sample a random orthonormal matrix to initialize weights
-        W = torch.qr(torch.FloatTensor(c, c).normal_())[0]
+        qr = getattr(getattr(torch, 'linalg', None), 'qr', torch.qr) # (torch.qr was removed in newer PyTorch versions)
+        W = qr(torch.FloatTensor(c, c).normal_())[0]
         
         # Ensure determinant is 1.0 not -1.0
         if torch.det(W) < 0:
@@ -92,8 +116,7 @@ class Invertible1x1Conv(nn.Module):
                 # Reverse computation
                 W_inverse = W.float().inverse()
                 W_inverse = Variable(W_inverse[..., None])
-                if z.dtype == 'torch.float16':
-                    W_inverse = W_inverse.half()
+                W_inverse = W_inverse.to(z.dtype) # fp16/bf16
                 self.W_inverse = W_inverse
             z = F.conv1d(z, self.W_inverse, bias=None, stride=1, padding=0)
             return z
@@ -190,12 +213,17 @@ class WN(nn.Module):
         output = torch.zeros_like(audio)
         n_channels_tensor = torch.IntTensor([self.n_channels])
         
+        cond_layers = self.cond_layers
         if self.speaker_embed_dim and speaker_id != None: # add speaker embeddings to spectrogram (channel dim)
-            speaker_embeddings = self.speaker_embed(speaker_id)
-            speaker_embeddings = speaker_embeddings.unsqueeze(-1).repeat(1, 1, spect.shape[2]) # shape like spect
-            spect = torch.cat([spect, speaker_embeddings], dim=1) # and concat them
+            if not self.training and len(cond_layers) and can_fold_speaker_embed(cond_layers[0]): # same result without the [B, n_mel+embed, T] tensor
+                spect = cond_layer_with_speaker(self, cond_layers[0], spect, speaker_id)
+                cond_layers = cond_layers[1:]
+            else:
+                speaker_embeddings = self.speaker_embed(speaker_id)
+                speaker_embeddings = speaker_embeddings.unsqueeze(-1).repeat(1, 1, spect.shape[2]) # shape like spect
+                spect = torch.cat([spect, speaker_embeddings], dim=1) # and concat them
         
-        for layer in self.cond_layers:
+        for layer in cond_layers:
             spect = layer(spect)
         
         for i in range(self.n_layers): # note, later layers learn lower frequency information
@@ -340,10 +368,7 @@ class WaveGlow(nn.Module):
             audio = self.convinv[k](audio, reverse=True)
             
             if k % self.n_early_every == 0 and k > 0:
-                if spect.type() == 'torch.cuda.HalfTensor':
-                    z = torch.cuda.HalfTensor(spect.size(0), self.n_early_size, spect.size(2)).normal_()
-                else:
-                    z = torch.cuda.FloatTensor(spect.size(0), self.n_early_size, spect.size(2)).normal_()
+                z = spect.new_empty((spect.size(0), self.n_early_size, spect.size(2))).normal_() # same device and dtype as spect
                 audio = torch.cat((sigma*z, audio),1)
         
         audio = audio.permute(0,2,1).contiguous().view(audio.size(0), -1).data
@@ -355,7 +380,7 @@ class WaveGlow(nn.Module):
         for WN in waveglow.WN:
             WN.start = nn.utils.remove_weight_norm(WN.start)
             WN.in_layers = remove(WN.in_layers)
-            WN.cond_layer = nn.utils.remove_weight_norm(WN.cond_layer)
+            WN.cond_layers = remove(WN.cond_layers)
             WN.res_skip_layers = remove(WN.res_skip_layers)
         return waveglow
 
@@ -29,6 +29,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
+from glow import can_fold_speaker_embed, cond_layer_with_speaker
 
 
 @torch.jit.script
@@ -74,7 +75,8 @@ class Invertible1x1Conv(nn.Module):
                                     bias=False)
         
         # Sample a random orthonormal matrix to initialize weights
-        W = torch.qr(torch.FloatTensor(c, c).normal_())[0]
+        qr = getattr(getattr(torch, 'linalg', None), 'qr', torch.qr) # (torch.qr was removed in newer PyTorch versions)
+        W = qr(torch.FloatTensor(c, c).normal_())[0]
         
         # Ensure determinant is 1.0 not -1.0
         if torch.det(W) < 0:
@@ -201,12 +203,17 @@ class WN(nn.Module):
         output = torch.zeros_like(audio)
         n_channels_tensor = torch.IntTensor([self.n_channels])
         
+        cond_layers = self.cond_layers
         if self.speaker_embed_dim and speaker_id != None: # add speaker embeddings to spectrogram (channel dim)
-            speaker_embeddings = self.speaker_embed(speaker_id)
-            speaker_embeddings = speaker_embeddings.unsqueeze(-1).repeat(1, 1, spect.shape[2]) # shape like spect
-            spect = torch.cat([spect, speaker_embeddings], dim=1) # and concat them
+            if not self.training and len(cond_layers) and can_fold_speaker_embed(cond_layers[0]): # same result without the [B, n_mel+embed, T] tensor
+                spect = cond_layer_with_speaker(self, cond_layers[0], spect, speaker_id)
+                cond_layers = cond_layers[1:]
+            else:
+                speaker_embeddings = self.speaker_embed(speaker_id)
+                speaker_embeddings = speaker_embeddings.unsqueeze(-1).repeat(1, 1, spect.shape[2]) # shape like spect
+                spect = torch.cat([spect, speaker_embeddings], dim=1) # and concat them
         
-        for layer in self.cond_layers:
+        for layer in cond_layers:
             spect = layer(spect)
         
         if audio.size(2) > spect.size(2): # if spectrogram hasn't been upsampled yet
@@ -359,10 +366,7 @@ class WaveGlow(nn.Module):
             audio = self.convinv[k](audio, reverse=True)
             
             if k % self.n_early_every == 0 and k > 0:
-                if spect.type() == 'torch.cuda.HalfTensor':
-                    z = torch.cuda.HalfTensor(spect.size(0), self.n_early_size, spect.size(2)).normal_()
-                else:
-                    z = torch.cuda.FloatTensor(spect.size(0), self.n_early_size, spect.size(2)).normal_()
+                z = spect.new_empty((spect.size(0), self.n_early_size, spect.size(2))).normal_() # same device and dtype as spect
                 audio = torch.cat((sigma*z, audio),1)
         
         audio = audio.permute(0,2,1).contiguous().view(audio.size(0), -1).data
@@ -29,6 +29,7 @@ def create_hparams(hparams_string=None, verbose=False):
         # Data Parameters              #
         ################################
         check_files=False, # check all files exist, aren't corrupted, have text, good length, and other stuff before training.
+        use_dataset_manifest=False, # save the checked filelist, text IDs and mel lengths next to each filelist ('*.manifest.npz') the first time it's loaded, and load that instead on later runs.
         load_mel_from_disk=True,
         speakerlist='/media/cookie/Samsung 860 QVO/ClipperDatasetV2/filelists/speaker_ids.txt',
         use_saved_speakers=True, # use the speaker lookups saved inside the model instead of generating again
@@ -60,8 +61,14 @@ def create_hparams(hparams_string=None, verbose=False):
         # Synthesis/Inference Related
         gate_threshold=0.5,
         gate_delay=10,
+        gate_check_interval=8, # decoder steps between each GPU->CPU read of the stopping condition during inference. Higher = less syncing but more wasted frames.
         max_decoder_steps=3000,
         low_vram_inference=False, # doesn't save alignment and gate information, frees up some vram, especially for large input sequences.
+        inference_fp16_outputs=False, # store mel/gate outputs in fp16 during inference (only matters for fp32/bf16 models).
+        inference_alignments='full', # 'full', 'half' (store in fp16) or 'none' (don't return alignments). low_vram_inference=True forces 'none'.
+        cuda_graph_inference=False, # capture each decoder step as a CUDA graph (requires PyTorch 1.10+), much less CPU overhead at small/medium batch sizes.
+        inference_attention_window=0, # (attention_type 0) only compute attention energies/softmax over this many encoder positions around the previous step's focus during inference. Rows where the attention reaches the edge of the window are recomputed over the full input (this reads the number of such rows on the host every step, so windowed steps aren't captured as CUDA graphs). 0 = disabled. e.g: 64
+        inference_attention_leak=1e-3, # max attention weight allowed in the outer 1/8th of either side of the window before a row is recomputed over the full input.
         
         # Teacher-forcing Config
         p_teacher_forcing=1.00,    # 1.00 baseline
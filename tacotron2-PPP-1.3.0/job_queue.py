@@ -0,0 +1,196 @@
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+
+
+def freeze(x):
+    """Make form values (lists, dicts) hashable so they can be compared."""
+    if isinstance(x, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in x.items()))
+    if isinstance(x, (list, tuple)):
+        return tuple(freeze(v) for v in x)
+    return x
+
+
+class TTSJob:
+    """A single text-to-speech request waiting for (or being processed by) the GPU worker."""
+    def __init__(self, text, params, tt_model, wg_model, stream=False, max_chunks=16):
+        self.id = uuid.uuid4().hex
+        self.text = text
+        self.params = params # kwargs for T2S.infer (everything except the text)
+        self.tt_model = tt_model
+        self.wg_model = wg_model
+        self.status = 'queued' # 'queued' -> 'running' -> 'done', 'failed' or 'cancelled'
+        self.result = None
+        self.error = None
+        self.n_coalesced = 1 # number of requests that shared batches with this one
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done_event = threading.Event()
+        self.cancelled = threading.Event() # set when the client is no longer waiting for the result
+        self.stream = stream # if True, segments are put into self.chunks as they're generated instead of being written to disk
+        self.chunks = queue.Queue(maxsize=max_chunks) # segment dicts from T2S.infer_stream, followed by None once the job has finished
+
+    def put_chunk(self, segment, poll_interval=0.5):
+        """Wait for space in self.chunks (the client reading slower than segments are generated) unless the job is cancelled.
+        Returns False if the segment was dropped because the job was cancelled."""
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(segment, timeout=poll_interval)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def batch_key(self):
+        """Jobs with the same key can be processed in the same Tacotron2/WaveGlow batches."""
+        return (self.tt_model, self.wg_model, self.stream, freeze(self.params))
+
+    def to_dict(self):
+        d = {
+            'id': self.id,
+            'status': self.status,
+            'n_coalesced': self.n_coalesced,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'error': self.error,
+        }
+        if self.result is not None:
+            filenames, gen_time, gen_dur, total_specs, n_passes, avg_score = self.result
+            d.update({
+                'voice': filenames,
+                'gen_time': round(float(gen_time), 2),
+                'gen_dur': round(float(gen_dur), 2),
+                'total_specs': int(total_specs),
+                'n_passes': int(n_passes),
+                'avg_score': round(float(avg_score), 3),
+            })
+        return d
+
+
+class TTSJobQueue:
+    """Runs T2S.infer on a single dedicated worker thread.
+
+    Requests are enqueued and return immediately, the worker drains the queue and
+    merges queued requests with matching models/settings into a single T2S.infer call
+    so they share Tacotron2 batches instead of being processed one after another.
+    """
+    def __init__(self, t2s, max_coalesce=8, max_finished_jobs=256, max_stream_chunks=16):
+        self.t2s = t2s
+        self.max_coalesce = max(int(max_coalesce), 1)
+        self.max_finished_jobs = max_finished_jobs
+        self.max_stream_chunks = max(int(max_stream_chunks), 1)
+
+        self.pending = deque()
+        self.jobs = {} # job_id -> TTSJob
+        self.finished_ids = deque()
+        self.cond = threading.Condition()
+
+        self.worker = threading.Thread(target=self._worker_loop, name="T2S-worker", daemon=True)
+        self.worker.start()
+
+    def submit(self, text, params, tt_model, wg_model, stream=False):
+        job = TTSJob(text, params, tt_model, wg_model, stream=stream, max_chunks=self.max_stream_chunks)
+        with self.cond:
+            self.jobs[job.id] = job
+            self.pending.append(job)
+            self.cond.notify()
+        return job
+
+    def cancel(self, job):
+        """Stop working on job. Queued jobs are removed from the queue, running stream jobs stop receiving segments
+        (and the batch is stopped once every job in it has been cancelled)."""
+        with self.cond:
+            job.cancelled.set()
+            if job.status != 'queued' or job not in self.pending:
+                return
+            self.pending.remove(job)
+            job.status = 'cancelled'
+            job.finished = time.time()
+            self.finished_ids.append(job.id)
+        job.done_event.set()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def status(self, job):
+        d = job.to_dict()
+        with self.cond:
+            d['position'] = self.pending.index(job) if job.status == 'queued' and job in self.pending else 0
+        return d
+
+    def _take_batch(self):
+        """Block till a job is available, then take it along with any compatible queued jobs."""
+        with self.cond:
+            while not len(self.pending):
+                self.cond.wait()
+            first_job = self.pending.popleft()
+            key = first_job.batch_key()
+            jobs = [first_job,]
+            for job in list(self.pending):
+                if len(jobs) >= self.max_coalesce:
+                    break
+                if job.batch_key() == key:
+                    self.pending.remove(job)
+                    jobs.append(job)
+            for job in jobs:
+                job.status = 'running'
+                job.started = time.time()
+                job.n_coalesced = len(jobs)
+        return jobs
+
+    def _worker_loop(self):
+        while True:
+            jobs = self._take_batch()
+            self._run(jobs)
+
+    def _run(self, jobs):
+        tt_model, wg_model = jobs[0].tt_model, jobs[0].wg_model
+        print(f"Processing {len(jobs)} queued request(s).")
+        try:
+            # update tacotron if needed
+            if self.t2s.tt_current != tt_model:
+                self.t2s.update_tt(tt_model)
+
+            # update waveglow if needed
+            if self.t2s.wg_current != wg_model:
+                self.t2s.update_wg(wg_model)
+
+            if jobs[0].stream:
+                # pass each segment to it's job as soon as it's ready
+                segments = self.t2s.infer_stream([job.text for job in jobs], **jobs[0].params)
+                try:
+                    for segment in segments:
+                        jobs[segment['request']].put_chunk(segment)
+                        if all(job.cancelled.is_set() for job in jobs): # nobody is listening anymore
+                            break
+                finally:
+                    segments.close()
+                for job in jobs:
+                    job.status = 'cancelled' if job.cancelled.is_set() else 'done'
+            else:
+                results = self.t2s.infer([job.text for job in jobs], filename_prefix=[job.id for job in jobs], **jobs[0].params)
+                for job, result in zip(jobs, results):
+                    job.result = result
+                    job.status = 'done'
+        except Exception as ex:
+            traceback.print_exc()
+            for job in jobs:
+                job.status = 'failed'
+                job.error = f'{type(ex).__name__}: {ex}'
+        finally:
+            for job in jobs:
+                if job.stream:
+                    job.put_chunk(None) # end of stream (dropped if the client has gone)
+            with self.cond:
+                for job in jobs:
+                    job.finished = time.time()
+                    job.done_event.set()
+                    self.finished_ids.append(job.id)
+                while len(self.finished_ids) > self.max_finished_jobs: # forget the oldest finished jobs
+                    self.jobs.pop(self.finished_ids.popleft(), None)
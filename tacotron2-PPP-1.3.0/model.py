@@ -1,4 +1,5 @@
 from math import sqrt
+import warnings
 import numpy as np
 from numpy import finfo
 import torch
@@ -14,9 +15,11 @@ from TPGST import GST # Other GST implementation
 
 drop_rate = 0.5
 
-def load_model(hparams):
+def load_model(hparams, device=None):
     model = Tacotron2(hparams)
-    if torch.cuda.is_available(): model = model.cuda()
+    if device is None: # (training default) CUDA if available
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = model.to(device)
     if hparams.fp16_run:
         if hparams.attention_type in [0,2]:
             model.decoder.attention_layer.score_mask_value = finfo('float16').min
@@ -28,6 +31,15 @@ def load_model(hparams):
     return model
 
 
+def grow_buffer(buffer, new_len, dim=1):
+    """Returns buffer zero-padded along dim to new_len."""
+    if buffer is None or buffer.size(dim) >= new_len:
+        return buffer
+    shape = list(buffer.shape)
+    shape[dim] = new_len-buffer.size(dim)
+    return torch.cat((buffer, buffer.new_zeros(shape)), dim=dim)
+
+
 class LSTMCellWithZoneout(nn.LSTMCell):
     def __init__(self, input_size, hidden_size, bias=True, zoneout_prob=0.1):
         super().__init__(input_size, hidden_size, bias)
@@ -130,6 +142,66 @@ class Attention(nn.Module):
         attention_context = attention_context.squeeze(1) # squeeze
         
         return attention_context, attention_weights
+    
+    def windowed_forward(self, attention_hidden_state, memory, processed_memory,
+                attention_weights_cat, mask, window_len, leak_threshold=1e-3):
+        """
+        Inference only. Same as forward() but energies/softmax are only computed for window_len encoder positions around the
+        previous step's attention argmax, so each step costs O(window_len) instead of O(enc_len).
+        Rows where the attention reaches the edge of the window (more than leak_threshold of the weight in the outer
+        window_len//8 positions of a side that isn't the end of the input) are recomputed over the full input.
+        PARAMS
+        ------
+        (same as forward())
+        window_len: number of encoder positions to attend over
+        leak_threshold: max attention weight allowed at either edge of the window before a row is recomputed over the full input.
+        
+        RETURNS
+        -------
+        (attention_context, attention_weights) or None if the input isn't longer than the window (use forward() instead).
+        """
+        B, _, enc = attention_weights_cat.shape
+        if enc <= window_len:
+            return None
+        
+        # window starts a quarter behind the current focus (attention moves forward)
+        center = attention_weights_cat[:, 0].argmax(dim=1) # [B]
+        start = (center - window_len//4).clamp_(0, enc-window_len) # [B]
+        index = start.unsqueeze(1) + torch.arange(window_len, device=start.device) # [B, win]
+        
+        # location conv over the window (+ kernel_size//2 either side, zero padded at the ends like the full conv)
+        conv = self.location_layer.location_conv.conv
+        pad = conv.padding[0]
+        loc_index = start.unsqueeze(1) + torch.arange(window_len+2*pad, device=start.device) # [B, win+2*pad]
+        loc_input = F.pad(attention_weights_cat, (pad, pad)).gather(2, loc_index.unsqueeze(1).expand(-1, 2, -1)) # [B, 2, win+2*pad]
+        processed = F.conv1d(loc_input, conv.weight, conv.bias) # [B, n_filters, win]
+        processed = self.location_layer.location_dense(processed.transpose(1, 2)) # [B, win, attention_dim]
+        
+        processed.add_( self.query_layer(attention_hidden_state.unsqueeze(1)).expand_as(processed) )
+        processed.add_( processed_memory.gather(1, index.unsqueeze(2).expand(-1, -1, processed_memory.size(2))) )
+        alignment = self.v( torch.tanh( processed ) ).squeeze(-1) # [B, win]
+        
+        if mask is not None:
+            alignment.masked_fill_(mask.gather(1, index), self.score_mask_value)
+        window_weights = F.softmax(alignment, dim=1) # [B, win]
+        memory_window = memory.gather(1, index.unsqueeze(2).expand(-1, -1, memory.size(2))) # [B, win, enc_dim]
+        attention_context = torch.bmm(window_weights.unsqueeze(1), memory_window).squeeze(1) # [B, enc_dim]
+        attention_weights = window_weights.new_zeros(B, enc).scatter_(1, index, window_weights) # [B, enc]
+        
+        # the window is too small for a row if the attention is still rising towards either edge (computed on the device)
+        edge = max(window_len//8, 1)
+        leaked = ((start > 0) & (window_weights[:, :edge].sum(dim=1) > leak_threshold)) | ((start+window_len < enc) & (window_weights[:, -edge:].sum(dim=1) > leak_threshold)) # [B]
+        
+        # recompute only the leaking rows over the full input
+        leaked_rows = leaked.nonzero().squeeze(1) # (reads the number of leaking rows on the host)
+        if leaked_rows.numel():
+            full_context, full_weights = self.forward(attention_hidden_state.index_select(0, leaked_rows), memory.index_select(0, leaked_rows),
+                processed_memory.index_select(0, leaked_rows), attention_weights_cat.index_select(0, leaked_rows),
+                mask.index_select(0, leaked_rows) if mask is not None else None)
+            attention_context = attention_context.index_copy(0, leaked_rows, full_context.to(attention_context.dtype))
+            attention_weights = attention_weights.index_copy(0, leaked_rows, full_weights.to(attention_weights.dtype))
+        
+        return attention_context, attention_weights
 
 
 class DynamicConvolutionAttention(nn.Module):
@@ -156,7 +228,7 @@ class DynamicConvolutionAttention(nn.Module):
         self.vg = LinearNorm(dynamic_filter_num, 1, bias=True)
         
         # prior
-        self.prior_filter = self.get_prior_filter(dynamic_filter_num, dynamic_filter_len).to("cuda")
+        self.register_buffer('prior_filter', self.get_prior_filter(dynamic_filter_num, dynamic_filter_len), persistent=False) # (moves with the model, not saved in checkpoints)
         
         # misc
         self.score_mask_value = -float("inf")
@@ -529,6 +601,105 @@ class Encoder(nn.Module):
         return outputs
 
 
+class DecoderState():
+    """
+    States of a single Decoder inference call (LSTM states, attention weights, memory, mask, ...).
+    Decoder inference keeps it's states in one of these instead of on the module, so one Decoder (one copy of the weights)
+    can run several inference calls at the same time, e.g: from different threads/CUDA streams.
+    Training still uses the Decoder itself as the state (Decoder methods use self if state is None).
+    """
+    names = ['attention_hidden', 'attention_cell', 'decoder_hidden', 'decoder_cell',
+             'attention_weights', 'attention_weights_cum', 'attention_context', 'previous_location',
+             'memory', 'processed_memory', 'mask']
+    
+    def __init__(self):
+        for name in self.names:
+            setattr(self, name, None)
+
+
+class DecoderStepGraph():
+    """
+    A CUDA graph of a single inference step (Prenet + Decoder.decode) for a fixed batch size and encoder length.
+    Decoder states are kept in static buffers so each step is a single graph replay instead of dozens of small kernel launches.
+    Any batch size up to the graph's batch_size can be stepped, the unused rows are zeroed and their outputs are ignored
+    (every op in a step is independent per row), so one graph can be reused while finished items are removed from the batch.
+    Likewise any encoder length up to the graph's enc_length can be stepped, the extra encoder positions are masked
+    so they get no attention weight (the states are views of the first rows/positions of the static buffers).
+    The static buffers are shared by every state stepped with this graph, so a graph should only be used by one inference call at a time.
+    """
+    enc_names = ['attention_weights', 'attention_weights_cum', 'memory', 'processed_memory', 'mask'] # states with an encoder length dim (dim 1)
+    
+    def __init__(self, decoder, state, decoder_input, batch_size, enc_length, pool=None):
+        self.decoder = decoder
+        self.batch_size = batch_size
+        self.enc_length = enc_length
+        self.names = [name for name in DecoderState.names if getattr(state, name, None) is not None or name == 'mask'] # (always masked, for the padded encoder positions)
+        self.static_input = decoder_input.new_zeros((batch_size,)+decoder_input.shape[1:])
+        self.static_states = {}
+        for name in self.names:
+            tensor = getattr(state, name)
+            if tensor is None: # mask
+                tensor = state.memory.new_zeros(state.memory.shape[:2], dtype=torch.bool)
+            shape = (batch_size, enc_length)+tensor.shape[2:] if name in self.enc_names else (batch_size,)+tensor.shape[1:]
+            self.static_states[name] = tensor.new_zeros(shape)
+        self.static_views = {} # {(B, enc_T): {name: static_states[name][:B, :enc_T]}}
+        self.static_state = DecoderState() # the state the graph is captured with (states are loaded into the buffers by step())
+        
+        # warmup on a side stream (required before capture)
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(2):
+                self.set_states(self.static_state)
+                decoder.decode(decoder.prenet(self.static_input), state=self.static_state)
+        torch.cuda.current_stream().wait_stream(stream)
+        
+        self.graph = torch.cuda.CUDAGraph()
+        self.set_states(self.static_state)
+        with torch.cuda.graph(self.graph, pool=pool):
+            self.static_outputs = decoder.decode(decoder.prenet(self.static_input), state=self.static_state)
+            self.new_states = {name: getattr(self.static_state, name) for name in self.names}
+        self.set_states(self.static_state)
+    
+    def get_views(self, B, enc_T):
+        if (B, enc_T) not in self.static_views:
+            self.static_views[(B, enc_T)] = {name: self.static_states[name][:B, :enc_T] if name in self.enc_names else self.static_states[name][:B] for name in self.names}
+        return self.static_views[(B, enc_T)]
+    
+    def set_states(self, state, B=None, enc_T=None):
+        """Point state at the static buffers (the first B rows and enc_T encoder positions of them)."""
+        views = self.static_states if B is None else self.get_views(B, enc_T)
+        for name in self.names:
+            setattr(state, name, views[name])
+    
+    def load_states(self, state):
+        """Copy state into the static buffers if it's tensors aren't the static buffers (e.g. new inference call, or after compact_decoder_states())."""
+        B, enc_T = state.memory.shape[:2]
+        views = self.get_views(B, enc_T)
+        for name in self.names:
+            tensor = getattr(state, name)
+            if tensor is not views[name]:
+                if tensor is None: # (no mask, nothing is padded)
+                    views[name].zero_()
+                else:
+                    views[name].copy_(tensor)
+                self.static_states[name][B:].zero_() # padding rows (zeroed so they can't produce inf/NaN)
+                if name in self.enc_names: # padding encoder positions (masked, so they get no attention)
+                    self.static_states[name][:, enc_T:].fill_(name == 'mask')
+        self.set_states(state, B, enc_T)
+    
+    def step(self, decoder_input, state):
+        B, enc_T = state.memory.shape[:2]
+        self.load_states(state)
+        self.static_input[:B].copy_(decoder_input)
+        self.graph.replay()
+        for name in self.names: # feed the new states back into the inputs for the next step
+            if self.new_states[name] is not self.static_states[name]:
+                self.static_states[name].copy_(self.new_states[name])
+        mel_output, gate_output, attention_weights = self.static_outputs
+        return mel_output[:B].clone(), gate_output[:B].clone(), attention_weights[:B, :enc_T].clone()
+
+
 class Decoder(nn.Module):
     def __init__(self, hparams):
         super(Decoder, self).__init__()
@@ -544,6 +715,7 @@ class Decoder(nn.Module):
         self.prenet_speaker_embed_dim = hparams.prenet_speaker_embed_dim if hasattr(hparams, 'prenet_speaker_embed_dim') else 0
         self.max_decoder_steps = hparams.max_decoder_steps
         self.gate_threshold = hparams.gate_threshold
+        self.gate_delay = hparams.gate_delay if hasattr(hparams, 'gate_delay') else 0
         self.AttRNN_extra_decoder_input = hparams.AttRNN_extra_decoder_input
         self.AttRNN_hidden_dropout_type = hparams.AttRNN_hidden_dropout_type
         self.p_AttRNN_hidden_dropout = hparams.p_AttRNN_hidden_dropout
@@ -560,6 +732,17 @@ class Decoder(nn.Module):
         self.attention_type = hparams.attention_type
         self.attention_layers = hparams.attention_layers
         self.low_vram_inference = hparams.low_vram_inference if hasattr(hparams, 'low_vram_inference') else False
+        self.cuda_graph_inference = hparams.cuda_graph_inference if hasattr(hparams, 'cuda_graph_inference') else False
+        self.inference_fp16_outputs = hparams.inference_fp16_outputs if hasattr(hparams, 'inference_fp16_outputs') else False
+        self.inference_alignments = 'none' if self.low_vram_inference else (hparams.inference_alignments if hasattr(hparams, 'inference_alignments') else 'full')
+        self.inference_initial_frames = 256 # length of the inference output buffers, doubled each time they fill up
+        self.gate_check_interval = hparams.gate_check_interval if hasattr(hparams, 'gate_check_interval') else 8 # how often (in decoder steps) the stopping condition is copied to the CPU
+        self.max_step_graphs = 16 # max number of captured batch sizes/encoder lengths to keep
+        self.step_graph_enc_bucket = 64 # encoder lengths are rounded up to a multiple of this for the CUDA graphs, so texts of similar lengths share a graph
+        self.inference_attention_window = hparams.inference_attention_window if hasattr(hparams, 'inference_attention_window') else 0 # (attention_type 0 only) 0 = attend over the full input
+        self.inference_attention_leak = hparams.inference_attention_leak if hasattr(hparams, 'inference_attention_leak') else 1e-3
+        self.step_graphs = {}
+        self.step_graph_pool = None
         self.context_frames = hparams.context_frames
         self.hide_startstop_tokens = hparams.hide_startstop_tokens
         
@@ -642,7 +825,7 @@ class Decoder(nn.Module):
         return decoder_input
     
     
-    def initialize_decoder_states(self, memory, mask, preserve=None, override=None):
+    def initialize_decoder_states(self, memory, mask, preserve=None, override=None, processed_memory=None, state=None):
         """ Initializes attention rnn states, decoder rnn states, attention
         weights, attention cumulative weights, attention context, stores memory
         and stores processed memory
@@ -651,7 +834,10 @@ class Decoder(nn.Module):
         memory: Encoder outputs
         mask: Mask for padded data if training, expects None for inference
         preserve: Batch shape bool tensor of decoder states to preserve
+        processed_memory: (optional) precomputed attention_layer.memory_layer(memory)
+        state: (optional) DecoderState to initialize, default is the Decoder itself
         """
+        state = self if state is None else state
         B = memory.size(0)
         MAX_ENCODE = memory.size(1)
         
@@ -661,59 +847,130 @@ class Decoder(nn.Module):
             assert preserve.shape[0] == B
         
         if hasattr(self, 'attention_hidden') and preserve is not None:
-            self.attention_hidden *= preserve
-            self.attention_hidden.detach_()
-            self.attention_cell *= preserve
-            self.attention_cell.detach_()
+            state.attention_hidden *= preserve
+            state.attention_hidden.detach_()
+            state.attention_cell *= preserve
+            state.attention_cell.detach_()
         else:
-            self.attention_hidden = Variable(memory.data.new( # attention hidden state
+            state.attention_hidden = Variable(memory.data.new( # attention hidden state
                 B, self.attention_rnn_dim).zero_())
-            self.attention_cell = Variable(memory.data.new( # attention cell state
+            state.attention_cell = Variable(memory.data.new( # attention cell state
                 B, self.attention_rnn_dim).zero_())
         
         if hasattr(self, 'decoder_hidden') and preserve is not None:
-            self.decoder_hidden *= preserve
-            self.decoder_hidden.detach_()
-            self.decoder_cell *= preserve
-            self.decoder_cell.detach_()
+            state.decoder_hidden *= preserve
+            state.decoder_hidden.detach_()
+            state.decoder_cell *= preserve
+            state.decoder_cell.detach_()
         else:
-            self.decoder_hidden = Variable(memory.data.new( # LSTM decoder hidden state
+            state.decoder_hidden = Variable(memory.data.new( # LSTM decoder hidden state
                 B, self.decoder_rnn_dim).zero_())
-            self.decoder_cell = Variable(memory.data.new( # LSTM decoder cell state
+            state.decoder_cell = Variable(memory.data.new( # LSTM decoder cell state
                 B, self.decoder_rnn_dim).zero_())
         
         if hasattr(self, 'attention_weights') and preserve is not None: # save all the encoder possible
-            self.saved_attention_weights = self.attention_weights
-            self.saved_attention_weights_cum = self.attention_weights_cum
+            state.saved_attention_weights = state.attention_weights
+            state.saved_attention_weights_cum = state.attention_weights_cum
         
-        self.attention_weights = Variable(memory.data.new( # attention weights of that frame
+        state.attention_weights = Variable(memory.data.new( # attention weights of that frame
             B, MAX_ENCODE).zero_())
-        self.attention_weights_cum = Variable(memory.data.new( # cumulative weights of all frames during that inferrence
+        state.attention_weights_cum = Variable(memory.data.new( # cumulative weights of all frames during that inferrence
             B, MAX_ENCODE).zero_())
         
         if hasattr(self, 'saved_attention_weights') and preserve is not None:
-            COMMON_ENCODE = min(MAX_ENCODE, self.saved_attention_weights.shape[1]) # smallest MAX_ENCODE of the saved and current encodes
-            self.attention_weights[:, :COMMON_ENCODE] = self.saved_attention_weights[:, :COMMON_ENCODE] # preserve any encoding weights possible (some will be part of the previous iterations padding and are gone)
-            self.attention_weights_cum[:, :COMMON_ENCODE] = self.saved_attention_weights_cum[:, :COMMON_ENCODE]
-            self.attention_weights *= preserve
-            self.attention_weights.detach_()
-            self.attention_weights_cum *= preserve
-            self.attention_weights_cum.detach_()
+            COMMON_ENCODE = min(MAX_ENCODE, state.saved_attention_weights.shape[1]) # smallest MAX_ENCODE of the saved and current encodes
+            state.attention_weights[:, :COMMON_ENCODE] = state.saved_attention_weights[:, :COMMON_ENCODE] # preserve any encoding weights possible (some will be part of the previous iterations padding and are gone)
+            state.attention_weights_cum[:, :COMMON_ENCODE] = state.saved_attention_weights_cum[:, :COMMON_ENCODE]
+            state.attention_weights *= preserve
+            state.attention_weights.detach_()
+            state.attention_weights_cum *= preserve
+            state.attention_weights_cum.detach_()
         
         if hasattr(self, 'attention_context') and preserve is not None:
-            self.attention_context *= preserve
-            self.attention_context = self.attention_context.detach()
+            state.attention_context *= preserve
+            state.attention_context = state.attention_context.detach()
         else:
-            self.attention_context = Variable(memory.data.new( # attention output
+            state.attention_context = Variable(memory.data.new( # attention output
                 B, self.encoder_LSTM_dim).zero_())
         
-        self.memory = memory
+        state.memory = memory
         if self.attention_type == 0:
-            self.processed_memory = self.attention_layer.memory_layer(memory) # Linear Layer, [B, enc_T, enc_dim] -> [B, enc_T, attention_dim]
+            state.processed_memory = processed_memory if processed_memory is not None else self.attention_layer.memory_layer(memory) # Linear Layer, [B, enc_T, enc_dim] -> [B, enc_T, attention_dim]
         elif self.attention_type == 1:
-            self.previous_location = Variable(memory.data.new(
+            state.previous_location = Variable(memory.data.new(
                 B, 1, self.num_att_mixtures).zero_())
-        self.mask = mask
+        state.mask = mask
+
+    def inference_step(self, decoder_input, state=None):
+        """ Prenet + Decoder step for inference. Replays a captured CUDA graph if cuda_graph_inference is enabled, else runs the normal Python path.
+        PARAMS
+        ------
+        decoder_input: previous mel output
+        state: DecoderState of this inference call, default is the Decoder itself
+        
+        RETURNS
+        -------
+        mel_output:
+        gate_output: gate output energies
+        attention_weights:
+        """
+        state = self if state is None else state
+        if self.cuda_graph_inference and decoder_input.is_cuda and not self.training and hasattr(torch.cuda, 'CUDAGraph'):
+            # graphs are captured for power of 2 batch sizes, so removing/refilling items only needs a new graph when the batch crosses a power of 2
+            graph_batch_size = 1 << (decoder_input.size(0)-1).bit_length()
+            # and for encoder lengths rounded up to step_graph_enc_bucket (the extra positions are masked).
+            # GMMAttention (attention_type 1) fills masked energies with 0 instead of -inf, so padded positions would get attention, it only uses exact lengths.
+            graph_enc_length = state.memory.size(1)
+            if self.attention_type != 1:
+                graph_enc_length = -(-graph_enc_length//self.step_graph_enc_bucket)*self.step_graph_enc_bucket
+            stream = torch.cuda.current_stream(decoder_input.device).cuda_stream # (each stream gets it's own graphs, so inference calls on different streams don't share static buffers)
+            key = (graph_batch_size, graph_enc_length, decoder_input.dtype, stream)
+            graph = self.step_graphs.get(key)
+            if graph is None:
+                if self.step_graph_pool is None:
+                    self.step_graph_pool = torch.cuda.graph_pool_handle()
+                if len(self.step_graphs) >= self.max_step_graphs: # forget the oldest graph
+                    del self.step_graphs[next(iter(self.step_graphs))]
+                try:
+                    graph = self.step_graphs[key] = DecoderStepGraph(self, state, decoder_input, graph_batch_size, graph_enc_length, pool=self.step_graph_pool)
+                except RuntimeError as ex:
+                    warnings.warn(f"Failed to capture Decoder CUDA graph for batch_size {graph_batch_size}, encoder length {graph_enc_length}. Using normal inference for these inputs.\n{ex}")
+                    graph = self.step_graphs[key] = False
+            if graph:
+                return graph.step(decoder_input, state)
+        
+        decoder_input = self.prenet(decoder_input)
+        return self.decode(decoder_input, state=state)
+    
+    def get_inference_buffers(self, memory, B, n_frames, alignments=True):
+        """ Returns zeroed output buffers for inference
+        RETURNS
+        -------
+        mel_buf: [B, n_frames, n_mel_channels*n_frames_per_step]
+        gate_buf: [B, n_frames]
+        align_buf: [B, n_frames, enc_T] or None if inference_alignments == 'none' and alignments are not required
+        """
+        out_dtype = torch.float16 if self.inference_fp16_outputs else memory.dtype
+        mel_buf = memory.new_zeros(B, n_frames, self.n_mel_channels * self.n_frames_per_step, dtype=out_dtype)
+        gate_buf = memory.new_zeros(B, n_frames, dtype=out_dtype)
+        align_buf = None
+        if alignments or self.inference_alignments != 'none':
+            align_dtype = memory.dtype if self.inference_alignments == 'full' else torch.float16
+            align_buf = memory.new_zeros(B, n_frames, memory.size(1), dtype=align_dtype)
+        return mel_buf, gate_buf, align_buf
+    
+    def compact_decoder_states(self, keep, state=None):
+        """ Removes finished items from the decoder states during inference
+        PARAMS
+        ------
+        keep: LongTensor of batch indices to keep
+        state: DecoderState to compact, default is the Decoder itself
+        """
+        state = self if state is None else state
+        for attr in DecoderState.names:
+            tensor = getattr(state, attr, None)
+            if tensor is not None:
+                setattr(state, attr, tensor.index_select(0, keep))
 
     def parse_decoder_inputs(self, decoder_inputs):
         """ Prepares decoder inputs, i.e. mel outputs
@@ -769,11 +1026,12 @@ class Decoder(nn.Module):
 
         return mel_outputs, gate_outputs, alignments
 
-    def decode(self, decoder_input, attention_weights=None):
+    def decode(self, decoder_input, attention_weights=None, state=None):
         """ Decoder step using stored states, attention and memory
         PARAMS
         ------
         decoder_input: previous mel output
+        state: DecoderState to read/update, default is the Decoder itself
 
         RETURNS
         -------
@@ -781,55 +1039,65 @@ class Decoder(nn.Module):
         gate_output: gate output energies
         attention_weights:
         """
+        state = self if state is None else state
         if self.AttRNN_extra_decoder_input:
-            cell_input = torch.cat((decoder_input, self.attention_context, self.decoder_hidden), -1)
+            cell_input = torch.cat((decoder_input, state.attention_context, state.decoder_hidden), -1)
         else:
-            cell_input = torch.cat((decoder_input, self.attention_context), -1)
+            cell_input = torch.cat((decoder_input, state.attention_context), -1)
         
         if self.normalize_AttRNN_output and self.attention_type == 1:
             cell_input = cell_input.tanh()
         
-        self.attention_hidden, self.attention_cell = self.attention_rnn( # predict next step attention based on cell_input
-            cell_input, (self.attention_hidden, self.attention_cell))
+        state.attention_hidden, state.attention_cell = self.attention_rnn( # predict next step attention based on cell_input
+            cell_input, (state.attention_hidden, state.attention_cell))
         
         if self.p_AttRNN_hidden_dropout:
-            self.attention_hidden = F.dropout(
-                self.attention_hidden, self.p_AttRNN_hidden_dropout, self.training)
+            state.attention_hidden = F.dropout(
+                state.attention_hidden, self.p_AttRNN_hidden_dropout, self.training)
         if self.p_AttRNN_cell_dropout:
-            self.attention_cell = F.dropout(
-                self.attention_cell, self.p_AttRNN_cell_dropout, self.training)
+            state.attention_cell = F.dropout(
+                state.attention_cell, self.p_AttRNN_cell_dropout, self.training)
         
         attention_weights_cat = torch.cat(
-            (self.attention_weights.unsqueeze(1),# attention weights from the last step and 
-             self.attention_weights_cum.unsqueeze(1)), dim=1)# the total attention weights from every step previously summed
-        
-        if self.attention_type == 0:
-            self.attention_context, self.attention_weights = self.attention_layer( # attention_context is the encoder output that is to be used at the current frame(?)
-                self.attention_hidden, self.memory, self.processed_memory, attention_weights_cat, self.mask, attention_weights)
+            (state.attention_weights.unsqueeze(1),# attention weights from the last step and 
+             state.attention_weights_cum.unsqueeze(1)), dim=1)# the total attention weights from every step previously summed
+        
+        windowed = None
+        if self.attention_type == 0 and self.inference_attention_window and attention_weights is None and not self.training and not (
+                state.memory.is_cuda and hasattr(torch.cuda, 'is_current_stream_capturing') and torch.cuda.is_current_stream_capturing()): # (the number of leaking rows is read on the host, which can't be captured in a CUDA graph)
+            windowed = self.attention_layer.windowed_forward(
+                state.attention_hidden, state.memory, state.processed_memory, attention_weights_cat, state.mask,
+                self.inference_attention_window, self.inference_attention_leak)
+        
+        if windowed is not None:
+            state.attention_context, state.attention_weights = windowed
+        elif self.attention_type == 0:
+            state.attention_context, state.attention_weights = self.attention_layer( # attention_context is the encoder output that is to be used at the current frame(?)
+                state.attention_hidden, state.memory, state.processed_memory, attention_weights_cat, state.mask, attention_weights)
         elif self.attention_type == 1:
-            self.attention_context, self.attention_weights, self.previous_location = self.attention_layer(
-                self.attention_hidden, self.memory, self.previous_location, self.mask)
+            state.attention_context, state.attention_weights, state.previous_location = self.attention_layer(
+                state.attention_hidden, state.memory, state.previous_location, state.mask)
         elif self.attention_type == 2:
-            self.attention_context, self.attention_weights = self.attention_layer( # attention_context is the encoder output that is to be used at the current frame(?)
-                self.attention_hidden, attention_weights_cat, self.memory, self.mask, attention_weights)
+            state.attention_context, state.attention_weights = self.attention_layer( # attention_context is the encoder output that is to be used at the current frame(?)
+                state.attention_hidden, attention_weights_cat, state.memory, state.mask, attention_weights)
         else:
             raise NotImplementedError(f"Attention Type {self.attention_type} Invalid")
         
-        self.attention_weights_cum += self.attention_weights# [B, enc]??? # cumulative weights determine how much time has been spent on each encoder_input, should let the model know what has already been said and what still needs to be spoken
+        state.attention_weights_cum += state.attention_weights# [B, enc]??? # cumulative weights determine how much time has been spent on each encoder_input, should let the model know what has already been said and what still needs to be spoken
         
-        decoder_input = torch.cat( (self.attention_hidden, self.attention_context), -1) # cat 6.475ms
+        decoder_input = torch.cat( (state.attention_hidden, state.attention_context), -1) # cat 6.475ms
         
-        self.decoder_hidden, self.decoder_cell = self.decoder_rnn( # lstmcell 12.789ms
-            decoder_input, (self.decoder_hidden, self.decoder_cell))
+        state.decoder_hidden, state.decoder_cell = self.decoder_rnn( # lstmcell 12.789ms
+            decoder_input, (state.decoder_hidden, state.decoder_cell))
         
         if self.p_DecRNN_hidden_dropout:
-            self.decoder_hidden = F.dropout(
-                self.decoder_hidden, self.p_DecRNN_hidden_dropout, self.training)
+            state.decoder_hidden = F.dropout(
+                state.decoder_hidden, self.p_DecRNN_hidden_dropout, self.training)
         if self.p_DecRNN_cell_dropout:
-            self.decoder_cell = F.dropout(
-                self.decoder_cell, self.p_DecRNN_cell_dropout, self.training)
+            state.decoder_cell = F.dropout(
+                state.decoder_cell, self.p_DecRNN_cell_dropout, self.training)
         
-        decoder_hidden_attention_context = torch.cat( (self.decoder_hidden, self.attention_context), dim=1) # cat 6.555ms
+        decoder_hidden_attention_context = torch.cat( (state.decoder_hidden, state.attention_context), dim=1) # cat 6.555ms
         
         gate_prediction = self.gate_layer(decoder_hidden_attention_context) # addmm 5.762ms
         
@@ -839,7 +1107,7 @@ class Decoder(nn.Module):
         
         decoder_output = self.linear_projection(decoder_hidden_attention_context) # addmm 5.621ms
         
-        return decoder_output, gate_prediction, self.attention_weights
+        return decoder_output, gate_prediction, state.attention_weights
 
     def forward(self, memory, decoder_inputs, memory_lengths, preserve_decoder=None, teacher_force_till=None, p_teacher_forcing=None):
         """ Decoder forward pass for training
@@ -896,63 +1164,271 @@ class Decoder(nn.Module):
         
         return mel_outputs, gate_outputs, alignments
 
-    def inference(self, memory, memory_lengths=None):
-        """ Decoder inference
+    def inference(self, memory, memory_lengths=None, n_repeats=1, max_decoder_steps=None, gate_threshold=None, gate_delay=None, return_alignments=False):
+        """ Decoder inference. States are kept in a new DecoderState, so this can be called from several threads/CUDA streams at once.
         PARAMS
         ------
         memory: Encoder outputs
+        memory_lengths: Encoder output lengths for attention masking.
+        n_repeats: number of times to decode each item, memory is only expanded after the attention memory_layer has been applied
+        max_decoder_steps, gate_threshold, gate_delay: (optional) stopping params for this call, default is the Decoder's values
+        return_alignments: always return alignments (e.g. to score the outputs), even if inference_alignments is 'none'
         
         RETURNS
         -------
         mel_outputs: mel outputs from the decoder
         gate_outputs: gate outputs from the decoder
-        alignments: sequence of attention weights from the decoder
+        alignments: sequence of attention weights from the decoder (None if inference_alignments is 'none' and return_alignments is False)
         """
         if self.hide_startstop_tokens: # remove start/stop token from Decoder
             memory = memory[:,1:-1,:]
             memory_lengths = memory_lengths-2
-        decoder_input = self.get_go_frame(memory)
         
-        self.initialize_decoder_states(memory, mask=None if memory_lengths is None else ~get_mask_from_lengths(memory_lengths))
-        
-        sig_max_gates = torch.zeros(decoder_input.size(0))
-        mel_outputs, gate_outputs, alignments, break_point = [], [], [], self.max_decoder_steps
-        for i in range(self.max_decoder_steps):
-            decoder_input = self.prenet(decoder_input)
-            
-            mel_output, gate_output_gpu, alignment = self.decode(decoder_input)
+        processed_memory = None
+        if n_repeats > 1: # expand memory for every repeat
+            if self.attention_type == 0:
+                processed_memory = self.attention_layer.memory_layer(memory).repeat_interleave(n_repeats, dim=0)
+            memory = memory.repeat_interleave(n_repeats, dim=0)
+            if memory_lengths is not None:
+                memory_lengths = memory_lengths.repeat_interleave(n_repeats, dim=0)
+        decoder_input = self.get_go_frame(memory)
+        max_decoder_steps = self.max_decoder_steps if max_decoder_steps is None else max_decoder_steps
+        gate_threshold = self.gate_threshold if gate_threshold is None else gate_threshold
+        gate_delay = self.gate_delay if gate_delay is None else gate_delay
+        
+        state = DecoderState()
+        self.initialize_decoder_states(memory, mask=None if memory_lengths is None else ~get_mask_from_lengths(memory_lengths), processed_memory=processed_memory, state=state)
+        
+        B = decoder_input.size(0)
+        device = decoder_input.device
+        batch_indices = torch.arange(B, device=device) # original batch index of each item still being decoded
+        decoded_lengths = torch.full((B,), max_decoder_steps, dtype=torch.long, device=device) # number of frames generated for each item
+        sig_max_gates = torch.zeros(B, device=device)
+        over_thresh = torch.zeros(B, dtype=torch.bool, device=device) # True once an item's gate has gone over gate_threshold
+        break_points = torch.full((B,), max_decoder_steps, dtype=torch.long, device=device) # step each item will stop at
+        
+        # outputs are written into preallocated buffers (indexed by original batch index) that grow as needed
+        mel_buf, gate_buf, align_buf = self.get_inference_buffers(memory, B, min(self.inference_initial_frames, max_decoder_steps), alignments=return_alignments)
+        all_finished = False
+        for i in range(max_decoder_steps):
+            mel_output, gate_output_gpu, alignment = self.inference_step(decoder_input, state)
             
-            mel_outputs += [mel_output.squeeze(1)]
-            gate_output_cpu = gate_output_gpu.cpu().float() # small operations e.g min(), max() and sigmoid() are faster on CPU # also .float() because Tensor.min() doesn't work on half precision CPU
-            if not self.low_vram_inference:
-                gate_outputs += [gate_output_gpu.squeeze(1)]
-                alignments += [alignment]
+            if i >= mel_buf.size(1): # buffers are full
+                new_len = min(mel_buf.size(1)*2, max_decoder_steps)
+                mel_buf, gate_buf, align_buf = grow_buffer(mel_buf, new_len), grow_buffer(gate_buf, new_len), grow_buffer(align_buf, new_len)
+            mel_buf[batch_indices, i] = mel_output.to(mel_buf.dtype)
+            gate_buf[batch_indices, i] = gate_output_gpu.view(-1).to(gate_buf.dtype)
+            if align_buf is not None:
+                align_buf[batch_indices, i] = alignment.to(align_buf.dtype)
             
+            # stopping condition is tracked on the device, no GPU->CPU sync here
             if self.attention_type == 1 and self.num_att_mixtures == 1:## stop when the attention location is out of the encoder_outputs
-                if self.previous_location.squeeze().item() + 1. > memory.shape[1]:
-                    break
+                newly_over_thresh = (state.previous_location.view(state.previous_location.size(0), -1)[:, 0] + 1. > memory.shape[1]) & ~over_thresh
+                newly_break_point = i
             else:
-                # once ALL batch predictions have gone over gate_threshold at least once, set break_point
+                # once an item's prediction has gone over gate_threshold at least once, set it's break_point
                 if i > 4: # model has very *interesting* starting predictions
-                    sig_max_gates = torch.max(torch.sigmoid(gate_output_cpu), sig_max_gates)# sigmoid -> max
-                if sig_max_gates.min() > self.gate_threshold: # min()  ( implicit item() as well )
-                    break_point = min(break_point, i+self.gate_delay)
+                    sig_max_gates = torch.max(torch.sigmoid(gate_output_gpu.view(-1).float()), sig_max_gates)# sigmoid -> max
+                newly_over_thresh = (sig_max_gates > gate_threshold) & ~over_thresh
+                newly_break_point = i+max(gate_delay, 0) # negative gate_delay still stops on the step the threshold was crossed
+            break_points.masked_fill_(newly_over_thresh, newly_break_point)
+            over_thresh |= newly_over_thresh
             
-            if i >= break_point: # gt
-                break
+            # only read the stopping condition on the host every gate_check_interval steps, items that finish in between generate a few extra frames that get removed below
+            if (i+1) % self.gate_check_interval == 0 or (i+1) == max_decoder_steps:
+                finished_gpu = (break_points <= i)
+                finished = finished_gpu.cpu()
+                if finished.any():
+                    decoded_lengths[batch_indices[finished_gpu]] = break_points[finished_gpu]+1
+                    if finished.all():
+                        all_finished = True
+                        break
+                    # remove finished items from the batch so the next steps only compute items that are still speaking
+                    keep_gpu = (~finished).nonzero().squeeze(1).to(device)
+                    self.compact_decoder_states(keep_gpu, state)
+                    batch_indices, sig_max_gates, over_thresh, break_points = batch_indices[keep_gpu], sig_max_gates[keep_gpu], over_thresh[keep_gpu], break_points[keep_gpu]
+                    mel_output = mel_output[keep_gpu]
             
             decoder_input = mel_output
-        else:
+        if not all_finished:
             print("Warning! Reached max decoder steps")
         
-        mel_outputs, gate_outputs, alignments = self.parse_decoder_outputs(
-            mel_outputs, gate_outputs, alignments)
+        n_steps = int(decoded_lengths.max().item())
+        frame_indices = torch.arange(n_steps, device=device)[None, :]
+        frame_mask = frame_indices < decoded_lengths[:, None] # [B, T_out]
+        
+        # [B, T_out, n_mel_channels*n_frames_per_step] -> [B, n_mel_channels, T_out*n_frames_per_step]
+        mel_outputs = mel_buf[:, :n_steps].masked_fill(~frame_mask[:, :, None], 0.0)
+        mel_outputs = mel_outputs.reshape(B, -1, self.n_mel_channels).transpose(1, 2)
+        alignments = align_buf[:, :n_steps].masked_fill(~frame_mask[:, :, None], 0.0) if align_buf is not None else None
+        
+        # repeat the last gate output of items that stopped early so 'thresh' and 'max' end_modes pick the same frame as before
+        frame_indices = torch.min(frame_indices, (decoded_lengths-1)[:, None])
+        gate_outputs = gate_buf[:, :n_steps].gather(1, frame_indices)
         
         # apply modification to the GPU as well.
         gate_outputs = torch.sigmoid(gate_outputs)
         
         return mel_outputs, gate_outputs, alignments
 
+    
+    def reset_decoder_rows(self, rows, memory, processed_memory, mask, state):
+        """ Starts new candidates in finished rows of the decoder states during inference_pool()
+        PARAMS
+        ------
+        rows: LongTensor of batch indices to reset
+        memory: Encoder outputs of the text each row will now decode
+        processed_memory: memory_layer(memory) (only used by attention_type 0)
+        mask: padding mask of the text each row will now decode
+        state: DecoderState of the inference_pool() call
+        """
+        for attr in ['attention_hidden', 'attention_cell', 'decoder_hidden', 'decoder_cell',
+                     'attention_weights', 'attention_weights_cum', 'attention_context', 'previous_location']:
+            tensor = getattr(state, attr, None)
+            if tensor is not None:
+                tensor[rows] = 0.0
+        state.memory[rows] = memory
+        if self.attention_type == 0:
+            state.processed_memory[rows] = processed_memory
+        state.mask[rows] = mask
+    
+    def inference_pool(self, memory, memory_lengths, sampler, batch_size, max_decoder_steps=None, gate_threshold=None, gate_delay=None):
+        """ Decoder inference for best-of-N sampling.
+        Keeps up to batch_size candidates decoding at once. When a candidate finishes (or the sampler decides it can't
+        beat the best candidate for it's text) it's row is refilled with a new attempt for any text that still needs one.
+        PARAMS
+        ------
+        memory: Encoder outputs of each text [N, enc_T, enc_dim]
+        memory_lengths: Encoder output lengths of each text [N]
+        sampler: decides which text each row decodes and receives finished candidates (see text2speech.BestOfNSampler)
+        batch_size: max number of candidates decoded at the same time
+        max_decoder_steps, gate_threshold, gate_delay: (optional) stopping params for this call, default is the Decoder's values
+        """
+        assert not (self.attention_type == 1 and self.num_att_mixtures == 1), "inference_pool() requires gate outputs to stop, use inference() instead."
+        if self.hide_startstop_tokens: # remove start/stop token from Decoder
+            memory = memory[:,1:-1,:]
+            memory_lengths = memory_lengths-2
+        device = memory.device
+        text_mask = ~get_mask_from_lengths(memory_lengths)
+        text_processed_memory = self.attention_layer.memory_layer(memory) if self.attention_type == 0 else None
+        
+        # pick the texts for the first batch
+        row_text = []
+        while len(row_text) < batch_size:
+            text_index = sampler.next_text()
+            if text_index is None:
+                break
+            row_text.append(text_index)
+        B = len(row_text)
+        if B == 0:
+            return
+        row_text = torch.tensor(row_text, dtype=torch.long) # text index of each row
+        state = DecoderState()
+        self.initialize_decoder_states(memory[row_text.to(device)], mask=text_mask[row_text.to(device)], state=state)
+        gate_threshold = self.gate_threshold if gate_threshold is None else gate_threshold
+        gate_delay = self.gate_delay if gate_delay is None else gate_delay
+        
+        # output buffers, rows write into their own slot so finished rows can be removed without moving outputs
+        T_max = self.max_decoder_steps if max_decoder_steps is None else max_decoder_steps
+        mel_buf, gate_buf, align_buf = self.get_inference_buffers(memory, B, min(self.inference_initial_frames, T_max), alignments=True)
+        row_slot = torch.arange(B, device=device)
+        
+        row_step = torch.zeros(B, dtype=torch.long)  # frame each row is generating (CPU copy, used to size the buffers without syncing)
+        row_step_gpu = torch.zeros(B, dtype=torch.long, device=device)
+        sig_max_gates = torch.zeros(B, device=device)
+        over_thresh = torch.zeros(B, dtype=torch.bool, device=device)
+        break_points = torch.full((B,), T_max, dtype=torch.long, device=device)
+        prev_idx = memory.new_zeros(B).float() # attended encoder position of the previous frame
+        dist = memory.new_zeros(B).float()     # alignment path length so far (for diagonality)
+        focus_cum = memory.new_zeros(B, memory.size(1)).float() # attention summed over the scored frames (for max_focus)
+        scoring = torch.ones(B, dtype=torch.bool, device=device) # False from the first frame with a gate over gate_threshold, later frames aren't scored (see text2speech.get_first_over_thresh())
+        
+        decoder_input = self.get_go_frame(state.memory)
+        i = 0
+        while B > 0:
+            mel_output, gate_output_gpu, alignment = self.inference_step(decoder_input, state)
+            
+            if row_step.max() >= mel_buf.size(1): # buffers are full
+                new_len = min(mel_buf.size(1)*2, T_max)
+                mel_buf, gate_buf, align_buf = grow_buffer(mel_buf, new_len), grow_buffer(gate_buf, new_len), grow_buffer(align_buf, new_len)
+            mel_buf[row_slot, row_step_gpu] = mel_output.to(mel_buf.dtype)
+            gate_buf[row_slot, row_step_gpu] = gate_output_gpu.view(-1).to(gate_buf.dtype)
+            align_buf[row_slot, row_step_gpu] = alignment.to(align_buf.dtype)
+            
+            # update partial alignment metrics (only over the frames the finished candidate will be scored on, so the abort bound never overestimates the punishments)
+            scoring &= (torch.sigmoid(gate_output_gpu.view(-1).float()) < gate_threshold)
+            cur_idx = alignment.argmax(dim=1).float()
+            prev_idx = torch.where(row_step_gpu == 0, cur_idx, prev_idx)
+            dist += ((prev_idx - cur_idx).pow(2) + 1).pow(0.5) * scoring
+            focus_cum += alignment.float() * scoring[:, None]
+            prev_idx = cur_idx
+            
+            # once an item's prediction has gone over gate_threshold at least once, set it's break_point (on the device, no GPU->CPU sync here)
+            sig_max_gates = torch.where(row_step_gpu > 4, torch.max(torch.sigmoid(gate_output_gpu.view(-1).float()), sig_max_gates), sig_max_gates) # model has very *interesting* starting predictions
+            newly_over_thresh = (sig_max_gates > gate_threshold) & ~over_thresh
+            break_points = torch.where(newly_over_thresh, row_step_gpu+max(gate_delay, 0), break_points)
+            over_thresh |= newly_over_thresh
+            
+            check_doomed = (i % sampler.check_interval == 0)
+            if check_doomed or (i+1) % self.gate_check_interval == 0 or row_step.max() >= T_max-1:
+                finished_gpu = (break_points <= row_step_gpu) | (row_step_gpu >= T_max-1)
+                finished = finished_gpu.cpu()
+                
+                # abort candidates that can't beat the best candidate of their text
+                aborted = torch.zeros(B, dtype=torch.bool)
+                if check_doomed:
+                    max_focus = focus_cum.masked_fill(state.mask, 0.0).max(dim=1)[0]
+                    aborted = sampler.doomed(row_text, row_step+1, dist.cpu(), max_focus.cpu().float()) & ~finished
+                
+                # send finished candidates to the sampler
+                if finished.any():
+                    slots = row_slot[finished_gpu]
+                    lengths = (torch.min(break_points, row_step_gpu)+1)[finished_gpu].cpu() # items that finished since the last check generated a few extra frames, ignore them
+                    mels = mel_buf[slots].reshape(slots.size(0), -1, self.n_mel_channels).transpose(1, 2) # [b, T, n_mel*n_frames_per_step] -> [b, n_mel, T*n_frames_per_step]
+                    sampler.add_results(row_text[finished], lengths, mels, torch.sigmoid(gate_buf[slots].float()), align_buf[slots].float())
+                if aborted.any():
+                    sampler.add_aborted(row_text[aborted])
+                
+                free = finished | aborted
+                if free.any():
+                    # start new attempts in the free rows
+                    refill_rows, refill_texts, keep = [], [], torch.ones(B, dtype=torch.bool)
+                    for row in free.nonzero().squeeze(1).tolist():
+                        text_index = sampler.next_text()
+                        if text_index is None:
+                            keep[row] = False
+                        else:
+                            refill_rows.append(row)
+                            refill_texts.append(text_index)
+                    if len(refill_rows):
+                        rows, texts = torch.tensor(refill_rows, dtype=torch.long), torch.tensor(refill_texts, dtype=torch.long)
+                        rows_gpu, texts_gpu = rows.to(device), texts.to(device)
+                        self.reset_decoder_rows(rows_gpu, memory[texts_gpu], None if text_processed_memory is None else text_processed_memory[texts_gpu], text_mask[texts_gpu], state)
+                        mel_output[rows_gpu] = 0.0 # go frame
+                        row_text[rows] = texts
+                        row_step[rows] = -1
+                        row_step_gpu[rows_gpu] = -1
+                        sig_max_gates[rows_gpu] = 0.0
+                        over_thresh[rows_gpu] = False
+                        break_points[rows_gpu] = T_max
+                        dist[rows_gpu] = 0.0
+                        focus_cum[rows_gpu] = 0.0
+                        scoring[rows_gpu] = True
+                    
+                    # remove rows that have nothing left to do
+                    if not keep.all():
+                        keep = keep.nonzero().squeeze(1)
+                        keep_gpu = keep.to(device)
+                        self.compact_decoder_states(keep_gpu, state)
+                        row_slot, mel_output, prev_idx, dist, focus_cum, scoring = row_slot[keep_gpu], mel_output[keep_gpu], prev_idx[keep_gpu], dist[keep_gpu], focus_cum[keep_gpu], scoring[keep_gpu]
+                        row_step_gpu, sig_max_gates, over_thresh, break_points = row_step_gpu[keep_gpu], sig_max_gates[keep_gpu], over_thresh[keep_gpu], break_points[keep_gpu]
+                        row_text, row_step = row_text[keep], row_step[keep]
+                        B = keep.size(0)
+            
+            row_step += 1
+            row_step_gpu += 1
+            i += 1
+            decoder_input = mel_output
 
 class Tacotron2(nn.Module):
     def __init__(self, hparams):
@@ -1057,7 +1533,8 @@ class Tacotron2(nn.Module):
             [mel_outputs, mel_outputs_postnet, gate_outputs, alignments],
             output_lengths)
     
-    def inference(self, text, speaker_ids, style_input=None, style_mode=None, text_lengths=None):
+    def encode(self, text, speaker_ids, style_input=None, style_mode=None, text_lengths=None):
+        """Returns the memory used by the decoder ( Encoder outputs + GST/TorchMoji + Speaker embeddings )."""
         embedded_text = self.embedding(text).transpose(1, 2) # [B, embed, sequence]
         encoder_outputs = self.encoder.inference(embedded_text, speaker_ids=speaker_ids, text_lengths=text_lengths) # [B, time, encoder_out]
         
@@ -1066,20 +1543,20 @@ class Tacotron2(nn.Module):
             if style_mode.lower() == 'mel': # enter any 160 channel mel-spectrogram
                 embedded_gst = self.gst(style_input)
             elif style_mode.lower() == 'zeros': # enter any value, will set style_tokens to 0
-                weights = torch.ones(1, self.token_num).cuda()
-                embedded_gst = self.gst(weights*0.0, ref_mode=0).half()
+                weights = torch.ones(1, self.token_num, device=self.embedding.weight.device)
+                embedded_gst = self.gst(weights*0.0, ref_mode=0).to(self.embedding.weight.dtype)
             elif style_mode.lower() == 'style_token' or  style_mode.lower() == 'token': # should input style_token length list/array
                 assert len(style_input) == self.token_num
-                weights = torch.FloatTensor(style_input).unsqueeze(0).cuda()
-                embedded_gst = self.gst(weights, ref_mode=0).half()
+                weights = torch.FloatTensor(style_input).unsqueeze(0).to(self.embedding.weight.device)
+                embedded_gst = self.gst(weights, ref_mode=0).to(self.embedding.weight.dtype)
             elif style_mode.lower() == 'torchmoji_hidden':
                 assert type(style_input) == torch.Tensor
-                embedded_gst = self.gst(style_input, ref_mode=3).half() # should input hidden_state of torchMoji as tensor
+                embedded_gst = self.gst(style_input, ref_mode=3).to(self.embedding.weight.dtype) # should input hidden_state of torchMoji as tensor
             elif style_mode.lower() == 'torchmoji_string':
                 assert type(style_input) == type(list()) or type(style_input) == type('')
                 if type(style_input) == type(''):
                     style_input = [style_input,]
-                embedded_gst = self.gst(style_input, ref_mode=2).half() # should input text as string
+                embedded_gst = self.gst(style_input, ref_mode=2).to(self.embedding.weight.dtype) # should input text as string
             else:
                 raise NotImplementedError("No style option specified however styles are used in this model.")
             embedded_gst = embedded_gst.repeat(1, encoder_outputs.size(1), 1)
@@ -1089,12 +1566,41 @@ class Tacotron2(nn.Module):
             embedded_speakers = self.speaker_embedding(speaker_ids)[:, None]
             embedded_speakers = embedded_speakers.repeat(1, encoder_outputs.size(1), 1)
             encoder_outputs = torch.cat((encoder_outputs, embedded_speakers), dim=2) # [batch, time, encoder_out]
+        return encoder_outputs
+    
+    def inference(self, text, speaker_ids, style_input=None, style_mode=None, text_lengths=None, encoder_outputs=None, n_repeats=1, run_postnet=True, max_decoder_steps=None, gate_threshold=None, gate_delay=None, return_alignments=False):
+        """
+        encoder_outputs: (optional) output of encode() for these inputs, skips running the Encoder again (e.g. when retrying the same texts).
+        n_repeats: decode each text n_repeats times (outputs are in repeat_interleave order). The Encoder still only runs once per text.
+        run_postnet: if False, mel_outputs_postnet is returned as None. Use postnet_inference() on the selected outputs afterwards.
+        max_decoder_steps, gate_threshold, gate_delay: (optional) stopping params for this call (see Decoder.inference()).
+        return_alignments: return alignments even if the Decoder's inference_alignments is 'none' (e.g. to score the outputs).
+        """
+        if encoder_outputs is None:
+            encoder_outputs = self.encode(text, speaker_ids, style_input=style_input, style_mode=style_mode, text_lengths=text_lengths)
         
         mel_outputs, gate_outputs, alignments = self.decoder.inference(
-            encoder_outputs, memory_lengths=text_lengths)
+            encoder_outputs, memory_lengths=text_lengths, n_repeats=n_repeats, max_decoder_steps=max_decoder_steps, gate_threshold=gate_threshold, gate_delay=gate_delay, return_alignments=return_alignments)
+        mel_outputs = mel_outputs.to(encoder_outputs.dtype) # (if decoder outputs were stored in fp16)
         
-        mel_outputs_postnet = self.postnet(mel_outputs)
-        mel_outputs_postnet.add_(mel_outputs)
+        mel_outputs_postnet = self.postnet_inference(mel_outputs) if run_postnet else None
         
         return self.mask_outputs(
             [mel_outputs, mel_outputs_postnet, gate_outputs, alignments])
+    
+    def postnet_inference(self, mel_outputs):
+        """Run the Postnet (+ residual) on Decoder mel outputs [B, n_mel, T]."""
+        mel_outputs = mel_outputs.to(self.embedding.weight.dtype) # (if decoder outputs were stored in fp16)
+        mel_outputs_postnet = self.postnet(mel_outputs)
+        mel_outputs_postnet.add_(mel_outputs)
+        return mel_outputs_postnet
+    
+    def inference_pool(self, text, speaker_ids, sampler, batch_size, style_input=None, style_mode=None, text_lengths=None, max_decoder_steps=None, gate_threshold=None, gate_delay=None):
+        """
+        Best-of-N inference without a fixed number of attempts per text.
+        text, speaker_ids, style_input and text_lengths should contain each text once (not repeated for every attempt).
+        Finished candidates are sent to sampler.add_results() (see text2speech.BestOfNSampler), Postnet is not run.
+        """
+        encoder_outputs = self.encode(text, speaker_ids, style_input=style_input, style_mode=style_mode, text_lengths=text_lengths)
+        
+        self.decoder.inference_pool(encoder_outputs, text_lengths, sampler, batch_size, max_decoder_steps=max_decoder_steps, gate_threshold=gate_threshold, gate_delay=gate_delay)
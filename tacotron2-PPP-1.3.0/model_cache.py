@@ -0,0 +1,86 @@
+from collections import OrderedDict
+import torch
+
+
+def module_nbytes(module):
+    """Size of a module's parameters and buffers in bytes."""
+    return sum(t.numel()*t.element_size() for t in list(module.parameters())+list(module.buffers()))
+
+
+def move_module(module, device, pin_memory=False):
+    """Move parameters/buffers of module to device, in-place. If pin_memory, CPU tensors are page-locked so they can be copied back to the GPU asynchronously."""
+    if device.type == 'cpu':
+        module._apply(lambda t: t.cpu().pin_memory() if (pin_memory and torch.cuda.is_available()) else t.cpu())
+    else:
+        module._apply(lambda t: t.to(device, non_blocking=True))
+    return module
+
+
+class ModelCache:
+    """
+    LRU cache of loaded models keyed by name.
+    Each entry is the tuple returned by a loader function (e.g. T2S.load_tacotron2), any torch.nn.Module inside the tuple
+    counts towards the memory budget and is moved when the entry is offloaded.
+
+    Entries that don't fit in max_device_gb are offloaded to (pinned) CPU memory if offload_to_cpu, else dropped.
+    Entries that don't fit in max_cpu_gb are dropped.
+    The entries passed as 'in_use' to get() are never offloaded or dropped.
+    """
+    def __init__(self, device, max_device_gb=8.0, max_cpu_gb=16.0, offload_to_cpu=True):
+        self.device = device
+        self.max_device_bytes = max_device_gb*1024**3
+        self.max_cpu_bytes = max_cpu_gb*1024**3
+        self.offload_to_cpu = offload_to_cpu and device.type != 'cpu'
+        self.entries = OrderedDict() # key -> {'value': tuple, 'nbytes': int, 'offloaded': bool}, oldest first
+
+    def modules(self, key):
+        return [x for x in self.entries[key]['value'] if isinstance(x, torch.nn.Module)]
+
+    def get(self, key, loader, in_use=()):
+        """Return the cached value for key (moving it back to self.device if it was offloaded), else call loader() and cache the result."""
+        if key in self.entries:
+            entry = self.entries[key]
+            self.entries.move_to_end(key)
+            if entry['offloaded']:
+                print(f"Moving {key} back to {self.device}... ", end="")
+                for module in self.modules(key):
+                    move_module(module, self.device)
+                entry['offloaded'] = False
+                print("Done!")
+        else:
+            value = loader()
+            self.entries[key] = {'value': value, 'nbytes': sum(module_nbytes(x) for x in value if isinstance(x, torch.nn.Module)), 'offloaded': False}
+        self.enforce_budget(in_use=set(in_use) | {key,})
+        return self.entries[key]['value']
+
+    def used_bytes(self, offloaded):
+        return sum(e['nbytes'] for e in self.entries.values() if e['offloaded'] == offloaded)
+
+    def enforce_budget(self, in_use=()):
+        """Offload/drop the least recently used entries till the cache fits in the budget."""
+        device_budget = self.max_device_bytes if self.device.type != 'cpu' else self.max_cpu_bytes
+        for key in list(self.entries.keys()): # oldest first
+            if self.used_bytes(offloaded=False) <= device_budget:
+                break
+            if key in in_use or self.entries[key]['offloaded']:
+                continue
+            if self.offload_to_cpu and self.entries[key]['nbytes'] <= self.max_cpu_bytes:
+                print(f"Offloading {key} to CPU.")
+                for module in self.modules(key):
+                    if hasattr(module, 'decoder') and hasattr(module.decoder, 'step_graphs'): # captured CUDA graphs keep their own GPU buffers
+                        module.decoder.step_graphs = {}
+                    move_module(module, torch.device('cpu'), pin_memory=True)
+                self.entries[key]['offloaded'] = True
+            else:
+                print(f"Removing {key} from model cache.")
+                del self.entries[key]
+
+        for key in list(self.entries.keys()):
+            if self.used_bytes(offloaded=True) <= self.max_cpu_bytes:
+                break
+            if self.entries[key]['offloaded'] and key not in in_use:
+                print(f"Removing {key} from model cache.")
+                del self.entries[key]
+
+        if self.device.type == 'cuda':
+            torch.cuda.empty_cache()
@@ -0,0 +1,124 @@
+import time
+import argparse
+import numpy as np
+import torch
+from torch import nn
+from model import LSTMCellWithZoneout, load_model
+from text import text_to_sequence
+
+
+def replace_zoneout_cells(module):
+    """Swap LSTMCellWithZoneout for plain nn.LSTMCell (zoneout is only used during training) so quantize_dynamic recognises them."""
+    for name, child in module.named_children():
+        if isinstance(child, LSTMCellWithZoneout):
+            cell = nn.LSTMCell(child.input_size, child.hidden_size, bias=child.bias)
+            cell.load_state_dict(child.state_dict())
+            setattr(module, name, cell)
+        else:
+            replace_zoneout_cells(child)
+    return module
+
+
+def quantize_tacotron2(model):
+    """
+    Returns model with int8 dynamically quantized Decoder (LSTMCells and Linear layers) for CPU inference.
+    Activations stay fp32 so the rest of the model (Encoder, Postnet) is converted to fp32 on the CPU.
+    """
+    model = model.cpu().float().eval()
+    model.decoder.cuda_graph_inference = False
+    model.decoder = replace_zoneout_cells(model.decoder)
+    model.decoder = torch.quantization.quantize_dynamic(model.decoder, {nn.LSTMCell, nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def load_quantized_tacotron2(checkpoint):
+    """Rebuild a model saved by export_quantized() (state_dicts of quantized modules only load into quantized modules)."""
+    model = load_model(checkpoint['hparams'], device='cpu')
+    model = quantize_tacotron2(model)
+    model.load_state_dict(checkpoint['state_dict'])
+    return model
+
+
+def export_quantized(checkpoint_path, output_path):
+    """Quantize a Tacotron2 checkpoint and save it in the same format (+ 'quantization' key) for T2S.load_tacotron2."""
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    model = load_model(checkpoint['hparams'], device='cpu')
+    model.load_state_dict(checkpoint['state_dict'])
+    q_model = quantize_tacotron2(model)
+    torch.save({'state_dict': q_model.state_dict(),
+                'hparams': checkpoint['hparams'],
+                'speaker_name_lookup': checkpoint['speaker_name_lookup'],
+                'speaker_id_lookup': checkpoint['speaker_id_lookup'],
+                'iteration': checkpoint['iteration'],
+                'quantization': 'dynamic_int8',}, output_path)
+    print(f"Saved quantized model to '{output_path}'")
+    return q_model
+
+
+@torch.no_grad()
+def check_accuracy(model, q_model, hparams, texts, speaker_id=0, n_runs=8, gate_threshold=0.5, seed=1234):
+    """
+    Compare the quantized model against the fp32 model on CPU.
+    Both models are run with the same random seed (Prenet dropout is active during inference) so the outputs can be compared frame-by-frame.
+    Prints the mean alignment metrics (see text2speech.alignment_metric), the mel L1 error over frames both models generated and the speedup.
+    """
+    from text2speech import alignment_metric, get_first_over_thresh
+    model = model.cpu().float().eval()
+    q_model = q_model.cpu().float().eval()
+    style_mode = 'zeros' if getattr(model, 'with_gst', False) else None
+
+    results = {'fp32': [], 'int8': []} # [[diagonality, avg_prob, enc_max_focus, enc_min_focus, enc_avg_focus, length], ...]
+    durations = {'fp32': 0.0, 'int8': 0.0}
+    mel_l1 = []
+    for text in texts:
+        sequence = torch.LongTensor(text_to_sequence(text, hparams.text_cleaners))[None, :]
+        text_lengths = torch.LongTensor([sequence.size(1)])
+        speaker_ids = torch.LongTensor([speaker_id])
+        for i in range(n_runs):
+            outputs = {}
+            for name, m in (('fp32', model), ('int8', q_model)):
+                torch.manual_seed(seed+i)
+                start_time = time.time()
+                mel_outputs, mel_outputs_postnet, gate_outputs, alignments = m.inference(sequence, speaker_ids, style_input=None, style_mode=style_mode, text_lengths=text_lengths)
+                durations[name] += time.time()-start_time
+                output_lengths = get_first_over_thresh(gate_outputs, gate_threshold)
+                metrics = alignment_metric(alignments, input_lengths=text_lengths, output_lengths=output_lengths)
+                results[name].append([x.item() for x in metrics]+[output_lengths.item(),])
+                outputs[name] = mel_outputs_postnet[0, :, :output_lengths.item()]
+            n_frames = min(outputs['fp32'].size(1), outputs['int8'].size(1))
+            mel_l1.append((outputs['fp32'][:, :n_frames]-outputs['int8'][:, :n_frames]).abs().mean().item())
+
+    names = ['diagonality', 'avg_prob', 'enc_max_focus', 'enc_min_focus', 'enc_avg_focus', 'length']
+    fp32_mean, int8_mean = np.mean(results['fp32'], axis=0), np.mean(results['int8'], axis=0)
+    for j, name in enumerate(names):
+        print(f"{name:>14}: fp32 {fp32_mean[j]:.4f} int8 {int8_mean[j]:.4f} (diff {int8_mean[j]-fp32_mean[j]:+.4f})")
+    print(f"{'mel L1':>14}: {np.mean(mel_l1):.4f}")
+    print(f"{'speedup':>14}: {durations['fp32']/durations['int8']:.2f}x ({durations['fp32']:.2f}s fp32, {durations['int8']:.2f}s int8)")
+    return {'fp32': dict(zip(names, fp32_mean)), 'int8': dict(zip(names, int8_mean)), 'mel_l1': np.mean(mel_l1), 'speedup': durations['fp32']/durations['int8']}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--checkpoint_path', type=str, required=True,
+                        help='Tacotron2 checkpoint to quantize')
+    parser.add_argument('-o', '--output_path', type=str, default=None,
+                        required=False, help='where to save the quantized checkpoint (default: checkpoint_path+"_int8")')
+    parser.add_argument('--check', action='store_true',
+                        help='Compare alignment metrics and mel error of the quantized model against the fp32 model.')
+    parser.add_argument('--texts', type=str, default="The quick brown fox jumps over the lazy dog.|I don't know what you're talking about!|Hello there, how are you doing today?",
+                        required=False, help='"|" separated texts used by --check')
+    parser.add_argument('--speaker_id', type=int, default=0,
+                        required=False, help='(internal) speaker id used by --check')
+    parser.add_argument('--n_runs', type=int, default=8,
+                        required=False, help='number of runs per text used by --check')
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    output_path = args.output_path or args.checkpoint_path+"_int8"
+    q_model = export_quantized(args.checkpoint_path, output_path)
+
+    if args.check: # reload the fp32 model (quantize_tacotron2 modifies the model in-place)
+        checkpoint = torch.load(args.checkpoint_path, map_location='cpu')
+        model = load_model(checkpoint['hparams'], device='cpu')
+        model.load_state_dict(checkpoint['state_dict'])
+        check_accuracy(model, q_model, checkpoint['hparams'], args.texts.split("|"), speaker_id=args.speaker_id, n_runs=args.n_runs)
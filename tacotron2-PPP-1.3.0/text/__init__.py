@@ -1,5 +1,7 @@
 """ from https://github.com/keithito/tacotron """
 import re
+from functools import lru_cache
+import torch
 from text import cleaners
 from text.symbols import symbols
 
@@ -7,9 +9,11 @@ from text.symbols import symbols
 # Mappings from symbol to numeric ID and vice versa:
 _symbol_to_id = {s: i for i, s in enumerate(symbols)}
 _id_to_symbol = {i: s for i, s in enumerate(symbols)}
+_keep_symbol_to_id = {s: i for s, i in _symbol_to_id.items() if s != '_' and s != '~'}
 
 # Regular expression matching text enclosed in curly braces:
 _curly_re = re.compile(r'(.*?)\{(.+?)\}(.*)')
+_curly_split_re = re.compile(r'\{(.+?)\}')
 
 
 def text_to_sequence(text, cleaner_names):
@@ -25,6 +29,42 @@ def text_to_sequence(text, cleaner_names):
     Returns:
       List of integers corresponding to the symbols in the text
   '''
+  return list(_cached_text_to_sequence(text, tuple(cleaner_names)))
+
+
+def text_to_sequence_batch(texts, cleaner_names, pad_value=0):
+  '''Converts a list of strings to a padded batch of symbol IDs.
+
+    Args:
+      texts: list of strings to convert (see text_to_sequence)
+      cleaner_names: names of the cleaner functions to run the texts through
+      pad_value: ID used to pad the shorter texts
+
+    Returns:
+      (LongTensor [B, max_len] of IDs, LongTensor [B] of text lengths)
+  '''
+  cleaner_names = tuple(cleaner_names)
+  sequences = [_cached_text_to_sequence(text, cleaner_names) for text in texts]
+  text_lengths = torch.LongTensor([len(seq) for seq in sequences])
+  max_len = int(text_lengths.max()) if len(sequences) else 0
+  sequence = torch.LongTensor([list(seq) + [pad_value,]*(max_len-len(seq)) for seq in sequences]).view(len(sequences), max_len)
+  return sequence, text_lengths
+
+
+@lru_cache(maxsize=65536)
+def _cached_text_to_sequence(text, cleaner_names):
+  if '{' not in text:
+    return tuple(_symbols_to_sequence(_clean_text(text, cleaner_names)))
+
+  if '\n' not in text:
+    # split into [text, arpabet, text, arpabet, ..., text]
+    parts = _curly_split_re.split(text)
+    sequence = []
+    for i, part in enumerate(parts):
+      sequence += _arpabet_to_sequence(part) if i % 2 else _symbols_to_sequence(_clean_text(part, cleaner_names))
+    return tuple(sequence)
+
+  # (_curly_re doesn't match across newlines, keep the original behaviour for those texts)
   sequence = []
 
   # Check for curly braces and treat their contents as ARPAbet:
@@ -37,7 +77,7 @@ def text_to_sequence(text, cleaner_names):
     sequence += _arpabet_to_sequence(m.group(2))
     text = m.group(3)
 
-  return sequence
+  return tuple(sequence)
 
 
 def sequence_to_text(sequence):
@@ -54,16 +94,24 @@ def sequence_to_text(sequence):
 
 
 def _clean_text(text, cleaner_names):
+  for cleaner in _get_cleaners(tuple(cleaner_names)):
+    text = cleaner(text)
+  return text
+
+
+@lru_cache(maxsize=None)
+def _get_cleaners(cleaner_names):
+  cleaner_fns = []
   for name in cleaner_names:
-    cleaner = getattr(cleaners, name)
+    cleaner = getattr(cleaners, name, None)
     if not cleaner:
       raise Exception('Unknown cleaner: %s' % name)
-    text = cleaner(text)
-  return text
+    cleaner_fns.append(cleaner)
+  return tuple(cleaner_fns)
 
 
 def _symbols_to_sequence(symbols):
-  return [_symbol_to_id[s] for s in symbols if _should_keep_symbol(s)]
+  return [_keep_symbol_to_id[s] for s in symbols if s in _keep_symbol_to_id]
 
 
 def _arpabet_to_sequence(text):
@@ -71,4 +119,4 @@ def _arpabet_to_sequence(text):
 
 
 def _should_keep_symbol(s):
-  return s in _symbol_to_id and s is not '_' and s is not '~'
+  return s in _keep_symbol_to_id
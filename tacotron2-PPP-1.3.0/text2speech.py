@@ -7,15 +7,25 @@ import argparse
 import torch
 import matplotlib.pyplot as plt
 from scipy.io.wavfile import write
-from model import Tacotron2
-from train import load_model
-from text import text_to_sequence
+from model import Tacotron2, load_model
+from text import text_to_sequence_batch
 from denoiser import Denoiser
+from quantize import quantize_tacotron2, load_quantized_tacotron2
+from model_cache import ModelCache
+from audio_cache import AudioCache
+from audio_writer import AudioFileWriter
+from waveglow_utils import chunked_infer
+from waveglow_export import prepare_inference_waveglow
 from utils import load_filepaths_and_text
 import json
 import re
 import difflib
+from functools import lru_cache
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import queue
+import heapq
 from unidecode import unidecode
 import nltk # sentence spliting
 from nltk import sent_tokenize
@@ -28,7 +38,7 @@ def get_mask_from_lengths(lengths, max_len=None):
     return mask
 
 #@torch.jit.script # should work and be even faster, but makes it harder to debug and it's already fast enough right now
-def alignment_metric(alignments, input_lengths=None, output_lengths=None, average_across_batch=False):
+def alignment_metric(alignments, input_lengths=None, output_lengths=None, average_across_batch=False, to_cpu=True):
     alignments = alignments.transpose(1,2) # [B, dec, enc] -> [B, enc, dec]
     # alignments [batch size, x, y]
     # input_lengths [batch size] for len_x
@@ -62,7 +72,7 @@ def alignment_metric(alignments, input_lengths=None, output_lengths=None, averag
     encoder_avg_focus *= (att_enc_total.size(1)/input_lengths.float())
     
     # calc min (with padding ignored)
-    att_enc_total.masked_fill_(~get_mask_from_lengths(input_lengths, max_len=att_enc_total.size(1)), 1.0)
+    att_enc_total.masked_fill_(~get_mask_from_lengths(input_lengths, max_len=att_enc_total.size(1)), float('inf'))
     encoder_min_focus = att_enc_total.min(dim=1)[0] # [B, enc] -> [B]
     
     # calc average max attention (with padding ignored)
@@ -76,6 +86,8 @@ def alignment_metric(alignments, input_lengths=None, output_lengths=None, averag
         encoder_min_focus = encoder_min_focus.mean()
         encoder_avg_focus = encoder_avg_focus.mean()
         avg_prob = avg_prob.mean()
+    if not to_cpu: # keep on the device (e.g: for score_alignments())
+        return diagonalitys, avg_prob, encoder_max_focus, encoder_min_focus, encoder_avg_focus
     return diagonalitys.cpu(), avg_prob.cpu(), encoder_max_focus.cpu(), encoder_min_focus.cpu(), encoder_avg_focus.cpu()
 
 
@@ -144,12 +156,153 @@ def parse_text_into_segments(texts, split_at_quotes=True, target_segment_length=
 
 
 def get_first_over_thresh(x, threshold):
-    """Takes [B, T] and outputs first T over threshold for each B (output.shape = [B])."""
-    device = x.device
-    x = x.clone().cpu().float() # GPU implementation of argmax() splits tensor into 32 elem chunks, each chunk is parsed forward then the outputs are collected together... backwards
-    x[:,-1] = threshold # set last to threshold just incase the output didn't finish generating.
-    x[x>threshold] = threshold
-    return ( (x.size(1)-1)-(x.flip(dims=(1,)).argmax(dim=1)) ).to(device).int()
+    """Takes [B, T] and outputs first T over threshold for each B (output.shape = [B]). Runs on x's device without syncing."""
+    over = (x >= threshold)
+    over[:,-1] = True # set last to over threshold just incase the output didn't finish generating.
+    return (over.cumsum(dim=1) == 0).sum(dim=1).int() # number of frames before the first one over threshold
+
+
+def score_alignments(diagonality, avg_prob, enc_max_focus, enc_min_focus, enc_avg_focus, diagonality_weighting=0.5, max_focus_weighting=1.0, min_focus_weighting=1.0, avg_focus_weighting=1.0):
+    """
+    Combine the outputs of alignment_metric() into weighted scores for the whole batch, on the same device as the inputs.
+    RETURNS
+    -------
+    scores: [B, 6] (diagonality, avg_prob, weighted_score, max_focus_punishment, min_focus_punishment, avg_focus_punishment), see score_to_str()
+    """
+    diagonality, avg_prob = diagonality.double(), avg_prob.double()
+    diagonality_punishment = (diagonality.clamp(min=1.20)-1.20) * 0.5 * diagonality_weighting  # smooth pacing
+    max_focus_punishment = (enc_max_focus.double()-24).clamp(min=0) * 0.005 * max_focus_weighting # getting stuck on pauses/phones
+    min_focus_punishment = (0.25-enc_min_focus.double()).clamp(min=0) * min_focus_weighting # skipping single enc outputs
+    avg_focus_punishment = (2.5-enc_avg_focus.double()).clamp(min=0) * avg_focus_weighting # skipping most enc outputs
+    weighted_score = avg_prob - (diagonality_punishment + max_focus_punishment + min_focus_punishment + avg_focus_punishment) # general alignment quality - punishments
+    return torch.stack((diagonality, avg_prob, weighted_score, max_focus_punishment, min_focus_punishment, avg_focus_punishment), dim=1)
+
+
+def best_of_pass(scores, best_score):
+    """
+    Picks the best attempt of each text from one pass of best-of-N sampling.
+    PARAMS
+    ------
+    scores: [texts, attempts, 6] output of score_alignments()
+    best_score: [texts] best weighted_score of each text so far (on the same device as scores)
+    RETURNS
+    -------
+    best_score: [texts] updated best_score
+    pass_info: [texts, 8] host array of the best attempt's scores, whether it improved on best_score and it's attempt index
+    """
+    pass_best_index = scores[:, :, 2].argmax(dim=1) # [texts]
+    pass_best = scores[torch.arange(scores.size(0), device=scores.device), pass_best_index] # [texts, 6]
+    improved = pass_best[:, 2] > best_score
+    best_score = torch.where(improved, pass_best[:, 2], best_score)
+    pass_info = torch.cat((pass_best, improved[:, None].double(), pass_best_index[:, None].double()), dim=1).cpu().numpy() # (single copy to the host)
+    return best_score, pass_info
+
+
+def score_to_str(score):
+    """Format one (host) row of score_alignments() for printing."""
+    diagonality, avg_prob, weighted_score, max_focus_punishment, min_focus_punishment, avg_focus_punishment = [float(x) for x in score]
+    return f"{round(diagonality,3)} {round(avg_prob*100,2)}% {round(weighted_score,4)} {round(max_focus_punishment,2)} {round(min_focus_punishment,2)} {round(avg_focus_punishment,2)}|"
+
+
+class BestOfNSampler:
+    """
+    Keeps track of the best candidate for each text while Tacotron2.inference_pool() is running.
+    Decides which text each free decoder row should attempt next and which running
+    attempts can be aborted because they can no longer beat the best candidate of their text.
+    """
+    def __init__(self, text_lengths, target_score, max_attempts, absolute_maximum_tries, absolutely_required_score, max_decoder_steps, gate_threshold, end_mode='thresh', check_interval=8, score_weights={}):
+        n_texts = text_lengths.size(0)
+        self.text_lengths = text_lengths
+        self.target_score = target_score
+        self.max_attempts = max_attempts
+        self.absolute_maximum_tries = absolute_maximum_tries
+        self.absolutely_required_score = absolutely_required_score
+        self.max_decoder_steps = max_decoder_steps
+        self.gate_threshold = gate_threshold
+        self.end_mode = end_mode
+        self.check_interval = max(int(check_interval), 1) # how often (in decoder steps) running attempts are checked
+        self.score_weights = score_weights
+        
+        self.best_score = np.ones(n_texts) * -9e9
+        self.best_score_str = ['']*n_texts
+        self.best_generations = [0]*n_texts # [mel, mel_postnet, gate, alignment] of the best attempt, mel_postnet is filled in later
+        self.tries = np.zeros(n_texts)       # finished + aborted attempts
+        self.in_progress = np.zeros(n_texts) # attempts currently being decoded
+        self.n_aborted = 0
+        self.text_queue = [(0, j) for j in range(n_texts)] # heap of (tries+in_progress, text_index), one entry per text that may still need attempts
+    
+    def is_done(self, text_index):
+        j = text_index
+        if self.best_score[j] >= self.target_score:
+            return True
+        if self.tries[j] >= self.max_attempts and self.best_score[j] > (self.absolutely_required_score-1):
+            return True
+        return self.tries[j] >= self.absolute_maximum_tries
+    
+    def next_text(self):
+        """Returns the index of the text that should be attempted next (texts with the least attempts first), or None if no more attempts are needed."""
+        # tries+in_progress only changes here (finished/aborted attempts move from in_progress to tries), so the heap is never stale.
+        # texts that fail the check can't become attemptable again (best_score and tries only increase), so they're dropped from the heap.
+        while len(self.text_queue):
+            n_attempts, j = self.text_queue[0]
+            max_tries = self.max_attempts if self.best_score[j] > (self.absolutely_required_score-1) else self.absolute_maximum_tries
+            if self.is_done(j) or n_attempts >= max_tries:
+                heapq.heappop(self.text_queue)
+                continue
+            heapq.heapreplace(self.text_queue, (n_attempts+1, j))
+            self.in_progress[j]+=1
+            return j
+        return None
+    
+    def doomed(self, row_text, n_frames, dist, max_focus):
+        """
+        Takes the partial alignment metrics of running attempts and returns a bool tensor of attempts that should be aborted.
+        The diagonality and max_focus punishments can only increase as more frames are generated,
+        so 1.0 minus their current values is the best score the attempt could possibly finish with.
+        """
+        text_lengths = self.text_lengths[row_text].cpu().double()
+        optimums = torch.sqrt(text_lengths.pow(2) + float(self.max_decoder_steps)**2) # longest possible optimal path
+        diagonality = (dist.double() + 1.4142135)/optimums
+        diagonality_punishment = (diagonality.clamp(min=1.20)-1.20) * 0.5 * self.score_weights.get('diagonality_weighting', 0.5)
+        max_focus_punishment = (max_focus.double()-24).clamp(min=0) * 0.005 * self.score_weights.get('max_focus_weighting', 1.0)
+        max_possible_score = 1.0 - (diagonality_punishment + max_focus_punishment)
+        
+        best_score = torch.from_numpy(self.best_score)[row_text]
+        is_done = torch.tensor([self.is_done(j) for j in row_text.tolist()], dtype=torch.bool)
+        return (max_possible_score < best_score) | is_done
+    
+    def add_aborted(self, row_text):
+        for j in row_text.tolist():
+            self.tries[j]+=1
+            self.in_progress[j]-=1
+            self.n_aborted+=1
+    
+    def add_results(self, row_text, lengths, mels, gates, alignments):
+        """Score finished attempts. mels [B, n_mel, T*n_frames_per_step], gates [B, T] (after sigmoid), alignments [B, T, enc]. Only the first lengths[i] decoder steps are valid."""
+        lengths = lengths.tolist()
+        n_frames_per_step = mels.size(2)//gates.size(1)
+        mels = [mel[:, :l*n_frames_per_step] for mel, l in zip(mels, lengths)]
+        gates = [gate[:l] for gate, l in zip(gates, lengths)]
+        alignments = [alignment[:l] for alignment, l in zip(alignments, lengths)]
+        
+        gate_batch = torch.nn.utils.rnn.pad_sequence(gates, batch_first=True, padding_value=0.0)
+        alignments_batch = torch.nn.utils.rnn.pad_sequence(alignments, batch_first=True, padding_value=0.0)
+        if self.end_mode == 'thresh':
+            output_lengths = get_first_over_thresh(gate_batch, self.gate_threshold)
+        elif self.end_mode == 'max':
+            output_lengths = gate_batch.argmax(dim=1)
+        input_lengths = self.text_lengths[row_text.to(self.text_lengths.device)]
+        metrics = alignment_metric(alignments_batch, input_lengths=input_lengths, output_lengths=output_lengths, to_cpu=False)
+        scores = score_alignments(*metrics, **self.score_weights).cpu().numpy() # [B, 6] (single copy to the host)
+        
+        for k, j in enumerate(row_text.tolist()):
+            weighted_score = scores[k, 2]
+            if weighted_score > self.best_score[j]:
+                self.best_score[j] = weighted_score
+                self.best_score_str[j] = score_to_str(scores[k])
+                self.best_generations[j] = [mels[k][None].clone(), None, gates[k][None].clone(), alignments[k][None].clone()]
+            self.tries[j]+=1
+            self.in_progress[j]-=1
 
 
 class T2S:
@@ -158,28 +311,40 @@ class T2S:
         with open('t2s_config.json', 'r') as f:
             self.conf = json.load(f)
         
+        # pick inference device and precision
+        self.device = torch.device(self.conf.get('inference_device', 'cuda'))
+        if self.device.type == 'cuda' and not torch.cuda.is_available():
+            print("CUDA is not available, running inference on CPU.")
+            self.device = torch.device('cpu')
+        self.dtype = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}[self.conf.get('inference_dtype', 'fp16')]
+        if self.device.type == 'cpu' and self.dtype == torch.float16: # most fp16 ops aren't implemented/fast on CPU
+            print("fp16 is not supported for CPU inference, using fp32.")
+            self.dtype = torch.float32
+        if self.device.type == 'cpu' and self.conf.get('cpu_threads', 0):
+            torch.set_num_threads(self.conf['cpu_threads'])
+        
+        # keeps recently used models loaded so switching between them doesn't reload the checkpoints
+        cache_conf = self.conf.get('model_cache', {})
+        self.model_cache = ModelCache(self.device, max_device_gb=cache_conf.get('max_device_gb', 8.0), max_cpu_gb=cache_conf.get('max_cpu_gb', 16.0), offload_to_cpu=cache_conf.get('offload_to_cpu', True))
+        self.tt_current = self.wg_current = None
+        
+        # (optional) reuse audio of segments that have been generated before with the same text/speaker/models/settings
+        audio_cache_conf = self.conf.get('audio_cache', {})
+        self.audio_cache = AudioCache(audio_cache_conf.get('directory', 'server_infer_cache'), max_size_gb=audio_cache_conf.get('max_size_gb', 2.0)) if audio_cache_conf.get('enabled', False) else None
+        self.audio_cache_mels = audio_cache_conf.get('store_mels', True)
+        
         # load Tacotron2
-        self.tt_current = self.conf['tacotron']['default_model']
-        assert self.tt_current in self.conf['tacotron']['models'].keys(), "Tacotron default model not found in config models"
-        tacotron_path = self.conf['tacotron']['models'][self.tt_current]['modelpath'] # get first available Tacotron
-        self.tacotron, self.tt_hparams, self.tt_sp_name_lookup, self.tt_sp_id_lookup = self.load_tacotron2(tacotron_path)
+        assert self.conf['tacotron']['default_model'] in self.conf['tacotron']['models'].keys(), "Tacotron default model not found in config models"
+        self.update_tt(self.conf['tacotron']['default_model'])
         
         # load WaveGlow
-        self.wg_current = self.conf['waveglow']['default_model']
-        assert self.wg_current in self.conf['waveglow']['models'].keys(), "WaveGlow default model not found in config models"
-        waveglow_path = self.conf['waveglow']['models'][self.wg_current]['modelpath'] # get first available waveglow
-        waveglow_confpath = self.conf['waveglow']['models'][self.wg_current]['configpath']
-        self.waveglow, self.wg_denoiser, self.wg_train_sigma, self.wg_sp_id_lookup = self.load_waveglow(waveglow_path, waveglow_confpath)
+        assert self.conf['waveglow']['default_model'] in self.conf['waveglow']['models'].keys(), "WaveGlow default model not found in config models"
+        self.update_wg(self.conf['waveglow']['default_model'])
         
         # load torchMoji
         if self.tt_hparams.torchMoji_linear: # if Tacotron includes a torchMoji layer
             self.tm_sentence_tokenizer, self.tm_torchmoji = self.load_torchmoji()
         
-        # override since my checkpoints are still missing speaker names
-        if self.conf['tacotron']['use_speaker_ids_file_override']:
-            speaker_ids_fpath = self.conf['tacotron']['speaker_ids_file']
-            self.tt_sp_name_lookup = {name: self.tt_sp_id_lookup[int(ext_id)] for _, name, ext_id in load_filepaths_and_text(speaker_ids_fpath)}
-        
         # load arpabet/pronounciation dictionary
         dict_path = self.conf['dict_path']
         self.load_arpabet_dict(dict_path)
@@ -192,25 +357,49 @@ class T2S:
     
     def load_arpabet_dict(self, dict_path):
         print("Loading ARPAbet Dictionary... ", end="")
-        self.arpadict = {}
-        for line in reversed((open(dict_path, "r").read()).splitlines()):
-            self.arpadict[(line.split(" ", 1))[0]] = (line.split(" ", 1))[1].strip()
+        compiled_path = dict_path+'.json' # precompiled dictionary, rebuilt whenever the text file is modified (JSON so loading it can't run code, unlike a pickle)
+        if os.path.exists(compiled_path) and os.path.getmtime(compiled_path) >= os.path.getmtime(dict_path):
+            with open(compiled_path, 'r', encoding='utf-8') as f:
+                self.arpadict = json.load(f)
+        else:
+            self.arpadict = {}
+            with open(dict_path, "r") as f:
+                for line in f:
+                    word, _, pronunciation = line.rstrip("\r\n").partition(" ")
+                    if word not in self.arpadict: # first entry is used for words with multiple pronunciations
+                        self.arpadict[word] = pronunciation.strip()
+            try:
+                with open(compiled_path+'.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(self.arpadict, f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(compiled_path+'.tmp', compiled_path) # (so a crash can't leave a partially written file)
+            except OSError as ex:
+                print(f"(failed to save precompiled dictionary: {ex}) ", end="")
+        self.arpa_word = lru_cache(maxsize=65536)(self.arpa_word_uncached) # new cache for every dictionary
         print("Done!")
     
     
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def punc_regexes(punc):
+        """Returns regexes splitting a word into (word, trailing punctuation) and (leading punctuation, word). At least one character is always left in the word."""
+        punc = re.escape(punc)
+        return re.compile(f'(.+?)([{punc}]*)', re.S), re.compile(f'([{punc}]*)(.+)', re.S)
+    
+    
+    def arpa_word_uncached(self, word, punc):
+        end_re, start_re = self.punc_regexes(punc)
+        word, end_chars = end_re.fullmatch(word).groups()
+        start_chars, word = start_re.fullmatch(word).groups()
+        pronunciation = self.arpadict.get(word.upper())
+        if pronunciation is not None:
+            word = "{" + str(pronunciation) + "}"
+        return (start_chars + word + end_chars).rstrip()
+    
+    
     def ARPA(self, text, punc=r"!?,.;:␤#-_'\"()[]"):
         text = text.replace("\n"," ")
-        out = ''
-        for word in text.split(" "):
-            end_chars = ''; start_chars = ''
-            while any(elem in word for elem in punc) and len(word) > 1:
-                if word[-1] in punc: end_chars = word[-1] + end_chars; word = word[:-1]
-                elif word[0] in punc: start_chars = start_chars + word[0]; word = word[1:]
-                else: break
-            if word.upper() in self.arpadict.keys():
-                word = "{" + str(self.arpadict[word.upper()]) + "}"
-            out = (out + " " + start_chars + word + end_chars).strip()
-        return out
+        words = [self.arpa_word(word, punc) for word in text.split(" ") if len(word)]
+        return " ".join([word for word in words if len(word)]).strip()
     
     def load_torchmoji(self):
         """ Use torchMoji to score texts for emoji distribution.
@@ -280,14 +469,19 @@ class T2S:
         
         # initialize model
         print(f"intializing WaveGlow model... ", end="")
-        waveglow = WaveGlow(**waveglow_config).cuda()
+        waveglow = WaveGlow(**waveglow_config)
         print(f"Done!")
         
         # load checkpoint from file
         print(f"loading WaveGlow checkpoint... ", end="")
-        checkpoint = torch.load(waveglow_path)
-        waveglow.load_state_dict(checkpoint['model']) # and overwrite initialized weights with checkpointed weights
-        waveglow.cuda().eval().half() # move to GPU and convert to half precision
+        checkpoint = torch.load(waveglow_path, map_location='cpu')
+        if checkpoint.get('inference_export', False): # exported by waveglow_export.py, already in inference form
+            waveglow = prepare_inference_waveglow(waveglow)
+            waveglow.load_state_dict(checkpoint['model'])
+        else:
+            waveglow.load_state_dict(checkpoint['model']) # and overwrite initialized weights with checkpointed weights
+            waveglow = prepare_inference_waveglow(waveglow) # fold weight norm, merge cond_layers and precompute W_inverse
+        waveglow.to(self.device, self.dtype).eval() # move to inference device and precision
         print(f"Done!")
         
         print(f"initializing Denoiser... ", end="")
@@ -302,7 +496,9 @@ class T2S:
     
     
     def update_wg(self, waveglow_name):
-        self.waveglow, self.wg_denoiser, self.wg_train_sigma, self.wg_sp_id_lookup = self.load_waveglow(self.conf['waveglow']['models'][waveglow_name]['modelpath'], self.conf['waveglow']['models'][waveglow_name]['configpath'])
+        model_conf = self.conf['waveglow']['models'][waveglow_name]
+        self.waveglow, self.wg_denoiser, self.wg_train_sigma, self.wg_sp_id_lookup = self.model_cache.get(('waveglow', waveglow_name),
+            lambda: self.load_waveglow(model_conf['modelpath'], model_conf['configpath']), in_use=[('tacotron', self.tt_current)])
         self.wg_current = waveglow_name
     
     def load_tacotron2(self, tacotron_path):
@@ -312,14 +508,23 @@ class T2S:
         - hparams
         - speaker_lookup
         """
-        checkpoint = torch.load(tacotron_path) # load file into memory
+        checkpoint = torch.load(tacotron_path, map_location='cpu') # load file into memory
         print("Loading Tacotron... ", end="")
         checkpoint_hparams = checkpoint['hparams'] # get hparams
         checkpoint_dict = checkpoint['state_dict'] # get state_dict
         
-        model = load_model(checkpoint_hparams) # initialize the model
-        model.load_state_dict(checkpoint_dict) # load pretrained weights
-        _ = model.cuda().eval().half()
+        if checkpoint.get('quantization', None) is not None: # exported by quantize.py
+            assert self.device.type == 'cpu', "quantized Tacotron2 checkpoints can only be used for CPU inference"
+            model = load_quantized_tacotron2(checkpoint) # (stays fp32, dynamic quantized layers take fp32 inputs)
+        else:
+            model = load_model(checkpoint_hparams, device=self.device) # initialize the model
+            model.load_state_dict(checkpoint_dict) # load pretrained weights
+            if self.device.type == 'cpu' and self.conf['tacotron'].get('quantize_cpu', False): # (optional) int8 Decoder weights for CPU inference
+                model = quantize_tacotron2(model) # (stays fp32, see self.tt_dtype)
+            else:
+                _ = model.to(self.device, self.dtype).eval()
+        model.decoder.cuda_graph_inference = self.conf['tacotron'].get('cuda_graph_inference', False) # (optional) capture decoder steps as CUDA graphs
+        model.decoder.inference_attention_window = self.conf['tacotron'].get('inference_attention_window', model.decoder.inference_attention_window) # (optional) windowed attention for long inputs
         print("Done")
         tacotron_speaker_name_lookup = checkpoint['speaker_name_lookup'] # save speaker name lookup
         tacotron_speaker_id_lookup = checkpoint['speaker_id_lookup'] # save speaker_id lookup
@@ -328,10 +533,12 @@ class T2S:
     
     
     def update_tt(self, tacotron_name):
-        self.model, self.tt_hparams, self.tt_sp_name_lookup, self.tt_sp_id_lookup = self.load_tacotron2(self.conf['tacotron']['models'][tacotron_name]['modelpath'])
+        self.tacotron, self.tt_hparams, self.tt_sp_name_lookup, self.tt_sp_id_lookup = self.model_cache.get(('tacotron', tacotron_name),
+            lambda: self.load_tacotron2(self.conf['tacotron']['models'][tacotron_name]['modelpath']), in_use=[('waveglow', self.wg_current)])
         self.tt_current = tacotron_name
+        self.tt_dtype = self.tacotron.embedding.weight.dtype # Tacotron2 input precision, fp32 for quantized models (WaveGlow still uses self.dtype)
         
-        if self.conf['tacotron']['use_speaker_ids_file_override']:# (optional) override
+        if self.conf['tacotron']['use_speaker_ids_file_override']:# (optional) override since my checkpoints are still missing speaker names
             self.tt_sp_name_lookup = {name: self.tt_sp_id_lookup[int(ext_id)] for _, name, ext_id in load_filepaths_and_text(self.conf['tacotron']['speaker_ids_file'])}
     
     
@@ -350,86 +557,98 @@ class T2S:
         return validated_names
     
     
-    def infer(self, text, speaker_names, style_mode, textseg_mode, batch_mode, max_attempts, max_duration_s, batch_size, dyna_max_duration_s, use_arpabet, target_score, speaker_mode, cat_silence_s, textseg_len_target, gate_delay=4, gate_threshold=0.6, filename_prefix=None, status_updates=False, show_time_to_gen=True, end_mode='thresh', absolute_maximum_tries=4096, absolutely_required_score=-1e3):
+    def segment_text(self, text, textseg_mode, textseg_len_target):
+        """Split a request's text into the segments that will be spoken as individual clips."""
+        if textseg_mode == 'no_segmentation':
+            texts = [text,]
+        elif textseg_mode == 'segment_by_line':
+            texts = text.split("\n")
+        elif textseg_mode == 'segment_by_sentence':
+            texts = parse_text_into_segments(text, split_at_quotes=False, target_segment_length=textseg_len_target)
+        elif textseg_mode == 'segment_by_sentencequote':
+            texts = parse_text_into_segments(text, split_at_quotes=True, target_segment_length=textseg_len_target)
+        else:
+            raise NotImplementedError(f"textseg_mode of {textseg_mode} is invalid.")
+        
+        # cleanup for empty inputs.
+        texts = [x.strip() for x in texts if len(x.strip())]
+        return texts
+    
+    
+    def infer_stream(self, text, speaker_names, style_mode, textseg_mode, batch_mode, max_attempts, max_duration_s, batch_size, dyna_max_duration_s, use_arpabet, target_score, speaker_mode, cat_silence_s, textseg_len_target, gate_delay=4, gate_threshold=0.6, status_updates=False, show_time_to_gen=True, end_mode='thresh', absolute_maximum_tries=4096, absolutely_required_score=-1e3):
         """
-        PARAMS:
-        ...
-        gate_delay
-            default: 4
-            options: int ( 0 -> inf )
-            info: a modifier for when spectrograms are cut off.
-                  This would allow you to add silence to the end of a clip without an unnatural fade-out.
-                  8 will give 0.1 seconds of delay before ending the clip.
-                  If this param is set too high then the model will try to start speaking again
-                  despite not having any text left to speak, therefore keeping it low is typical.
-        gate_threshold
-            default: 0.6
-            options: float ( 0.0 -> 1.0 )
-            info: used to control when Tacotron2 will stop generating new mel frames.
-                  This will effect speed of generation as the model will generate
-                  extra frames till it hits the threshold. This may be preferred if
-                  you believe the model is stopping generation too early.
-                  When end_mode == 'thresh', this param will also be used to decide
-                  when the audio from the best spectrograms should be cut off.
-        ...
-        end_mode
-            default: 'thresh'
-            options: ['max','thresh']
-            info: controls where the spectrograms are cut off.
-                  'max' will cut the spectrograms off at the highest gate output, 
-                  'thresh' will cut off spectrograms at the first gate output over gate_threshold.
+        Generator version of infer(). Takes the same params (except filename_prefix) and
+        yields each segment as soon as WaveGlow has finished it, instead of writing files.
+        
+        YIELDS:
+            dict with
+            - 'request':       index of the request this segment belongs to (always 0 when text is a str)
+            - 'segment':       index of the segment
+            - 'text':          the segment's text
+            - 'audio':         int16 numpy array of the segment's audio (including cat_silence_s padding)
+            - 'audio_len':     number of samples of speech in 'audio' (excluding padding)
+            - 'sampling_rate': sampling rate of 'audio'
+            - 'score', 'score_str': alignment score of the chosen spectrogram
+            - 'is_last':       True if this is the final segment of it's request
+            - 'total_specs', 'n_passes': running totals for the html stats
+            - 'cached':        True if the segment was loaded from the audio cache (see 'audio_cache' in t2s_config.json)
+            - 'mel':           (only when the audio cache stores mels) fp16 numpy array of the chosen spectrogram [n_mel, T]
         """
         assert end_mode in ['max','thresh'], f"end_mode of {end_mode} is not valid."
         assert gate_delay > -10, "gate_delay is negative."
         assert gate_threshold > 0.0, "gate_threshold less than 0.0"
         assert gate_threshold <= 1.0, "gate_threshold greater than 1.0"
-        os.makedirs(self.conf["working_directory"], exist_ok=True)
-        os.makedirs(self.conf["output_directory"], exist_ok=True)
         
         with torch.no_grad():
             # time to gen
             audio_len = 0
             start_time = time.time()
             
-            # Score Metric
-            scores = []
-            
             # Score Parameters
             diagonality_weighting = 0.5 # 'pacing factor', a penalty for clips where the model pace changes often/rapidly. # this thing does NOT work well for Rarity.
             max_focus_weighting = 1.0   # 'stuck factor', a penalty for clips that spend execisve time on the same letter.
             min_focus_weighting = 1.0   # 'miniskip factor', a penalty for skipping/ignoring single letters in the input text.
             avg_focus_weighting = 1.0   # 'skip factor', a penalty for skipping very large parts of the input text
+            score_weights = {'diagonality_weighting': diagonality_weighting, 'max_focus_weighting': max_focus_weighting, 'min_focus_weighting': min_focus_weighting, 'avg_focus_weighting': avg_focus_weighting}
             
-            # add a filename prefix to keep multiple requests seperate
-            if not filename_prefix:
-                filename_prefix = str(time.time())
+            # adaptive best-of-N (aborts bad attempts early and starts new ones in their place)
+            adaptive_conf = self.conf.get('adaptive_sampler', {})
+            use_adaptive_sampler = adaptive_conf.get('enabled', False) and not (self.tacotron.decoder.attention_type == 1 and self.tacotron.decoder.num_att_mixtures == 1)
             
-            # add output filename
-            output_filename = f"{filename_prefix}_output"
+            # multiple requests can be passed in together to share batches
+            request_texts = [text,] if isinstance(text, str) else list(text)
             
             # split the text into chunks (if applicable)
-            if textseg_mode == 'no_segmentation':
-                texts = [text,]
-            elif textseg_mode == 'segment_by_line':
-                texts = text.split("\n")
-            elif textseg_mode == 'segment_by_sentence':
-                texts = parse_text_into_segments(text, split_at_quotes=False, target_segment_length=textseg_len_target)
-            elif textseg_mode == 'segment_by_sentencequote':
-                texts = parse_text_into_segments(text, split_at_quotes=True, target_segment_length=textseg_len_target)
-            else:
-                raise NotImplementedError(f"textseg_mode of {textseg_mode} is invalid.")
-            del text
-            
-            # cleanup for empty inputs.
-            texts = [x.strip() for x in texts if len(x.strip())]
+            texts = []
+            texts_request = [] # request index of each segment
+            for r, request_text in enumerate(request_texts):
+                request_segments = self.segment_text(request_text, textseg_mode, textseg_len_target)
+                assert len(request_segments), f"request {r} has no text to speak."
+                texts.extend(request_segments)
+                texts_request.extend([r,]*len(request_segments))
+            del text, request_texts
+            request_last_segment = {r: i for i, r in enumerate(texts_request)} # index of the final segment for each request
             
             total_len = len(texts)
             
-            # update Tacotron stopping params
+            def segment_info(segment_index, score, score_str):
+                r = texts_request[segment_index] # find which request this clip belongs to
+                return {
+                    'request': r,
+                    'segment': segment_index,
+                    'text': texts[segment_index],
+                    'sampling_rate': self.tt_hparams.sampling_rate,
+                    'score': score,
+                    'score_str': score_str,
+                    'is_last': (segment_index == request_last_segment[r]), # true if final clip of this request
+                    'total_specs': total_specs,
+                    'n_passes': n_passes,
+                    'cached': False,
+                }
+            
+            # Tacotron stopping params (passed to every inference call instead of being set on the Decoder, so concurrent requests can share the model)
             frames_per_second = float(self.tt_hparams.sampling_rate/self.tt_hparams.hop_length)
-            self.tacotron.decoder.gate_delay = int(gate_delay)
-            self.tacotron.decoder.max_decoder_steps = int(min(max([len(t) for t in texts]) * float(dyna_max_duration_s)*frames_per_second, float(max_duration_s)*frames_per_second))
-            self.tacotron.decoder.gate_threshold = float(gate_threshold)
+            stopping_params = {'gate_delay': int(gate_delay), 'gate_threshold': float(gate_threshold)}
             
             # find closest valid name(s)
             speaker_names = self.get_closest_names(speaker_names)
@@ -448,326 +667,501 @@ class T2S:
             else:
                 raise NotImplementedError(f"batch_mode of {batch_mode} is invalid.")
             
-            # for size merging
-            running_fsize = 0
-            fpaths = []
-            out_count = 0
-            
-            # keeping track of stats for html/terminal
-            show_inference_progress_start = time.time()
-            continue_from = 0
-            counter = 0
-            total_specs = 0
-            n_passes = 0
-            
-            text_batch_in_progress = []
-            for text_index, text in enumerate(texts):
-                if text_index < continue_from: print(f"Skipping {text_index}.\t",end=""); counter+=1; continue
-                last_text = (text_index == (total_len-1)) # true if final text input
-                
-                # setup the text batches
-                text_batch_in_progress.append(text)
-                if (len(text_batch_in_progress) == simultaneous_texts) or last_text: # if text batch ready or final input
-                    text_batch = text_batch_in_progress
-                    text_batch_in_progress = []
-                else:
-                    continue # if batch not ready, add another text
-                
-                self.tacotron.decoder.max_decoder_steps = int(min(max([len(t) for t in text_batch]) * float(dyna_max_duration_s)*frames_per_second, float(max_duration_s)*frames_per_second))
-                
-                if speaker_mode == "not_interleaved": # non-interleaved
-                    batch_speaker_names = speaker_names * -(-simultaneous_texts//len(speaker_names))
-                    batch_speaker_names = batch_speaker_names[:simultaneous_texts]
-                elif speaker_mode == "interleaved": # interleaved
-                    repeats = -(-simultaneous_texts//len(speaker_names))
-                    batch_speaker_names = [i for i in speaker_names for _ in range(repeats)][:simultaneous_texts]
-                elif speaker_mode == "random": # random
-                    batch_speaker_names = [random.choice(speaker_names),] * simultaneous_texts
-                elif speaker_mode == "cycle_next": # use next speaker for each text input
-                    def shuffle_and_return():
-                        first_speaker = speaker_names[0]
-                        speaker_names.append(speaker_names.pop(0))
-                        return first_speaker
-                    batch_speaker_names = [shuffle_and_return() for i in range(simultaneous_texts)]
-                else:
-                    raise NotImplementedError
-                
-                if 0:# (optional) use different speaker list for text inside quotes
-                    speaker_ids = [random.choice(speakers).split("|")[2] if ('"' in text) else random.choice(narrators).split("|")[2] for text in text_batch] # pick speaker if quotemark in text, else narrator
-                text_batch  = [text.replace('"',"") for text in text_batch] # remove quotes from text
-                
-                if len(batch_speaker_names) > len(text_batch):
-                    batch_speaker_names = batch_speaker_names[:len(text_batch)]
-                    simultaneous_texts = len(text_batch)
-                
-                # get speaker_ids (tacotron)
-                tacotron_speaker_ids = [self.tt_sp_name_lookup[speaker] for speaker in batch_speaker_names]
-                tacotron_speaker_ids = torch.LongTensor(tacotron_speaker_ids).cuda().repeat_interleave(batch_size_per_text)
-                
-                # get speaker_ids (waveglow)
-                waveglow_speaker_ids = self.get_wg_sp_id_from_tt_sp_names(batch_speaker_names)
-                waveglow_speaker_ids = [self.wg_sp_id_lookup[int(speaker_id)] for speaker_id in waveglow_speaker_ids]
-                waveglow_speaker_ids = torch.LongTensor(waveglow_speaker_ids).cuda()
-                
-                # get style input
-                if style_mode == 'mel':
-                    mel = load_mel(audio_path.replace(".npy",".wav")).cuda().half()
-                    style_input = mel
-                elif style_mode == 'token':
-                    pass
-                    #style_input =
-                elif style_mode == 'zeros':
-                    style_input = None
-                elif style_mode == 'torchmoji_hidden':
-                    try:
-                        tokenized, _, _ = self.tm_sentence_tokenizer.tokenize_sentences(text_batch) # input array [B] e.g: ["Test?","2nd Sentence!"]
-                    except:
-                        raise Exception(f"TorchMoji failed to tokenize text:\n{text_batch}")
-                    try:
-                        embedding = self.tm_torchmoji(tokenized) # returns np array [B, Embed]
-                    except Exception as ex:
-                        print(f'Exception: {ex}')
-                        print(f"TorchMoji failed to process text:\n{text_batch}")
-                        #raise Exception(f"text\n{text}\nfailed to process.")
-                    style_input = torch.from_numpy(embedding).cuda().half().repeat_interleave(batch_size_per_text, dim=0)
-                elif style_mode == 'torchmoji_string':
-                    style_input = text_batch
-                    raise NotImplementedError
-                else:
-                    raise NotImplementedError
+            # (optional) run WaveGlow for each text batch on a seperate thread/CUDA stream while Tacotron2 works on the next batch
+            vocode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='T2S-vocoder') if (self.conf.get('pipelined_inference', False) and self.device.type == 'cuda') else None
+            try:
+                pending_batch = None # (get_vocoded, segment_infos) of the batch currently being vocoded
                 
-                if style_input.size(0) < (simultaneous_texts*batch_size_per_text):
-                    diff = -(-(simultaneous_texts*batch_size_per_text) // style_input.size(0))
-                    style_input = style_input.repeat(diff, 1)[:simultaneous_texts*batch_size_per_text]
+                # keeping track of stats for html/terminal
+                show_inference_progress_start = time.time()
+                continue_from = 0
+                counter = 0
+                total_specs = 0
+                n_passes = 0
                 
-                # check punctuation and add '.' if missing
-                valid_last_char = '-,.?!;:' # valid final characters in texts
-                text_batch = [text+'.' if (text[-1] not in valid_last_char) else text for text in text_batch]
-                
-                # parse text
-                text_batch = [unidecode(text.replace("...",". ").replace("  "," ").strip()) for text in text_batch] # remove eclipses, double spaces, unicode and spaces before/after the text.
-                if use_arpabet: # convert texts to ARPAbet (phonetic) versions.
-                    text_batch = [self.ARPA(text) for text in text_batch]
-                
-                # convert texts to number representation, pad where appropriate and move to GPU
-                sequence_split = [torch.LongTensor(text_to_sequence(text, self.tt_hparams.text_cleaners)) for text in text_batch] # convert texts to numpy representation
-                text_lengths = torch.tensor([seq.size(0) for seq in sequence_split])
-                max_len = text_lengths.max().item()
-                sequence = torch.zeros(text_lengths.size(0), max_len).long() # create large tensor to move each text input into
-                for i in range(text_lengths.size(0)): # move each text into padded input tensor
-                    sequence[i, :sequence_split[i].size(0)] = sequence_split[i]
-                sequence = sequence.cuda().long().repeat_interleave(batch_size_per_text, dim=0) # move to GPU and repeat text
-                text_lengths = text_lengths.cuda().long() # move to GPU
-                
-                # debug # Looks like pytorch 1.5 doesn't run contiguous on some operations the previous versions did.
-                text_lengths = text_lengths.clone()
-                sequence = sequence.clone()
-                
-                print("sequence.shape[0] =",sequence.shape[0]) # debug
-                
-                try:
-                    best_score = np.ones(simultaneous_texts) * -9e9
-                    tries      = np.zeros(simultaneous_texts)
-                    best_generations = [0]*simultaneous_texts
-                    best_score_str = ['']*simultaneous_texts
-                    while np.amin(best_score) < target_score:
-                        # run Tacotron
+                text_batch_in_progress = []
+                for text_index, text in enumerate(texts):
+                    if text_index < continue_from: print(f"Skipping {text_index}.\t",end=""); counter+=1; continue
+                    last_text = (text_index == (total_len-1)) # true if final text input
+                    
+                    # setup the text batches
+                    text_batch_in_progress.append(text)
+                    if (len(text_batch_in_progress) == simultaneous_texts) or last_text: # if text batch ready or final input
+                        text_batch = text_batch_in_progress
+                        text_batch_in_progress = []
+                    else:
+                        continue # if batch not ready, add another text
+                    batch_start_index = text_index-(len(text_batch)-1) # segment index of text_batch[0]
+                    
+                    stopping_params['max_decoder_steps'] = int(min(max([len(t) for t in text_batch]) * float(dyna_max_duration_s)*frames_per_second, float(max_duration_s)*frames_per_second))
+                    
+                    if speaker_mode == "not_interleaved": # non-interleaved
+                        batch_speaker_names = speaker_names * -(-simultaneous_texts//len(speaker_names))
+                        batch_speaker_names = batch_speaker_names[:simultaneous_texts]
+                    elif speaker_mode == "interleaved": # interleaved
+                        repeats = -(-simultaneous_texts//len(speaker_names))
+                        batch_speaker_names = [i for i in speaker_names for _ in range(repeats)][:simultaneous_texts]
+                    elif speaker_mode == "random": # random
+                        batch_speaker_names = [random.choice(speaker_names),] * simultaneous_texts
+                    elif speaker_mode == "cycle_next": # use next speaker for each text input
+                        def shuffle_and_return():
+                            first_speaker = speaker_names[0]
+                            speaker_names.append(speaker_names.pop(0))
+                            return first_speaker
+                        batch_speaker_names = [shuffle_and_return() for i in range(simultaneous_texts)]
+                    else:
+                        raise NotImplementedError
+                    
+                    if 0:# (optional) use different speaker list for text inside quotes
+                        speaker_ids = [random.choice(speakers).split("|")[2] if ('"' in text) else random.choice(narrators).split("|")[2] for text in text_batch] # pick speaker if quotemark in text, else narrator
+                    text_batch  = [text.replace('"',"") for text in text_batch] # remove quotes from text
+                    
+                    if len(batch_speaker_names) > len(text_batch):
+                        batch_speaker_names = batch_speaker_names[:len(text_batch)]
+                        simultaneous_texts = len(text_batch)
+                    
+                    # (optional) load segments that have been generated before, only the rest are sent to Tacotron2
+                    batch_simultaneous_texts = simultaneous_texts
+                    batch_segment_indices = list(range(batch_start_index, batch_start_index+len(text_batch))) # segment index of each text in text_batch
+                    cache_keys = [None,]*len(text_batch)
+                    cached_infos = []
+                    if self.audio_cache is not None:
+                        cache_keys = [self.audio_cache.make_key(self.tt_current, self.wg_current, speaker, text, use_arpabet, style_mode, target_score, max_attempts, absolute_maximum_tries, absolutely_required_score, max_duration_s, dyna_max_duration_s, gate_delay, gate_threshold, end_mode, cat_silence_s) for speaker, text in zip(batch_speaker_names, text_batch)]
+                        misses = []
+                        for j, key in enumerate(cache_keys):
+                            cached = self.audio_cache.get(key)
+                            if cached is None:
+                                misses.append(j)
+                                continue
+                            info = segment_info(batch_segment_indices[j], cached.pop('score'), cached.pop('score_str'))
+                            info.update(cached)
+                            info['cached'] = True
+                            cached_infos.append(info)
+                        if len(cached_infos):
+                            print(f"Loaded {len(cached_infos)} segment(s) from the audio cache.")
+                            text_batch, batch_speaker_names, batch_segment_indices, cache_keys = [[x[j] for j in misses] for x in (text_batch, batch_speaker_names, batch_segment_indices, cache_keys)]
+                            simultaneous_texts = len(text_batch)
+                    
+                    if not len(text_batch): # every segment of this batch was cached
+                        simultaneous_texts = batch_simultaneous_texts
+                        if pending_batch is not None:
+                            for segment in self.join_vocoded_batch(*pending_batch):
+                                audio_len+=segment['audio_len']
+                                yield segment
+                            pending_batch = None
+                        for segment in cached_infos:
+                            audio_len+=segment['audio_len']
+                            yield segment
+                        continue
+                    
+                    # get speaker_ids (tacotron)
+                    tacotron_speaker_ids = [self.tt_sp_name_lookup[speaker] for speaker in batch_speaker_names]
+                    tacotron_speaker_ids = torch.LongTensor(tacotron_speaker_ids).to(self.device)
+                    
+                    # get speaker_ids (waveglow)
+                    waveglow_speaker_ids = self.get_wg_sp_id_from_tt_sp_names(batch_speaker_names)
+                    waveglow_speaker_ids = [self.wg_sp_id_lookup[int(speaker_id)] for speaker_id in waveglow_speaker_ids]
+                    waveglow_speaker_ids = torch.LongTensor(waveglow_speaker_ids).to(self.device)
+                    
+                    # get style input
+                    if style_mode == 'mel':
+                        mel = load_mel(audio_path.replace(".npy",".wav")).to(self.device, self.tt_dtype)
+                        style_input = mel
+                    elif style_mode == 'token':
+                        pass
+                        #style_input =
+                    elif style_mode == 'zeros':
+                        style_input = None
+                    elif style_mode == 'torchmoji_hidden':
+                        try:
+                            tokenized, _, _ = self.tm_sentence_tokenizer.tokenize_sentences(text_batch) # input array [B] e.g: ["Test?","2nd Sentence!"]
+                        except:
+                            raise Exception(f"TorchMoji failed to tokenize text:\n{text_batch}")
+                        try:
+                            embedding = self.tm_torchmoji(tokenized) # returns np array [B, Embed]
+                        except Exception as ex:
+                            print(f'Exception: {ex}')
+                            print(f"TorchMoji failed to process text:\n{text_batch}")
+                            #raise Exception(f"text\n{text}\nfailed to process.")
+                        style_input = torch.from_numpy(embedding).to(self.device, self.tt_dtype)
+                    elif style_mode == 'torchmoji_string':
+                        style_input = text_batch
+                        raise NotImplementedError
+                    else:
+                        raise NotImplementedError
+                    
+                    if style_input.size(0) < simultaneous_texts:
+                        diff = -(-simultaneous_texts // style_input.size(0))
+                        style_input = style_input.repeat(diff, 1)[:simultaneous_texts]
+                    
+                    # check punctuation and add '.' if missing
+                    valid_last_char = '-,.?!;:' # valid final characters in texts
+                    text_batch = [text+'.' if (text[-1] not in valid_last_char) else text for text in text_batch]
+                    
+                    # parse text
+                    text_batch = [unidecode(text.replace("...",". ").replace("  "," ").strip()) for text in text_batch] # remove eclipses, double spaces, unicode and spaces before/after the text.
+                    if use_arpabet: # convert texts to ARPAbet (phonetic) versions.
+                        text_batch = [self.ARPA(text) for text in text_batch]
+                    
+                    # convert texts to number representation, pad where appropriate and move to GPU
+                    sequence, text_lengths = text_to_sequence_batch(text_batch, self.tt_hparams.text_cleaners) # [B, max_len] padded IDs, [B] lengths
+                    sequence = sequence.to(self.device).long() # move to GPU (each text is only encoded once, the encoder outputs are repeated for every attempt)
+                    text_lengths = text_lengths.to(self.device).long() # move to GPU
+                    
+                    # debug # Looks like pytorch 1.5 doesn't run contiguous on some operations the previous versions did.
+                    text_lengths = text_lengths.clone()
+                    sequence = sequence.clone()
+                    
+                    print("sequence.shape[0] =",sequence.shape[0]) # debug
+                    
+                    if use_adaptive_sampler:
+                        sampler = BestOfNSampler(text_lengths, target_score, max_attempts, absolute_maximum_tries, absolutely_required_score, stopping_params['max_decoder_steps'], gate_threshold, end_mode=end_mode, check_interval=adaptive_conf.get('check_interval', 8), score_weights=score_weights)
                         if status_updates: print("Running Tacotron2... ", end='')
-                        mel_batch_outputs, mel_batch_outputs_postnet, gate_batch_outputs, alignments_batch = self.tacotron.inference(sequence, tacotron_speaker_ids, style_input=style_input, style_mode=style_mode, text_lengths=text_lengths.repeat_interleave(batch_size_per_text, dim=0))
+                        self.tacotron.inference_pool(sequence, tacotron_speaker_ids, sampler, sequence.size(0)*batch_size_per_text, style_input=style_input, style_mode=style_mode, text_lengths=text_lengths, **stopping_params)
+                        if status_updates: print("Done")
                         
-                        # metric for html side
+                        best_score, best_score_str, best_generations, tries = sampler.best_score, sampler.best_score_str, sampler.best_generations, sampler.tries
                         n_passes+=1 # metric for html
-                        total_specs+=mel_batch_outputs.shape[0]
+                        total_specs+=int(tries.sum())
+                        print(f"{int(tries.sum())} attempts ({sampler.n_aborted} aborted early), minimum score of {np.amin(best_score):.4f}.")
+                    else:
+                        best_score = np.ones(simultaneous_texts) * -9e9
+                        tries      = np.zeros(simultaneous_texts)
+                        best_generations = [0]*simultaneous_texts
+                        best_score_str = ['']*simultaneous_texts
+                        best_score_device = torch.full((simultaneous_texts,), -9e9, device=self.device, dtype=torch.float64) # same as best_score, kept on the device so each pass only needs one copy to the host
                         
-                        # get metrics for each item
-                        if end_mode == 'thresh':
-                            output_lengths = get_first_over_thresh(gate_batch_outputs, gate_threshold)
-                        elif end_mode == 'max':
-                            output_lengths = gate_batch_outputs.argmax(dim=1)
-                        diagonality_batch, avg_prob_batch, enc_max_focus_batch, enc_min_focus_batch, enc_avg_focus_batch = alignment_metric(alignments_batch, input_lengths=text_lengths.repeat_interleave(batch_size_per_text, dim=0), output_lengths=output_lengths)
-                        
-                        # split batch into items
-                        batch = list(zip(
-                            mel_batch_outputs.split(1,dim=0),
-                            mel_batch_outputs_postnet.split(1,dim=0),
-                            gate_batch_outputs.split(1,dim=0),
-                            alignments_batch.split(1,dim=0),
-                            diagonality_batch,
-                            avg_prob_batch,
-                            enc_max_focus_batch,
-                            enc_min_focus_batch,
-                            enc_avg_focus_batch,))
-                        
-                        for j in range(simultaneous_texts): # process each set of text spectrograms seperately
-                            start, end = (j*batch_size_per_text), ((j+1)*batch_size_per_text)
-                            sametext_batch = batch[start:end] # seperate the full batch into pieces that use the same input text
+                        # run the Encoder once, the outputs are reused for every attempt/retry
+                        encoder_outputs = self.tacotron.encode(sequence, tacotron_speaker_ids, style_input=style_input, style_mode=style_mode, text_lengths=text_lengths)
+                        while np.amin(best_score) < target_score:
+                            # run Tacotron
+                            if status_updates: print("Running Tacotron2... ", end='')
+                            mel_batch_outputs, _, gate_batch_outputs, alignments_batch = self.tacotron.inference(sequence, tacotron_speaker_ids, style_input=style_input, style_mode=style_mode, text_lengths=text_lengths, encoder_outputs=encoder_outputs, n_repeats=batch_size_per_text, run_postnet=False, return_alignments=True, **stopping_params) # Postnet is only run on the best attempts, alignments are always needed for scoring
                             
-                            # process all items related to the j'th text input
-                            for k, (mel_outputs, mel_outputs_postnet, gate_outputs, alignments, diagonality, avg_prob, enc_max_focus, enc_min_focus, enc_avg_focus) in enumerate(sametext_batch):
-                                # factors that make up score
-                                weighted_score =  avg_prob.item() # general alignment quality
-                                diagonality_punishment = (max(diagonality.item(),1.20)-1.20) * 0.5 * diagonality_weighting  # smooth pacing
-                                max_focus_punishment = max((enc_max_focus.item()-24), 0) * 0.005 * max_focus_weighting # getting stuck on pauses/phones
-                                min_focus_punishment = max(0.25-enc_min_focus.item(),0) * min_focus_weighting # skipping single enc outputs
-                                avg_focus_punishment = max(2.5-enc_avg_focus.item(), 0) * avg_focus_weighting # skipping most enc outputs
-                                weighted_score -= (diagonality_punishment + max_focus_punishment + min_focus_punishment + avg_focus_punishment)
-                                score_str = f"{round(diagonality.item(),3)} {round(avg_prob.item()*100,2)}% {round(weighted_score,4)} {round(max_focus_punishment,2)} {round(min_focus_punishment,2)} {round(avg_focus_punishment,2)}|"
-                                if weighted_score > best_score[j]:
-                                    best_score[j] = weighted_score
-                                    best_score_str[j] = score_str
-                                    best_generations[j] = [mel_outputs, mel_outputs_postnet, gate_outputs, alignments]
-                                tries[j]+=1
-                                if np.amin(tries) >= max_attempts and np.amin(best_score) > (absolutely_required_score-1):
-                                    raise StopIteration
-                                if np.amin(tries) >= absolute_maximum_tries:
-                                    print(f"Absolutely required score not achieved in {absolute_maximum_tries} attempts - ", end='')
-                                    raise StopIteration
-                        
-                        if np.amin(tries) < (max_attempts-1):
-                            print(f'Minimum score of {np.amin(best_score)} is less than Target score of {target_score}. Retrying.')
-                        elif np.amin(best_score) < absolutely_required_score:
-                            print(f"Minimum score of {np.amin(best_score)} is less than 'Absolutely Required score' of {absolutely_required_score}. Retrying.")
-                except StopIteration:
-                    del batch
-                    if status_updates: print("Done")
-                    pass
-                
-                # cleanup VRAM
-                style_input = sequence = None
-                
-                # [[mel, melpost, gate, align], [mel, melpost, gate, align], [mel, melpost, gate, align]] -> [[mel, mel, mel], [melpost, melpost, melpost], [gate, gate, gate], [align, align, align]]
-                mel_batch_outputs, mel_batch_outputs_postnet, gate_batch_outputs, alignments_batch = [x[0][0].T for x in best_generations], [x[1][0].T for x in best_generations], [x[2][0] for x in best_generations], [x[3][0] for x in best_generations]
-                # pickup the best attempts from each input
-                
-                # stack best output arrays into tensors for WaveGlow
-                gate_batch_outputs = torch.nn.utils.rnn.pad_sequence(gate_batch_outputs, batch_first=True, padding_value=0.0)
-                
-                # get duration(s)
-                if end_mode == 'thresh':
-                    max_lengths = get_first_over_thresh(gate_batch_outputs, gate_threshold)+gate_delay
-                elif end_mode == 'max':
-                    max_lengths = gate_batch_outputs.argmax(dim=1)+gate_delay
-                max_length = torch.max(max_lengths)
-                
-                mel_batch_outputs = torch.nn.utils.rnn.pad_sequence(mel_batch_outputs, batch_first=True, padding_value=-11.6).transpose(1,2)[:,:,:max_length]
-                mel_batch_outputs_postnet = torch.nn.utils.rnn.pad_sequence(mel_batch_outputs_postnet, batch_first=True, padding_value=-11.6).transpose(1,2)[:,:,:max_length]
-                alignments_batch = torch.nn.utils.rnn.pad_sequence(alignments_batch, batch_first=True, padding_value=0)[:,:max_length,:]
-                
-                if status_updates:
-                    print("Running WaveGlow... ", end='')
-                # Run WaveGlow
-                audio_batch = self.waveglow.infer(mel_batch_outputs_postnet, speaker_ids=waveglow_speaker_ids, sigma=self.wg_train_sigma*0.95)
-                audio_denoised_batch = self.wg_denoiser(audio_batch, strength=0.0001).squeeze(1)
-                print("audio_denoised_batch.shape =", audio_denoised_batch.shape) # debug
-                if status_updates:
-                    print('Done')
-                
-                
-                # write audio files and any stats
-                audio_bs = audio_batch.size(0)
-                for j, (audio, audio_denoised) in enumerate(zip(audio_batch.split(1, dim=0), audio_denoised_batch.split(1, dim=0))):
-                    # remove WaveGlow padding
-                    audio_end = max_lengths[j] * self.tt_hparams.hop_length
-                    audio = audio[:,:audio_end]
-                    audio_denoised = audio_denoised[:,:audio_end]
+                            # metric for html side
+                            n_passes+=1 # metric for html
+                            total_specs+=mel_batch_outputs.shape[0]
+                            
+                            # get metrics for each item
+                            if end_mode == 'thresh':
+                                output_lengths = get_first_over_thresh(gate_batch_outputs, gate_threshold)
+                            elif end_mode == 'max':
+                                output_lengths = gate_batch_outputs.argmax(dim=1)
+                            metrics = alignment_metric(alignments_batch, input_lengths=text_lengths.repeat_interleave(batch_size_per_text, dim=0), output_lengths=output_lengths, to_cpu=False)
+                            scores = score_alignments(*metrics, **score_weights).view(simultaneous_texts, batch_size_per_text, -1) # [texts, attempts, 6]
+                            best_score_device, pass_info = best_of_pass(scores, best_score_device)
+                            tries += batch_size_per_text
+                            
+                            for j in np.nonzero(pass_info[:, 6])[0]: # texts that got a better attempt
+                                i = j*batch_size_per_text + int(pass_info[j, 7])
+                                best_score[j] = pass_info[j, 2]
+                                best_score_str[j] = score_to_str(pass_info[j, :6])
+                                best_generations[j] = [mel_batch_outputs[i:i+1], None, gate_batch_outputs[i:i+1], alignments_batch[i:i+1]]
+                            del scores, metrics
+                            
+                            if np.amin(tries) >= max_attempts and np.amin(best_score) > (absolutely_required_score-1):
+                                break
+                            if np.amin(tries) >= absolute_maximum_tries:
+                                print(f"Absolutely required score not achieved in {absolute_maximum_tries} attempts - ", end='')
+                                break
+                            if np.amin(best_score) < target_score:
+                                if np.amin(tries) < (max_attempts-1):
+                                    print(f'Minimum score of {np.amin(best_score)} is less than Target score of {target_score}. Retrying.')
+                                elif np.amin(best_score) < absolutely_required_score:
+                                    print(f"Minimum score of {np.amin(best_score)} is less than 'Absolutely Required score' of {absolutely_required_score}. Retrying.")
+                        if status_updates: print("Done")
                     
-                    # remove Tacotron2 padding
-                    spec_end = max_lengths[j]
-                    mel_outputs = mel_batch_outputs.split(1, dim=0)[j][:,:,:spec_end]
-                    mel_outputs_postnet = mel_batch_outputs_postnet.split(1, dim=0)[j][:,:,:spec_end]
-                    alignments = alignments_batch.split(1, dim=0)[j][:,:spec_end,:text_lengths[j]]
+                    # cleanup VRAM
+                    style_input = sequence = encoder_outputs = None
                     
-                    # save audio
-                    filename = f"{filename_prefix}_{counter//300:04}_{counter:06}.wav"
-                    save_path = os.path.join(self.conf['working_directory'], filename)
+                    # run Postnet on the best attempt of each text
+                    for generation in best_generations:
+                        generation[0] = generation[0].to(self.tt_dtype) # (if decoder outputs were stored in fp16)
+                        generation[1] = self.tacotron.postnet_inference(generation[0])
                     
-                    # add silence to clips (ignore last clip)
-                    if cat_silence_s:
-                        cat_silence_samples = int(cat_silence_s*self.tt_hparams.sampling_rate)
-                        audio = torch.nn.functional.pad(audio, (0, cat_silence_samples))
                     
-                    # scale audio for int16 output
-                    audio = (audio * 2**15).squeeze().cpu().numpy().astype('int16')
+                    # [[mel, melpost, gate, align], [mel, melpost, gate, align], [mel, melpost, gate, align]] -> [[mel, mel, mel], [melpost, melpost, melpost], [gate, gate, gate], [align, align, align]]
+                    mel_batch_outputs, mel_batch_outputs_postnet, gate_batch_outputs, alignments_batch = [x[0][0].T for x in best_generations], [x[1][0].T for x in best_generations], [x[2][0] for x in best_generations], [x[3][0] for x in best_generations]
+                    # pickup the best attempts from each input
                     
-                    # remove if already exists
-                    if os.path.exists(save_path):
-                        print(f"File already found at [{save_path}], overwriting.")
-                        os.remove(save_path)
+                    # stack best output arrays into tensors for WaveGlow
+                    gate_batch_outputs = torch.nn.utils.rnn.pad_sequence(gate_batch_outputs, batch_first=True, padding_value=0.0)
                     
-                    if status_updates: print(f"Saving clip to [{save_path}]... ", end="")
-                    write(save_path, self.tt_hparams.sampling_rate, audio)
-                    if status_updates: print("Done")
+                    # get duration(s)
+                    if end_mode == 'thresh':
+                        max_lengths = get_first_over_thresh(gate_batch_outputs, gate_threshold)+gate_delay
+                    elif end_mode == 'max':
+                        max_lengths = gate_batch_outputs.argmax(dim=1)+gate_delay
+                    max_length = torch.max(max_lengths)
                     
-                    counter+=1
-                    audio_len+=audio_end
+                    mel_batch_outputs = torch.nn.utils.rnn.pad_sequence(mel_batch_outputs, batch_first=True, padding_value=-11.6).transpose(1,2)[:,:,:max_length]
+                    mel_batch_outputs_postnet = torch.nn.utils.rnn.pad_sequence(mel_batch_outputs_postnet, batch_first=True, padding_value=-11.6).transpose(1,2)[:,:,:max_length]
+                    alignments_batch = torch.nn.utils.rnn.pad_sequence(alignments_batch, batch_first=True, padding_value=0)[:,:max_length,:]
                     
-                    # ------ merge clips of 300 ------ #
-                    last_item = (j == audio_bs-1)
-                    if (counter % 300) == 0 or (last_text and last_item): # if 300th file or last item of last batch.
-                        i = (counter- 1)//300
-                        # merge batch of 300 files together
-                        print(f"Merging audio files {i*300} to {((i+1)*300)-1}... ", end='')
-                        fpath = os.path.join(self.conf['working_directory'], f"{filename_prefix}_concat_{i:04}.wav")
-                        files_to_merge = os.path.join(self.conf["working_directory"], f"{filename_prefix}_{i:04}_*.wav")
-                        os.system(f'sox "{files_to_merge}" -b 16 "{fpath}"')
-                        assert os.path.exists(fpath), f"'{fpath}' failed to generate."
-                        del files_to_merge
-                        
-                        # delete the original 300 files
-                        print("Cleaning up remaining temp files... ", end="")
-                        tmp_files = [fp for fp in glob(os.path.join(self.conf['working_directory'], f"{filename_prefix}_{i:04}_*.wav")) if "output" not in fp]
-                        _ = [os.remove(fp) for fp in tmp_files]
-                        print("Done")
-                        
-                        # add merged file to final output(s)
-                        fsize = os.stat(fpath).st_size
-                        running_fsize += fsize
-                        fpaths += [fpath,]
-                        if ( running_fsize/(1024**3) > self.conf['output_maxsize_gb'] ) or (len(fpaths) > 300) or (last_text and last_item): # if (total size of fpaths is > 2GB) or (more than 300 inputs) or (last item of last batch): save as output
-                            fpath_str = '"'+'" "'.join(fpaths)+'"' # chain together fpaths in string for SoX input
-                            output_extension = self.conf['sox_output_ext']
-                            if output_extension[0] != '.':
-                                output_extension = f".{output_extension}"
-                            out_name = f"{output_filename}_{out_count:02}{output_extension}"
-                            out_path = os.path.join(self.conf['output_directory'], out_name)
-                            os.system(f'sox {fpath_str} -b 16 "{out_path}"') # merge the merged files into final outputs. bit depth of 16 useful to stay in the 32bit duration limit
-                            
-                            if running_fsize >= (os.stat(out_path).st_size - 1024): # if output seems to have correctly generated.
-                                print("Cleaning up merged temp files... ", end="") # delete the temp files and keep the output
-                                _ = [os.remove(fp) for fp in fpaths]
-                                print("Done")
-                            
-                            running_fsize = 0
-                            out_count+=1
-                            fpaths = []
-                    # ------ // merge clips of 300 // ------ #
-                    #end of writing loop
+                    # info for each segment, yielded once WaveGlow has finished
+                    segment_infos = []
+                    for j in range(len(best_generations)):
+                        info = segment_info(batch_segment_indices[j], best_score[j], best_score_str[j])
+                        if cache_keys[j] is not None:
+                            info['cache_key'] = cache_keys[j]
+                            if self.audio_cache_mels:
+                                info['mel'] = mel_batch_outputs_postnet[j, :, :max_lengths[j]].cpu().half().numpy()
+                        segment_infos.append(info)
+                    segment_infos = sorted(segment_infos+cached_infos, key=lambda x: x['segment'])
+                    
+                    if vocode_executor is not None:
+                        # vocode this batch on the WaveGlow stream while Tacotron2 starts on the next batch
+                        tacotron_done = torch.cuda.Event()
+                        tacotron_done.record()
+                        future = vocode_executor.submit(self.vocode_batch, mel_batch_outputs_postnet, max_lengths, waveglow_speaker_ids, cat_silence_s, status_updates, ready_event=tacotron_done)
+                        if pending_batch is not None:
+                            for segment in self.join_vocoded_batch(*pending_batch):
+                                audio_len+=segment['audio_len']
+                                yield segment
+                        pending_batch = (future.result, segment_infos)
+                    else:
+                        vocoded = self.vocode_batch(mel_batch_outputs_postnet, max_lengths, waveglow_speaker_ids, cat_silence_s, status_updates)
+                        for segment in self.join_vocoded_batch(lambda: vocoded, segment_infos):
+                            audio_len+=segment['audio_len']
+                            yield segment
+                    
+                    if self.conf['show_inference_alignment_scores']:
+                        for k, bs in enumerate(best_score):
+                            print(f"Input_Str  {k}: '{text_batch[k]}'")
+                            print(f"Best_Score {k}: {bs:0.4f}")
+                            print(f"Score_Str  {k}: {best_score_str[k]}\n")
+                    
+                    if self.conf['show_inference_progress']:
+                        time_elapsed = time.time()-show_inference_progress_start
+                        time_per_clip = time_elapsed/(text_index+1)
+                        remaining_files = (total_len-(text_index+1))
+                        eta_finish = (remaining_files*time_per_clip)/60
+                        print(f"{text_index}/{total_len}, {eta_finish:.2f}mins remaining.")
+                        del time_per_clip, eta_finish, remaining_files, time_elapsed
+                    
+                    audio_seconds_generated = round(float(audio_len)/self.tt_hparams.sampling_rate,3)
+                    time_to_gen = round(time.time()-start_time,3)
+                    if show_time_to_gen:
+                        print(f"Generated {audio_seconds_generated}s of audio in {time_to_gen}s wall time - so far. (best of {tries.sum().astype('int')} tries this pass)")
+                    
+                    print("\n") # seperate each pass
+                    simultaneous_texts = batch_simultaneous_texts
+                
+                # return the final batch
+                if pending_batch is not None:
+                    for segment in self.join_vocoded_batch(*pending_batch):
+                        yield segment
+            finally: # (also runs if this generator raises or is closed early)
+                if vocode_executor is not None:
+                    vocode_executor.shutdown(wait=True)
+    
+    
+    @torch.no_grad()
+    def vocode_batch(self, mel_batch_outputs_postnet, max_lengths, waveglow_speaker_ids, cat_silence_s, status_updates=False, ready_event=None):
+        """
+        Run WaveGlow (+ Denoiser) on a batch of best spectrograms.
+        If ready_event is given, this runs on a seperate CUDA stream (see 'pipelined_inference' in t2s_config.json) and waits for ready_event first.
+        Returns list of (int16 numpy audio, audio_end) for each spectrogram.
+        """
+        stream = None
+        if ready_event is not None:
+            if getattr(self, 'vocode_stream', None) is None:
+                self.vocode_stream = torch.cuda.Stream()
+            stream = self.vocode_stream
+            stream.wait_event(ready_event)
+            for tensor in (mel_batch_outputs_postnet, max_lengths, waveglow_speaker_ids): # these were created on the Tacotron2 stream, don't let them be freed and reused while WaveGlow is still using them
+                if tensor.is_cuda:
+                    tensor.record_stream(stream)
+        
+        with torch.cuda.stream(stream):
+            mel_batch_outputs_postnet = mel_batch_outputs_postnet.to(self.dtype) # (Tacotron2 may run in a different precision, see self.tt_dtype)
+            if status_updates:
+                print("Running WaveGlow... ", end='')
+            # Run WaveGlow
+            chunked_conf = self.conf['waveglow'].get('chunked_inference', {})
+            if chunked_conf.get('enabled', False): # vocode fixed size windows of every spectrogram in the batch, bounds VRAM usage for long clips
+                mels = [mel[:, :max_lengths[j]] for j, mel in enumerate(mel_batch_outputs_postnet)]
+                audio_batch = chunked_infer(self.waveglow, mels, waveglow_speaker_ids, self.tt_hparams.hop_length, sigma=self.wg_train_sigma*0.95,
+                                            chunk_frames=chunked_conf.get('chunk_frames', 256), overlap_frames=chunked_conf.get('overlap_frames', 16), max_batch_size=chunked_conf.get('max_batch_size', 64))
+                audio_batch = torch.nn.utils.rnn.pad_sequence(audio_batch, batch_first=True).to(mel_batch_outputs_postnet.dtype)
+            else:
+                audio_batch = self.waveglow.infer(mel_batch_outputs_postnet, speaker_ids=waveglow_speaker_ids, sigma=self.wg_train_sigma*0.95)
+            audio_denoised_batch = self.wg_denoiser(audio_batch, strength=0.0001).squeeze(1)
+            print("audio_denoised_batch.shape =", audio_denoised_batch.shape) # debug
+            if status_updates:
+                print('Done')
+            
+            outputs = []
+            max_lengths = max_lengths.cpu()
+            for j, audio in enumerate(audio_batch.split(1, dim=0)):
+                # remove WaveGlow padding
+                audio_end = int(max_lengths[j]) * self.tt_hparams.hop_length
+                audio = audio[:,:audio_end]
                 
-                if self.conf['show_inference_alignment_scores']:
-                    for k, bs in enumerate(best_score):
-                        print(f"Input_Str  {k}: '{text_batch[k]}'")
-                        print(f"Best_Score {k}: {bs:0.4f}")
-                        print(f"Score_Str  {k}: {best_score_str[k]}\n")
+                # add silence to clips (ignore last clip)
+                if cat_silence_s:
+                    cat_silence_samples = int(cat_silence_s*self.tt_hparams.sampling_rate)
+                    audio = torch.nn.functional.pad(audio, (0, cat_silence_samples))
                 
-                for score in best_score:
-                    scores+=[score,]
+                # scale audio for int16 output
+                audio = (audio.float() * 2**15).squeeze().cpu().numpy().astype('int16')
+                outputs.append((audio, audio_end))
+        return outputs
+    
+    
+    def join_vocoded_batch(self, get_vocoded, segment_infos):
+        """Add the audio from vocode_batch() to each segment's info and yield them. Segments loaded from the audio cache are passed through in order."""
+        vocoded = iter(get_vocoded())
+        for segment in segment_infos:
+            if not segment['cached']:
+                segment['audio'], segment['audio_len'] = next(vocoded)
+                cache_key = segment.pop('cache_key', None)
+                if cache_key is not None:
+                    self.audio_cache.put(cache_key, segment['audio'], segment['audio_len'], segment['score'], segment['score_str'], mel=segment.get('mel'))
+            yield segment
+    
+    
+    def infer(self, text, speaker_names, style_mode, textseg_mode, batch_mode, max_attempts, max_duration_s, batch_size, dyna_max_duration_s, use_arpabet, target_score, speaker_mode, cat_silence_s, textseg_len_target, gate_delay=4, gate_threshold=0.6, filename_prefix=None, status_updates=False, show_time_to_gen=True, end_mode='thresh', absolute_maximum_tries=4096, absolutely_required_score=-1e3):
+        """
+        PARAMS:
+        text
+            options: str or list of str
+            info: the text to be spoken.
+                  A list will be treated as multiple independent requests (e.g. from the job queue) that
+                  share Tacotron2 and WaveGlow batches. Each request is written to it's own output file(s).
+        ...
+        gate_delay
+            default: 4
+            options: int ( 0 -> inf )
+            info: a modifier for when spectrograms are cut off.
+                  This would allow you to add silence to the end of a clip without an unnatural fade-out.
+                  8 will give 0.1 seconds of delay before ending the clip.
+                  If this param is set too high then the model will try to start speaking again
+                  despite not having any text left to speak, therefore keeping it low is typical.
+        gate_threshold
+            default: 0.6
+            options: float ( 0.0 -> 1.0 )
+            info: used to control when Tacotron2 will stop generating new mel frames.
+                  This will effect speed of generation as the model will generate
+                  extra frames till it hits the threshold. This may be preferred if
+                  you believe the model is stopping generation too early.
+                  When end_mode == 'thresh', this param will also be used to decide
+                  when the audio from the best spectrograms should be cut off.
+        ...
+        end_mode
+            default: 'thresh'
+            options: ['max','thresh']
+            info: controls where the spectrograms are cut off.
+                  'max' will cut the spectrograms off at the highest gate output, 
+                  'thresh' will cut off spectrograms at the first gate output over gate_threshold.
+        filename_prefix
+            default: None
+            options: str or list of str (one per request)
+            info: prefix for the output filenames, defaults to the current time.
+        
+        RETURNS:
+            (out_names, time_to_gen, audio_seconds_generated, total_specs, n_passes, avg_score)
+            or a list of these tuples (one per request) when text is a list.
+            out_names is the list of files the request was written to (more than one if it was larger than output_maxsize_gb).
+        """
+        os.makedirs(self.conf["working_directory"], exist_ok=True)
+        os.makedirs(self.conf["output_directory"], exist_ok=True)
+        start_time = time.time()
+        
+        # multiple requests can be passed in together to share batches
+        coalesced = not isinstance(text, str)
+        n_requests = len(text) if coalesced else 1
+        
+        # add a filename prefix to keep multiple requests seperate
+        if not filename_prefix:
+            filename_prefix = str(time.time())
+        if isinstance(filename_prefix, str):
+            filename_prefixes = [filename_prefix,] if n_requests == 1 else [f"{filename_prefix}_{r:02}" for r in range(n_requests)]
+        else:
+            filename_prefixes = list(filename_prefix)
+        assert len(filename_prefixes) == n_requests, "got a different number of filename_prefixes and texts"
+        
+        # add output filename
+        output_filenames = [f"{prefix}_output" for prefix in filename_prefixes]
+        
+        output_extension = self.conf['sox_output_ext']
+        if output_extension[0] != '.':
+            output_extension = f".{output_extension}"
+        
+        # output writers (per request), audio is appended to the current output file till it's larger than output_maxsize_gb
+        writers = [None,]*n_requests
+        out_count = [0,]*n_requests
+        out_names = [[] for _ in range(n_requests)]
+        request_audio_len = [0,]*n_requests
+        request_scores = [[] for _ in range(n_requests)]
+        request_out_bytes = [0,]*n_requests
+        total_specs = n_passes = 0
+        
+        # write audio on a seperate thread so file I/O doesn't hold up generating the next segments
+        write_queue = queue.Queue(maxsize=256)
+        write_errors = []
+        def write_loop():
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    break
+                writer, audio, close = item
+                try:
+                    if audio is not None and not len(write_errors): # (after an error, files are still closed but nothing else is written)
+                        if status_updates: print(f"Writing clip to [{writer.path}]... ", end="")
+                        writer.write(audio)
+                        if status_updates: print("Done")
+                    if close:
+                        writer.close()
+                except Exception as ex:
+                    write_errors.append(ex)
+        write_thread = threading.Thread(target=write_loop, name="T2S-writer", daemon=True)
+        write_thread.start()
+        
+        segments = self.infer_stream(text, speaker_names, style_mode, textseg_mode, batch_mode, max_attempts, max_duration_s, batch_size, dyna_max_duration_s, use_arpabet, target_score, speaker_mode, cat_silence_s, textseg_len_target, gate_delay=gate_delay, gate_threshold=gate_threshold, status_updates=status_updates, show_time_to_gen=show_time_to_gen, end_mode=end_mode, absolute_maximum_tries=absolute_maximum_tries, absolutely_required_score=absolutely_required_score)
+        try:
+            for segment in segments:
+                r = segment['request']
+                request_done = segment['is_last'] # true if final clip of this request
+                total_specs, n_passes = segment['total_specs'], segment['n_passes']
                 
-                if self.conf['show_inference_progress']:
-                    time_elapsed = time.time()-show_inference_progress_start
-                    time_per_clip = time_elapsed/(text_index+1)
-                    remaining_files = (total_len-(text_index+1))
-                    eta_finish = (remaining_files*time_per_clip)/60
-                    print(f"{text_index}/{total_len}, {eta_finish:.2f}mins remaining.")
-                    del time_per_clip, eta_finish, remaining_files, time_elapsed
+                # open a new output file if needed
+                if writers[r] is None:
+                    out_name = f"{output_filenames[r]}_{out_count[r]:02}{output_extension}"
+                    out_path = os.path.join(self.conf['output_directory'], out_name)
+                    if os.path.exists(out_path):
+                        print(f"File already found at [{out_path}], overwriting.")
+                        os.remove(out_path)
+                    writers[r] = AudioFileWriter(out_path, segment['sampling_rate'], tmp_dir=self.conf['working_directory'])
+                    out_names[r].append(out_name)
                 
-                audio_seconds_generated = round(audio_len.item()/self.tt_hparams.sampling_rate,3)
-                time_to_gen = round(time.time()-start_time,3)
-                if show_time_to_gen:
-                    print(f"Generated {audio_seconds_generated}s of audio in {time_to_gen}s wall time - so far. (best of {tries.sum().astype('int')} tries this pass)")
+                request_audio_len[r]+=segment['audio_len']
+                request_scores[r]+=[segment['score'],]
+                request_out_bytes[r]+=segment['audio'].nbytes
                 
-                print("\n") # seperate each pass
+                # append audio to output, and finish output file if it's too large or this request is done
+                close = ( request_out_bytes[r]/(1024**3) > self.conf['output_maxsize_gb'] ) or request_done
+                write_queue.put((writers[r], segment['audio'], close))
+                if close:
+                    writers[r] = None
+                    request_out_bytes[r] = 0
+                    out_count[r]+=1
+        finally:
+            segments.close() # (stops the vocoder thread if infer_stream raised)
+            for writer in writers: # close files left open if infer_stream raised
+                if writer is not None:
+                    write_queue.put((writer, None, True))
+            # wait for the remaining audio to be written
+            write_queue.put(None)
+            write_thread.join()
+        if len(write_errors):
+            raise write_errors[0]
         
-        scores = np.stack(scores)
-        avg_score = np.mean(scores)
+        time_to_gen = round(time.time()-start_time,3)
+        outputs = []
+        for r in range(n_requests):
+            audio_seconds_generated = round(float(request_audio_len[r])/self.tt_hparams.sampling_rate,3)
+            avg_score = np.mean(np.stack(request_scores[r]))
+            outputs.append((out_names[r], time_to_gen, audio_seconds_generated, total_specs, n_passes, avg_score))
         
-        return out_name, time_to_gen, audio_seconds_generated, total_specs, n_passes, avg_score
+        return outputs if coalesced else outputs[0]
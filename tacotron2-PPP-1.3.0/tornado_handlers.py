@@ -0,0 +1,93 @@
+import json
+import queue
+import tornado.gen
+import tornado.iostream
+import tornado.web
+from tornado.ioloop import IOLoop
+from audio_writer import wav_header
+
+# native Tornado handlers for the job queue (app.py routes them before the Flask fallback).
+# kept out of app.py so they can be used without loading T2S.
+
+#Stream job status updates as Server-Sent Events (waiting clients don't block the server)
+class JobEventsHandler(tornado.web.RequestHandler):
+    def initialize(self, job_queue, poll_interval=0.5):
+        self.job_queue = job_queue
+        self.poll_interval = poll_interval
+
+    async def get(self, job_id):
+        job = self.job_queue.get(job_id)
+        if job is None:
+            raise tornado.web.HTTPError(404)
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        last_state = None
+        while True:
+            done = job.done_event.is_set() # (checked before the status, so the last event sent is always the finished state)
+            state = json.dumps(self.job_queue.status(job))
+            if state != last_state:
+                self.write(f"data: {state}\n\n")
+                await self.flush()
+                last_state = state
+            if done:
+                break
+            await tornado.gen.sleep(self.poll_interval)
+
+#Stream audio to the client as each segment is generated (chunked WAV, so the response isn't buffered)
+class TTSStreamHandler(tornado.web.RequestHandler):
+    class FormArgs:
+        """Lets parse_tts_form read Tornado's request arguments like a Flask form."""
+        def __init__(self, handler):
+            self.handler = handler
+        def get(self, key, default=None):
+            return self.handler.get_argument(key, default)
+        def getlist(self, key):
+            return self.handler.get_arguments(key)
+    
+    job = None
+    
+    def initialize(self, job_queue, parse_form):
+        self.job_queue = job_queue
+        self.parse_form = parse_form # app.parse_tts_form
+    
+    def on_connection_close(self):
+        if self.job is not None: # client went away, stop generating audio for it
+            self.job_queue.cancel(self.job)
+    
+    def next_chunk(self):
+        """Blocks (on an executor thread) till the next segment is ready. Returns None at the end of the stream or once the job is cancelled."""
+        while not self.job.cancelled.is_set():
+            try:
+                return self.job.chunks.get(timeout=0.5)
+            except queue.Empty:
+                pass
+        return None
+    
+    async def get(self):
+        try:
+            text, params, tt_current, wg_current = self.parse_form(self.FormArgs(self))
+        except (AssertionError, TypeError, ValueError) as ex:
+            raise tornado.web.HTTPError(400, f'{type(ex).__name__}: {ex}')
+        job = self.job = self.job_queue.submit(text, params, tt_current, wg_current, stream=True)
+        print(f"QUEUED STREAM {job.id}\n\n")
+        self.set_header('Content-Type', 'audio/wav')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('X-Job-Id', job.id)
+        sent_header = False
+        try:
+            while True:
+                segment = await IOLoop.current().run_in_executor(None, self.next_chunk)
+                if segment is None: # end of stream
+                    break
+                if not sent_header:
+                    self.write(wav_header(segment['sampling_rate']))
+                    sent_header = True
+                self.write(segment['audio'].tobytes())
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            self.job_queue.cancel(job)
+            return
+        if job.status == 'failed' and not sent_header:
+            raise tornado.web.HTTPError(500, job.error)
+    
+    post = get
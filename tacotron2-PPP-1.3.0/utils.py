@@ -6,7 +6,7 @@ import torch
 def get_mask_from_lengths(lengths, max_len=None):
     if not max_len:
         max_len = int(torch.max(lengths).item())
-    ids = torch.arange(0, max_len, out=torch.cuda.LongTensor(max_len))
+    ids = torch.arange(0, max_len, device=lengths.device, dtype=torch.long)
     mask = (ids < lengths.unsqueeze(1))
     return mask
 
@@ -0,0 +1,154 @@
+import json
+import argparse
+import torch
+from torch import nn
+from efficient_util import remove_weight_norms
+
+
+def fold_weight_norms(waveglow):
+    """Remove weight norm from every layer (weight = g*v/|v| is computed once instead of on every forward)."""
+    waveglow.apply(remove_weight_norms)
+    return waveglow
+
+
+def is_pointwise(conv):
+    return conv.kernel_size == (1,) and conv.stride == (1,) and conv.padding == (0,) and conv.dilation == (1,) and conv.groups == 1
+
+
+def merge_convs(conv_a, conv_b):
+    """Returns a single Conv1d equal to conv_b(conv_a(x)). conv_b must be a 1x1 conv."""
+    w_a, w_b = conv_a.weight.data.double(), conv_b.weight.data.double()[:, :, 0] # [hidden, in, k], [out, hidden]
+    merged = nn.Conv1d(conv_a.in_channels, conv_b.out_channels, conv_a.kernel_size, stride=conv_a.stride, padding=conv_a.padding,
+                       dilation=conv_a.dilation, groups=conv_a.groups, bias=True, padding_mode=conv_a.padding_mode)
+    merged.weight.data = torch.einsum('oh,hik->oik', w_b, w_a).to(conv_a.weight.dtype)
+    bias = conv_b.bias.data.double() if conv_b.bias is not None else w_b.new_zeros(conv_b.out_channels)
+    if conv_a.bias is not None:
+        bias = bias + w_b @ conv_a.bias.data.double()
+    merged.bias.data = bias.to(conv_a.weight.dtype)
+    return merged.to(conv_a.weight.device)
+
+
+def merge_cond_layers(cond_layers):
+    """
+    cond_layers are applied one after another with no activation in between, so a 1x1 conv can be merged into the conv before it.
+    Layers are only merged when the merged conv needs fewer multiply-adds than the two convs it replaces.
+    Weight norm must be removed first.
+    """
+    layers = list(cond_layers)
+    merged_layers = [layers[0],] if len(layers) else []
+    for layer in layers[1:]:
+        prev = merged_layers[-1]
+        if is_pointwise(layer) and prev.groups == 1 and not hasattr(prev, 'weight_g') and not hasattr(layer, 'weight_g'):
+            k = prev.kernel_size[0]
+            cost_before = prev.out_channels*prev.in_channels*k + layer.out_channels*layer.in_channels
+            cost_after = layer.out_channels*prev.in_channels*k
+            if cost_after <= cost_before:
+                merged_layers[-1] = merge_convs(prev, layer)
+                continue
+        merged_layers.append(layer)
+    return nn.ModuleList(merged_layers)
+
+
+def precompute_W_inverse(waveglow):
+    """Store the inverse of every invertible 1x1 conv as a buffer (so it's saved with the state_dict and moved/cast with the model)."""
+    for module in waveglow.modules():
+        if type(module).__name__ in ('Invertible1x1Conv', 'InvertibleConv1x1'):
+            W = (module.conv.weight if hasattr(module, 'conv') else module.weight).data.squeeze()
+            W_inverse = W.double().inverse().to(W.dtype)[..., None]
+            if 'W_inverse' in module.__dict__: # (plain attribute from a previous inverse())
+                del module.__dict__['W_inverse']
+            module.register_buffer('W_inverse', W_inverse)
+    return waveglow
+
+
+def prepare_inference_waveglow(waveglow):
+    """
+    Convert a WaveGlow model (any of the glow.py/efficient_model.py/efficient_model_ax.py cores) into it's inference form.
+    Weight norm is folded, cond_layers are merged where possible and W_inverse is precomputed.
+    Exported checkpoints (see export_waveglow()) can only be loaded into a model that has been through this function.
+    """
+    waveglow = fold_weight_norms(waveglow)
+    for module in list(waveglow.modules()):
+        if isinstance(getattr(module, 'cond_layers', None), nn.ModuleList) and all(isinstance(layer, nn.Conv1d) for layer in module.cond_layers):
+            module.cond_layers = merge_cond_layers(module.cond_layers)
+    waveglow = precompute_W_inverse(waveglow)
+    for module in waveglow.modules():
+        if hasattr(module, 'param_list'): # memory efficient AffineCouplingBlock keeps a list of it's WN parameters
+            module.param_list = list(module.WN.parameters())
+    return waveglow.eval()
+
+
+def load_waveglow_model(checkpoint, config_fpath):
+    """Initialize the WaveGlow core described by config_fpath and load checkpoint (normal or exported)."""
+    with open(config_fpath) as f:
+        config = json.load(f)
+    waveglow_config = {
+        **config["waveglow_config"],
+        'win_length': config["data_config"]['win_length'],
+        'hop_length': config["data_config"]['hop_length']
+    }
+    if 'upsample_first' in waveglow_config.keys():
+        from efficient_model_ax import WaveGlow
+    elif waveglow_config["yoyo"]:
+        from efficient_model import WaveGlow
+    else:
+        from glow import WaveGlow
+    waveglow = WaveGlow(**waveglow_config)
+    if checkpoint.get('inference_export', False):
+        waveglow = prepare_inference_waveglow(waveglow)
+    waveglow.load_state_dict(checkpoint['model'])
+    return waveglow
+
+
+def export_waveglow(checkpoint_path, config_fpath, output_path):
+    """Save the inference form of a WaveGlow checkpoint (same format as the training checkpoints + 'inference_export' key)."""
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    waveglow = load_waveglow_model(checkpoint, config_fpath)
+    n_params = sum(p.numel() for p in waveglow.parameters())
+    waveglow = prepare_inference_waveglow(waveglow)
+    print(f"{n_params} -> {sum(p.numel() for p in waveglow.parameters())} parameters")
+    torch.save({'model': waveglow.state_dict(),
+                'iteration': checkpoint['iteration'],
+                'speaker_lookup': checkpoint['speaker_lookup'],
+                'inference_export': True,}, output_path)
+    print(f"Saved exported WaveGlow to '{output_path}'")
+    return waveglow
+
+
+@torch.no_grad()
+def check_accuracy(waveglow, exported, n_mel_channels=160, n_frames=200, speaker_id=0, seed=1234):
+    """Vocode the same random spectrogram and noise with both models and print the max/mean absolute difference of the audio."""
+    torch.manual_seed(seed)
+    spect = torch.randn(1, n_mel_channels, n_frames)*2.0-6.0
+    speaker_ids = torch.LongTensor([speaker_id])
+    audio = {}
+    for name, model in (('original', waveglow), ('exported', exported)):
+        torch.manual_seed(seed)
+        audio[name] = model.infer(spect, speaker_ids, sigma=0.8)
+    diff = (audio['original']-audio['exported']).abs()
+    print(f"max abs diff {diff.max().item():.2e}, mean abs diff {diff.mean().item():.2e}")
+    return diff.max().item()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--waveglow_path', type=str, required=True,
+                        help='WaveGlow checkpoint to export')
+    parser.add_argument('-c', '--config', type=str, required=True,
+                        help='JSON file for the WaveGlow configuration')
+    parser.add_argument('-o', '--output_path', type=str, default=None,
+                        required=False, help='where to save the exported checkpoint (default: waveglow_path+"_inference")')
+    parser.add_argument('--check', action='store_true',
+                        help='Compare the audio of the exported model against the original model.')
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    output_path = args.output_path or args.waveglow_path+"_inference"
+    exported = export_waveglow(args.waveglow_path, args.config, output_path)
+
+    if args.check: # reload the original model (prepare_inference_waveglow modifies the model in-place)
+        checkpoint = torch.load(args.waveglow_path, map_location='cpu')
+        waveglow = load_waveglow_model(checkpoint, args.config).eval()
+        with open(args.config) as f:
+            n_mel_channels = json.load(f)["waveglow_config"]["n_mel_channels"]
+        check_accuracy(waveglow, exported, n_mel_channels=n_mel_channels)
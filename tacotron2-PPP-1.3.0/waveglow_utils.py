@@ -37,3 +37,56 @@ class InversePreEmphasis(torch.nn.Module):
     def forward(self, input: torch.tensor) -> torch.tensor:
         x, _ = self.rnn(input.transpose(1, 2))
         return x.transpose(1, 2)
+
+
+@torch.no_grad()
+def chunked_infer(waveglow, mels, speaker_ids, hop_length, sigma=1.0, chunk_frames=256, overlap_frames=16, max_batch_size=64, pad_value=-11.512925):
+    """
+    Vocode a list of spectrograms in fixed size overlapping windows.
+    Every window is the same length so windows from different spectrograms (e.g. different requests) can be packed into the same
+    WaveGlow batch without padding, and VRAM usage depends on max_batch_size*chunk_frames instead of the longest spectrogram.
+    Neighbouring windows overlap by overlap_frames and are linearly crossfaded together.
+    
+    PARAMS:
+    mels: list of [n_mel, T] spectrograms (without padding)
+    speaker_ids: LongTensor [len(mels)] of WaveGlow speaker ids
+    hop_length: samples per spectrogram frame
+    
+    RETURNS:
+    list of [T*hop_length] audio tensors
+    """
+    window_frames = chunk_frames + overlap_frames
+    
+    # split every spectrogram into windows
+    windows, window_info = [], [] # window_info = (mel_index, start_frame, n_frames)
+    for i, mel in enumerate(mels):
+        n_frames = mel.size(1)
+        for start in range(0, max(n_frames-overlap_frames, 1), chunk_frames):
+            window = mel[:, start:start+window_frames]
+            window_info.append((i, start, window.size(1)))
+            if window.size(1) < window_frames: # pad the last window of each spectrogram
+                window = F.pad(window, (0, window_frames-window.size(1)), value=pad_value)
+            windows.append(window)
+    
+    # vocode windows in batches
+    window_audio = []
+    for b in range(0, len(windows), max_batch_size):
+        batch = torch.stack(windows[b:b+max_batch_size])
+        batch_speaker_ids = speaker_ids[[info[0] for info in window_info[b:b+max_batch_size]]]
+        window_audio.extend(waveglow.infer(batch, batch_speaker_ids, sigma=sigma).split(1, dim=0)) # (positional, the glow.py cores call it speaker_id)
+    
+    # crossfade windows back together
+    overlap = overlap_frames*hop_length
+    fade_in = torch.linspace(0.0, 1.0, overlap+2, device=mels[0].device)[1:-1] if overlap else None
+    outputs = [mel.new_zeros(mel.size(1)*hop_length, dtype=torch.float) for mel in mels]
+    for (i, start, n_frames), audio in zip(window_info, window_audio):
+        audio = audio.view(-1)[:n_frames*hop_length].float()
+        start_sample = start*hop_length
+        if overlap and start > 0: # fade in over the end of the previous window
+            audio = audio.clone()
+            audio[:overlap] *= fade_in
+        if overlap and start_sample+audio.size(0) < outputs[i].size(0): # fade out if another window follows
+            audio = audio.clone()
+            audio[-overlap:] *= fade_in.flip(0)
+        outputs[i][start_sample:start_sample+audio.size(0)] += audio
+    return outputs